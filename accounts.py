@@ -0,0 +1,149 @@
+# accounts.py
+"""Customer account view: summary, loan and fine history, holds, registrations.
+
+Each part is one indexed query however long the history is - loans come
+with their item and fine columns joined in, not looked up per loan. The
+summary (balance, open loans, what is due soon) is cached per customer
+under that customer's data version, the 'customer:<id>' counter that
+triggers on borrowing, fines, register, event_waitlist, item_holds and
+customers bump in the same transaction as the write. A borrow, a return or
+a fine being assessed therefore shows up on the next page view, and other
+customers' cached summaries are left alone.
+"""
+from datetime import date, timedelta
+
+from flask import current_app
+
+from cache import data_versions, get_cache
+
+DUE_SOON_DAYS = 3
+OPEN_LOANS_SHOWN = 100  # an account with more is shown the ones due first
+REGISTRATIONS_SHOWN = 50
+
+
+def version_name(customer_id):
+    """The data_versions counter for one customer's rows."""
+    return f'customer:{customer_id}'
+
+
+def summary(conn, customer_id, today=None):
+    """The account summary for customer_id, or None if there is no such customer.
+
+    A dict with the customer's details, balance, counts and their open loans
+    (due date order); `due_soon` is the part of those due within
+    DUE_SOON_DAYS, `overdue` the part already late.
+    """
+    today = today or date.today().isoformat()
+    use_cache = current_app.config['RESPONSE_CACHE_ENABLED']
+    if use_cache:
+        # The date is in the key because "due soon" moves with it
+        key = ('account_summary', customer_id, today,
+               data_versions(conn, (version_name(customer_id),)))
+        cached = get_cache().get(key)
+        if cached is not None:
+            return cached
+
+    account = _load_summary(conn, customer_id, today)
+    if use_cache and account is not None:
+        get_cache().set(key, account)
+    return account
+
+
+def _load_summary(conn, customer_id, today):
+    customer = conn.execute('''
+        SELECT c.customer_id, c.name, c.email, c.phone, c.outstanding_fine_balance,
+               (SELECT COUNT(*) FROM fines f
+                WHERE f.customer_id = c.customer_id AND f.fine_status = 'Unpaid') AS unpaid_fines,
+               (SELECT COUNT(*) FROM register r WHERE r.customer_id = c.customer_id) AS registrations,
+               (SELECT COUNT(*) FROM event_waitlist w WHERE w.customer_id = c.customer_id) AS waitlisted,
+               (SELECT COUNT(*) FROM item_holds h
+                WHERE h.customer_id = c.customer_id AND h.status = 'Ready') AS holds_ready
+        FROM customers c WHERE c.customer_id = ?
+    ''', (customer_id,)).fetchone()
+    if customer is None:
+        return None
+
+    open_loans = [dict(row) for row in conn.execute('''
+        SELECT b.transaction_id, b.item_id, i.title, i.item_type, b.borrowed_date, b.due_date
+        FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+        WHERE b.customer_id = ? AND b.returned_date IS NULL
+        ORDER BY b.due_date, b.transaction_id LIMIT ?
+    ''', (customer_id, OPEN_LOANS_SHOWN))]
+    soon = (date.fromisoformat(today) + timedelta(days=DUE_SOON_DAYS)).isoformat()
+
+    account = dict(customer)
+    account['balance'] = account.pop('outstanding_fine_balance')
+    account['open_loans'] = open_loans
+    account['overdue'] = [loan for loan in open_loans if loan['due_date'] and loan['due_date'] < today]
+    account['due_soon'] = [loan for loan in open_loans
+                           if loan['due_date'] and today <= loan['due_date'] <= soon]
+    return account
+
+
+def loan_history(conn, customer_id, before=None, limit=25):
+    """One page of a customer's loans, newest first, with any fine on each.
+
+    `before` is the (borrowed_date, transaction_id) cursor of the last row of
+    the previous page. Returns (rows, next_cursor); next_cursor is None on
+    the last page.
+    """
+    conditions, params = ['b.customer_id = ?'], [customer_id]
+    if before is not None:
+        conditions.append('(b.borrowed_date, b.transaction_id) < (?, ?)')
+        params.extend(before)
+    rows = conn.execute(f'''
+        SELECT b.transaction_id, b.item_id, i.title, b.borrowed_date, b.due_date, b.returned_date,
+               (SELECT SUM(f.amount_of_fine) FROM fines f
+                WHERE f.transaction_id = b.transaction_id) AS fine,
+               (SELECT SUM(f.amount_of_fine) FROM fines f
+                WHERE f.transaction_id = b.transaction_id AND f.fine_status = 'Unpaid') AS fine_unpaid
+        FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY b.borrowed_date DESC, b.transaction_id DESC LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1]['borrowed_date'], rows[-1]['transaction_id'])
+
+
+def registrations(conn, customer_id, limit=REGISTRATIONS_SHOWN):
+    """A customer's event registrations and waitlist places, latest event first."""
+    return conn.execute('''
+        SELECT e.event_id, e.event_name, e.datetime, e.location,
+               'registered' AS status, NULL AS position
+        FROM register r JOIN events e ON e.event_id = r.event_id
+        WHERE r.customer_id = ?
+        UNION ALL
+        SELECT e.event_id, e.event_name, e.datetime, e.location, 'waitlisted',
+               (SELECT COUNT(*) FROM event_waitlist ahead
+                WHERE ahead.event_id = w.event_id AND ahead.waitlist_id <= w.waitlist_id)
+        FROM event_waitlist w JOIN events e ON e.event_id = w.event_id
+        WHERE w.customer_id = ?
+        ORDER BY datetime DESC LIMIT ?
+    ''', (customer_id, customer_id, limit)).fetchall()
+
+
+def holds(conn, customer_id):
+    """A customer's holds: Ready ones with their pickup date, Waiting ones with their place in line."""
+    return conn.execute('''
+        SELECT h.item_id, i.title, h.status, h.ready_until,
+               CASE WHEN h.status = 'Waiting' THEN
+                   (SELECT COUNT(*) FROM item_holds ahead
+                    WHERE ahead.item_id = h.item_id AND ahead.status = 'Waiting'
+                      AND ahead.hold_id <= h.hold_id)
+               END AS position
+        FROM item_holds h JOIN library_items i ON i.item_id = h.item_id
+        WHERE h.customer_id = ?
+        ORDER BY h.status = 'Waiting', h.hold_id
+    ''', (customer_id,)).fetchall()
+
+
+def encode_cursor(cursor):
+    return f"{cursor[0]}|{cursor[1]}" if cursor else None
+
+
+def decode_cursor(value):
+    """'borrowed_date|transaction_id' from a page link -> tuple, or None."""
+    when, _, tid = (value or '').rpartition('|')
+    return (when, int(tid)) if when and tid.isdigit() else None
@@ -0,0 +1,397 @@
+# api.py
+"""JSON API for kiosks and sync jobs, mounted at /api/v1.
+
+Collections are returned compactly as {"columns": [...], "rows": [[...]]}
+with a "next" keyset cursor; single records as objects. Read endpoints send
+an ETag derived from the data_versions counters of the tables they read, so
+a client repeating a request with If-None-Match gets 304 without the query
+running. The batch endpoints borrow or return many items in one transaction.
+"""
+import functools
+import hashlib
+import json
+
+from flask import Blueprint, Response, current_app, request
+
+import accounts
+from cache import data_versions
+from circulation import CirculationError, borrow_many, parse_id, return_many
+from db import get_db
+from holds import HoldError, cancel_hold, place_hold
+from recommend import also_borrowed, recommended_for
+from registrations import RegistrationError, cancel, register, seats_left
+from search import correct_query, facet_counts, facet_where, search_items, selected_facets
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _json(payload, status=200):
+    return Response(json.dumps(payload, separators=(',', ':')), status=status,
+                    mimetype='application/json')
+
+
+def _rows(rows, columns, key=None):
+    """Compact payload for a list of rows; with `key`, adds the keyset cursor
+    for the next page (None on the last page)."""
+    payload = {'columns': list(columns), 'rows': [tuple(row) for row in rows]}
+    if key is not None:
+        payload['next'] = rows[-1][key] if rows and len(rows) == _limit() else None
+    return payload
+
+
+def _query(sql, params, key=None):
+    cursor = get_db().execute(sql, params)
+    rows = cursor.fetchall()
+    return _rows(rows, [d[0] for d in cursor.description], key)
+
+
+def _limit():
+    try:
+        limit = int(request.args.get('limit', current_app.config['API_PAGE_SIZE']))
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    return max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+
+def _after():
+    try:
+        return int(request.args.get('after', 0))
+    except ValueError:
+        raise ApiError("after must be an integer")
+
+
+def _id_list(values, name):
+    """Validates a batch of ids from a query string or JSON body."""
+    if isinstance(values, str):
+        values = [v for v in values.split(',') if v.strip()]
+    if not isinstance(values, list) or not values:
+        raise ApiError(f"{name} must be a non-empty list of ids")
+    if len(values) > current_app.config['API_BATCH_LIMIT']:
+        raise ApiError(f"at most {current_app.config['API_BATCH_LIMIT']} {name} per request")
+    try:
+        return [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise ApiError(f"{name} must be integers")
+
+
+def _by_ids(table, key, ids):
+    placeholders = ', '.join('?' for _ in ids)
+    return _query(f"SELECT * FROM {table} WHERE {key} IN ({placeholders}) ORDER BY {key}", ids)
+
+
+def _one(table, key, value):
+    row = get_db().execute(f"SELECT * FROM {table} WHERE {key} = ?", (value,)).fetchone()
+    if row is None:
+        raise ApiError(f"{table} {value} not found", 404)
+    return dict(row)
+
+
+def _body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError("expected a JSON object")
+    return body
+
+
+def conditional(*tables):
+    """Answers GETs with an ETag built from the data versions of `tables`.
+
+    A table may also be a function of the view's arguments returning a
+    counter name, e.g. the customer's own counter (accounts.version_name).
+    A matching If-None-Match gets 304 before the view runs.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            names = tuple(name(**kwargs) if callable(name) else name for name in tables)
+            versions = data_versions(get_db(), names)
+            etag = hashlib.blake2b(repr((request.full_path, versions)).encode(),
+                                   digest_size=12).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response):
+                    response = _json(response)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+@api.errorhandler(ApiError)
+@api.errorhandler(CirculationError)
+@api.errorhandler(RegistrationError)
+@api.errorhandler(HoldError)
+def api_error(e):
+    return _json({'error': str(e)}, e.status)
+
+
+# -----------------------------------------------------
+# ITEMS
+# -----------------------------------------------------
+@api.route('/items')
+@conditional('library_items')
+def items():
+    """?q= searches (best match first, with misspellings corrected if nothing
+    matches); ?ids=1,2,3 looks up a batch; otherwise pages by item_id with
+    ?after= and ?limit=. Searches and pages can be filtered by facet, e.g.
+    ?genre=Fiction&format=Audio."""
+    limit = _limit()
+    filters = selected_facets(request.args)
+    if request.args.get('q'):
+        rows = search_items(get_db(), request.args['q'], limit, filters)
+        corrected = None
+        if not rows:
+            corrected = correct_query(get_db(), request.args['q'])
+            if corrected:
+                rows = search_items(get_db(), corrected, limit, filters)
+        payload = _rows(rows, rows[0].keys() if rows else ())
+        payload['corrected'] = corrected
+        return payload
+    if request.args.get('ids'):
+        return _by_ids('library_items', 'item_id', _id_list(request.args['ids'], 'ids'))
+    where, params = facet_where(filters)
+    return _query(f"SELECT * FROM library_items WHERE item_id > ? {'AND ' + where if where else ''} "
+                  "ORDER BY item_id LIMIT ?", [_after()] + params + [limit], key='item_id')
+
+
+@api.route('/items/facets')
+@conditional('library_items')
+def item_facets():
+    """{facet: [[value, items], ...]} over the whole catalog."""
+    return facet_counts(get_db())
+
+
+@api.route('/items/<int:item_id>')
+@conditional('library_items')
+def item(item_id):
+    return _one('library_items', 'item_id', item_id)
+
+
+@api.route('/items/<int:item_id>/also-borrowed')
+@conditional('item_neighbors', 'library_items')
+def item_also_borrowed(item_id):
+    """Items most often borrowed along with this one, best first."""
+    cur = get_db().cursor()
+    rows = also_borrowed(cur, item_id, _limit())
+    return _rows(rows, [d[0] for d in cur.description])
+
+
+@api.route('/items/<int:item_id>/holds')
+def item_holds(item_id):
+    """The item's queue of waiting holds, head first; pages by hold_id."""
+    return _query('''
+        SELECT hold_id, customer_id, placed_at FROM item_holds
+        WHERE item_id = ? AND status = 'Waiting' AND hold_id > ? ORDER BY hold_id LIMIT ?
+    ''', (item_id, _after(), _limit()), key='hold_id')
+
+
+@api.route('/items/<int:item_id>/holds', methods=['POST'])
+def place_item_hold(item_id):
+    """{"customer_id": 1} - 201 with the place in the queue."""
+    hold_id, position = place_hold(get_db(), item_id, _body().get('customer_id'))
+    return _json({'hold_id': hold_id, 'position': position}, 201)
+
+
+@api.route('/items/<int:item_id>/holds/<int:customer_id>', methods=['DELETE'])
+def cancel_item_hold(item_id, customer_id):
+    """Cancels the hold; a copy it was holding goes to the next in line."""
+    return _json({'held_for': cancel_hold(get_db(), item_id, customer_id)})
+
+
+# -----------------------------------------------------
+# EVENTS
+# -----------------------------------------------------
+@api.route('/events')
+@conditional('events')
+def events():
+    if request.args.get('ids'):
+        return _by_ids('events', 'event_id', _id_list(request.args['ids'], 'ids'))
+    return _query("SELECT * FROM events WHERE event_id > ? ORDER BY event_id LIMIT ?",
+                  (_after(), _limit()), key='event_id')
+
+
+@api.route('/events/<int:event_id>')
+@conditional('events')
+def event(event_id):
+    return _one('events', 'event_id', event_id)
+
+
+@api.route('/events/<int:event_id>/seats')
+@conditional('events')
+def event_seats(event_id):
+    event = _one('events', 'event_id', event_id)
+    return {'event_id': event_id, 'capacity': event['capacity'],
+            'registered': event['registered_count'], 'seats_left': seats_left(event)}
+
+
+@api.route('/events/<int:event_id>/registrations', methods=['POST'])
+def register_for_event(event_id):
+    """{"customer_id": 1, "waitlist": true} - 201 with a seat, 200 when waitlisted."""
+    body = _body()
+    status, position = register(get_db(), event_id, body.get('customer_id'),
+                                waitlist=body.get('waitlist', True))
+    return _json({'status': status, 'waitlist_position': position}, 201 if position is None else 200)
+
+
+@api.route('/events/<int:event_id>/registrations/<int:customer_id>', methods=['DELETE'])
+def cancel_registration(event_id, customer_id):
+    """Frees the seat (or waitlist place); the next customer waiting gets it."""
+    return _json({'promoted_customer_id': cancel(get_db(), event_id, customer_id)})
+
+
+# -----------------------------------------------------
+# CUSTOMERS
+# -----------------------------------------------------
+@api.route('/customers/<int:customer_id>')
+@conditional('customers')
+def customer(customer_id):
+    return _one('customers', 'customer_id', customer_id)
+
+
+@api.route('/customers/<int:customer_id>/summary')
+def customer_summary(customer_id):
+    """Balance, counts and open loans (not ETagged: "due soon" moves with the date)."""
+    summary = accounts.summary(get_db(), customer_id)
+    if summary is None:
+        raise ApiError(f"customers {customer_id} not found", 404)
+    return _json(summary)
+
+
+@api.route('/customers/<int:customer_id>/history')
+@conditional(accounts.version_name)
+def customer_history(customer_id):
+    """Loans newest first with their fines; page with ?before=<next>."""
+    before = request.args.get('before')
+    cursor = accounts.decode_cursor(before)
+    if before and cursor is None:
+        raise ApiError("before must be a cursor from a previous page")
+    cur = get_db().cursor()
+    rows, next_cursor = accounts.loan_history(cur, customer_id, before=cursor, limit=_limit())
+    payload = _rows(rows, [d[0] for d in cur.description])
+    payload['next'] = accounts.encode_cursor(next_cursor)
+    return payload
+
+
+@api.route('/customers/<int:customer_id>/registrations')
+@conditional(accounts.version_name)
+def customer_registrations(customer_id):
+    cur = get_db().cursor()
+    rows = accounts.registrations(cur, customer_id)
+    return _rows(rows, [d[0] for d in cur.description])
+
+
+@api.route('/customers/<int:customer_id>/recommendations')
+@conditional('item_neighbors', 'library_items', accounts.version_name)
+def customer_recommendations(customer_id):
+    """Items the customer has not borrowed yet, from their recent loans and preferences."""
+    if get_db().execute("SELECT 1 FROM customers WHERE customer_id = ?", (customer_id,)).fetchone() is None:
+        raise ApiError(f"customers {customer_id} not found", 404)
+    rows = recommended_for(get_db(), customer_id, _limit())
+    return _rows(rows, rows[0].keys() if rows else [])
+
+
+@api.route('/customers/<int:customer_id>/transactions')
+@conditional(accounts.version_name)
+def customer_transactions(customer_id):
+    """A customer's loans by transaction_id; ?open=1 for unreturned only."""
+    open_only = 'AND returned_date IS NULL' if request.args.get('open') else ''
+    return _query(f'''
+        SELECT * FROM borrowing
+        WHERE customer_id = ? AND transaction_id > ? {open_only}
+        ORDER BY transaction_id LIMIT ?
+    ''', (customer_id, _after(), _limit()), key='transaction_id')
+
+
+# -----------------------------------------------------
+# TRANSACTIONS
+# -----------------------------------------------------
+@api.route('/transactions')
+@conditional('borrowing')
+def transactions():
+    """?ids=1,2,3 looks up a batch; otherwise pages by transaction_id."""
+    if request.args.get('ids'):
+        return _by_ids('borrowing', 'transaction_id', _id_list(request.args['ids'], 'ids'))
+    return _query("SELECT * FROM borrowing WHERE transaction_id > ? ORDER BY transaction_id LIMIT ?",
+                  (_after(), _limit()), key='transaction_id')
+
+
+@api.route('/transactions/<int:transaction_id>')
+@conditional('borrowing')
+def transaction(transaction_id):
+    return _one('borrowing', 'transaction_id', transaction_id)
+
+
+# -----------------------------------------------------
+# BATCH BORROW / RETURN
+# -----------------------------------------------------
+def _batch_response(entries, results, identify, describe):
+    """One result object per request entry: identify(entry) plus either
+    describe(result) or the error and its status."""
+    out, failed = [], 0
+    for entry, (result, error) in zip(entries, results):
+        fields = identify(entry)
+        if error is None:
+            fields.update(describe(result))
+        else:
+            failed += 1
+            fields.update(error=str(error), status=error.status)
+        out.append(fields)
+    return _json({'succeeded': len(out) - failed, 'failed': failed, 'results': out})
+
+
+@api.route('/borrow', methods=['POST'])
+def borrow_batch():
+    """{"borrowed_date": "YYYY-MM-DD", "loans": [{"item_id": 1, "customer_id": 2}, ...]}
+
+    All loans are made in one transaction; a loan that cannot be made (item
+    out, unknown customer) is reported in its result and the rest go ahead.
+    """
+    body = _body()
+    loans = body.get('loans')
+    if not isinstance(loans, list) or not loans:
+        raise ApiError("loans must be a non-empty list")
+    if len(loans) > current_app.config['API_BATCH_LIMIT']:
+        raise ApiError(f"at most {current_app.config['API_BATCH_LIMIT']} loans per request")
+    try:
+        pairs = [(parse_id(loan['item_id'], 'item_id'), parse_id(loan['customer_id'], 'customer_id'))
+                 for loan in loans]
+    except (TypeError, KeyError):
+        raise ApiError("each loan needs an item_id and a customer_id")
+
+    results = borrow_many(get_db(), pairs, body.get('borrowed_date'))
+    return _batch_response(
+        pairs, results,
+        lambda pair: {'item_id': pair[0], 'customer_id': pair[1]},
+        lambda result: {'transaction_id': result[0], 'due_date': result[1]})
+
+
+@api.route('/return', methods=['POST'])
+def return_batch():
+    """{"returned_date": "YYYY-MM-DD", "transaction_ids": [1, 2, ...]}
+
+    All returns are made in one transaction; unknown or already returned
+    loans are reported in their result.
+    """
+    body = _body()
+    transaction_ids = _id_list(body.get('transaction_ids'), 'transaction_ids')
+    results = return_many(get_db(), transaction_ids, body.get('returned_date'))
+    return _batch_response(
+        transaction_ids, results,
+        lambda transaction_id: {'transaction_id': transaction_id},
+        lambda result: {'amount_of_fine': result[0], 'held_for': result[1]})
+
+
+def init_app(app):
+    app.config.setdefault('API_PAGE_SIZE', 100)
+    app.config.setdefault('API_MAX_PAGE_SIZE', 1000)
+    app.config.setdefault('API_BATCH_LIMIT', 500)
+    app.register_blueprint(api)
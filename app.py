@@ -1,18 +1,53 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import (Flask, Response, render_template, request, redirect, stream_with_context, url_for, flash,
+                   jsonify, g, session)
 import sqlite3
+import io
 import os
-from datetime import datetime, timedelta
+import accounts
+import api
+import cache
+import db
+import instrument
+import reporting
+from bulk_import import (BulkImportError, add_item, detect_format, import_items,
+                         restore_index_maintenance)
+from cache import cached_view, get_cache
+from circulation import AlreadyReturned, CirculationError, borrow, return_loan
+from holds import HoldError, place_hold
+from db import get_db, get_pool, configure_storage, write_db, write_stats
+from eligibility import eligibility
+from migrations import current_version, latest_version, migrate
+from recommend import also_borrowed, recommended_for
+from registrations import WAITLISTED, RegistrationError, register, seats_left
+from search import correct_query, facet_counts, facet_where, search_items, selected_facets
 
 # Flask config
 app = Flask(__name__)
 app.secret_key = 'some_random_secret_key'
+app.config['SEARCH_LIMIT'] = 100  # max rows returned by a catalog search
+app.config['PAGE_SIZE'] = 25  # rows per page on /items and /events
+app.config['SHOW_TOTAL_COUNT'] = True  # show "N items" on listing pages
+app.config['COUNT_CACHE_SECONDS'] = 60  # how long a total count is reused
+app.config['COUNT_CACHE_SIZE'] = 256  # listing totals kept in memory
+app.config['IMPORT_CHUNK_SIZE'] = 10000  # rows per transaction in /import
 
 DATABASE = 'library.db'
+app.config['DATABASE'] = DATABASE
+app.config['DB_POOL_SIZE'] = 8  # max open connections per process
+db.init_app(app)
+cache.init_app(app)
+api.init_app(app)
+instrument.init_app(app)
+app.config['RESPONSE_CACHE_SIZE'] = 512  # rendered pages kept in memory
+
+# Audiences offered as filters on /events (events.targeted_customers)
+EVENT_AUDIENCES = ['All Ages', 'Adults', 'Teens', 'Kids']
 
 def init_db():
     """Creates the tables in library.db if they don't exist."""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    configure_storage(conn, app.config)
     c = conn.cursor()
 
     # 1) customers table
@@ -173,14 +208,148 @@ def init_db():
     ''')
 
     conn.commit()
+
+    # Indexes and later schema changes, applied once per database file
+    migrate(conn)
+    conn.close()
+
+def setup_schema():
+    """Runs init_db unless the database is already fully migrated.
+
+    Returns True if init_db ran. A database at the latest migration has all
+    the tables and triggers, so restarts skip re-running every CREATE. The
+    journal mode is set either way: a file upgraded by migrations.py or
+    built by backup.py restore starts out in rollback-journal mode. Indexes
+    left dropped by a bulk import that did not finish are put back.
+    """
+    if os.path.exists(app.config['DATABASE']):
+        conn = sqlite3.connect(app.config['DATABASE'])
+        try:
+            if current_version(conn) >= latest_version():
+                configure_storage(conn, app.config)
+                restore_index_maintenance(conn)
+                return False
+        finally:
+            conn.close()
+    init_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    restore_index_maintenance(conn)
     conn.close()
+    return True
+
+def create_app(config=None):
+    """Returns the app configured with `config` and its schema set up.
+
+    The routes are registered on the module-level app, so this configures
+    that app rather than building a second one. Entry points (serve.py,
+    asgi.py, app.run below) call it once, before any worker starts.
+    """
+    if config:
+        app.config.update(config)
+    setup_schema()
+    return app
 
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Returns this request's pooled connection; it is released on teardown."""
+    return get_db()
+
+def signed_in():
+    """(customer_id, age, fine blocked) for the customer signed in to this session, or None."""
+    if 'signed_in' not in g:
+        customer_id = session.get('customer_id')
+        allowed = eligibility(get_db_connection(), customer_id) if customer_id else None
+        g.signed_in = (customer_id, *allowed) if allowed else None
+    return g.signed_in
+
+def signed_in_key():
+    """What a listing shown to the signed-in customer depends on; part of its cache key."""
+    customer = signed_in()
+    return customer[1:] if customer else None
+
+def get_count_cache():
+    """Listing totals, bounded and shared by the request threads."""
+    counts = app.extensions.get('count_cache')
+    if counts is None:
+        counts = app.extensions.setdefault('count_cache', cache.ResponseCache(
+            app.config['COUNT_CACHE_SIZE'], app.config['COUNT_CACHE_SECONDS']))
+    return counts
+
+def cached_count(conn, table, where='', params=(), tables=None):
+    """Returns COUNT(*) for a listing, reusing it until `tables` change.
+
+    `tables` are the data_versions names the count depends on (default:
+    table itself). A count is also recomputed after COUNT_CACHE_SECONDS, for
+    views such as upcoming_events that change as time passes.
+    """
+    if not app.config['SHOW_TOTAL_COUNT']:
+        return None
+    key = (table, where, tuple(params), cache.data_versions(conn, tables or (table,)))
+    counts = get_count_cache()
+    count = counts.get(key)
+    if count is None:
+        c = conn.cursor()
+        c.execute(f"SELECT COUNT(*) FROM {table} {'WHERE ' + where if where else ''}", params)
+        count = c.fetchone()[0]
+        counts.set(key, count)
+    return count
+
+def fetch_page(conn, table, key, after=None, before=None, where='', params=()):
+    """Keyset pagination over table ordered by its key column(s).
+
+    `key` is a column name, or a tuple of columns ending in a unique one
+    (e.g. ('datetime', 'event_id')), in which case cursors are tuples too.
+    Only one of `after` / `before` is used: the page starts just past the
+    `after` key, or ends just before the `before` key. Returns
+    (rows, prev_cursor, next_cursor); a cursor is None if there is no page in
+    that direction.
+    """
+    page_size = app.config['PAGE_SIZE']
+    columns = (key,) if isinstance(key, str) else tuple(key)
+    if len(columns) == 1:
+        key_expr, placeholder = columns[0], '?'
+        cursor_of = lambda row: row[columns[0]]
+        values_of = lambda cursor: [cursor]
+    else:
+        key_expr = f"({', '.join(columns)})"
+        placeholder = f"({', '.join('?' for _ in columns)})"
+        cursor_of = lambda row: tuple(row[column] for column in columns)
+        values_of = list
+    conditions = [where] if where else []
+    params = list(params)
+
+    if before is not None:
+        conditions.append(f"{key_expr} < {placeholder}")
+        params.extend(values_of(before))
+        order = 'DESC'
+    else:
+        if after is not None:
+            conditions.append(f"{key_expr} > {placeholder}")
+            params.extend(values_of(after))
+        order = 'ASC'
+
+    where_clause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    order_by = ', '.join(f"{column} {order}" for column in columns)
+    c = conn.cursor()
+    # Fetch one extra row to learn whether another page exists
+    c.execute(
+        f"SELECT * FROM {table} {where_clause} ORDER BY {order_by} LIMIT ?",
+        params + [page_size + 1]
+    )
+    rows = c.fetchall()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    if before is not None:
+        rows.reverse()
+        prev_cursor = cursor_of(rows[0]) if has_more and rows else None
+        next_cursor = cursor_of(rows[-1]) if rows else None
+    else:
+        prev_cursor = cursor_of(rows[0]) if after is not None and rows else None
+        next_cursor = cursor_of(rows[-1]) if has_more else None
+    return rows, prev_cursor, next_cursor
 
 @app.route('/')
+@cached_view()
 def index():
     """Home Page."""
     return render_template('index.html')
@@ -189,24 +358,51 @@ def index():
 # (1) FIND AN ITEM /items
 # -----------------------------------------------------
 @app.route('/items')
+@cached_view('library_items', vary=signed_in_key)
 def list_items():
-    """List library items, optionally searching by query q."""
+    """List library items, optionally searching by query q and filtering by facet.
+
+    A signed-in customer only sees the items their age allows.
+    """
     search_query = request.args.get('q', '')
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    filters = selected_facets(request.args)
+    customer = signed_in()
+    age = customer[1] if customer else None
     conn = get_db_connection()
-    c = conn.cursor()
+    prev_cursor = next_cursor = total_count = corrected_query = None
     if search_query:
-        c.execute(
-            """
-            SELECT * FROM library_items
-            WHERE title LIKE ? OR author LIKE ?
-            """,
-            (f'%{search_query}%', f'%{search_query}%')
-        )
+        items = search_items(conn, search_query, app.config['SEARCH_LIMIT'], filters, age)
+        if not items:
+            # Nothing matched: try again with misspelled words corrected
+            corrected_query = correct_query(conn, search_query)
+            if corrected_query:
+                items = search_items(conn, corrected_query, app.config['SEARCH_LIMIT'], filters, age)
     else:
-        c.execute("SELECT * FROM library_items")
-    items = c.fetchall()
-    conn.close()
-    return render_template('items.html', items=items, search_query=search_query)
+        where, params = facet_where(filters, age)
+        items, prev_cursor, next_cursor = fetch_page(
+            conn, 'library_items', 'item_id', after=after, before=before, where=where, params=params
+        )
+        if len(filters) == 1 and age is None and app.config['SHOW_TOTAL_COUNT']:
+            # One filter: its count is already in item_facets
+            (facet, value), = filters.items()
+            row = conn.execute("SELECT items FROM item_facets WHERE facet = ? AND value = ?",
+                               (facet, value)).fetchone()
+            total_count = row[0] if row else 0
+        elif not filters and age is not None and app.config['SHOW_TOTAL_COUNT']:
+            # Everything up to the customer's age: a range of the restriction counts
+            total_count = conn.execute('''
+                SELECT COALESCE(SUM(items), 0) FROM item_facets
+                WHERE facet = 'restriction' AND value <= ?
+            ''', (age,)).fetchone()[0]
+        else:
+            total_count = cached_count(conn, 'library_items', where, params)
+    return render_template('items.html', items=items, search_query=search_query,
+                           corrected_query=corrected_query, filters=filters,
+                           facets=facet_counts(conn), prev_cursor=prev_cursor,
+                           next_cursor=next_cursor, total_count=total_count,
+                           age=age, fine_blocked=customer[2] if customer else False)
 
 # -----------------------------------------------------
 # (2) BORROW AN ITEM /borrow/<item_id>
@@ -222,29 +418,27 @@ def borrow_item(item_id):
         item = c.fetchone()
         if not item:
             flash("Item not found.", "danger")
-            conn.close()
             return redirect(url_for('list_items'))
-        return render_template('borrow_item.html', item=item)
+        return render_template('borrow_item.html', item=item, also_borrowed=also_borrowed(conn, item_id))
 
     # POST -> process borrow
     if request.method == 'POST':
         customer_id = request.form.get('customer_id')
         borrowed_date = request.form.get('borrowed_date')
 
-        # Calculate due date (2 weeks after borrowed date)
-        borrowed_date_obj = datetime.strptime(borrowed_date, '%Y-%m-%d')
-        due_date_obj = borrowed_date_obj + timedelta(weeks=2)
-        due_date = due_date_obj.strftime('%Y-%m-%d')
+        # Check availability and record the loan in one transaction; due
+        # date is 2 weeks after the borrowed date
+        try:
+            transaction_id, due_date = borrow(conn, item_id, customer_id, borrowed_date)
+        except CirculationError as e:
+            c.execute("SELECT * FROM library_items WHERE item_id = ?", (item_id,))
+            item = c.fetchone()
+            flash(str(e), "danger")
+            if not item:
+                return redirect(url_for('list_items'))
+            return render_template('borrow_item.html', item=item,
+                                   also_borrowed=also_borrowed(conn, item_id)), e.status
 
-        # Insert new borrowing record
-        c.execute('''
-            INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date)
-            VALUES (?, ?, ?, ?)
-        ''', (item_id, customer_id, borrowed_date, due_date))
-        
-        # Get the transaction ID of the newly inserted record
-        transaction_id = c.lastrowid
-        
         # Get item details for the confirmation page
         c.execute("SELECT * FROM library_items WHERE item_id = ?", (item_id,))
         item = c.fetchone()
@@ -252,9 +446,6 @@ def borrow_item(item_id):
         # Get customer details
         c.execute("SELECT * FROM customers WHERE customer_id = ?", (customer_id,))
         customer = c.fetchone()
-
-        conn.commit()
-        conn.close()
         
         # Render a borrow confirmation page with transaction details
         return render_template('borrow_confirmation.html', 
@@ -264,6 +455,20 @@ def borrow_item(item_id):
                               borrowed_date=borrowed_date,
                               due_date=due_date)
 
+@app.route('/hold/<int:item_id>', methods=['POST'])
+def hold_item(item_id):
+    """Joins the item's holds queue when no copy is on the shelf."""
+    conn = get_db_connection()
+    try:
+        _, position = place_hold(conn, item_id, request.form.get('customer_id'))
+    except HoldError as e:
+        flash(str(e), "danger")
+        if conn.execute("SELECT 1 FROM library_items WHERE item_id = ?", (item_id,)).fetchone() is None:
+            return redirect(url_for('list_items'))
+        return redirect(url_for('borrow_item', item_id=item_id))
+    flash(f"Your hold is placed. You are number {position} in the queue.", "success")
+    return redirect(url_for('list_items'))
+
 # -----------------------------------------------------
 # (3) RETURN AN ITEM /return/<transaction_id>
 # -----------------------------------------------------
@@ -274,7 +479,6 @@ def return_item():
 
     if request.method == 'GET':
         # Render the page with a form to input transaction_id
-        conn.close()
         return render_template('return_item.html', transaction=None, item=None)
 
     if request.method == 'POST':
@@ -289,72 +493,40 @@ def return_item():
             
             if not transaction:
                 flash("Transaction not found.", "danger")
-                conn.close()
                 return redirect(url_for('return_item'))
             
             # If it's already returned, show a message
             if transaction['returned_date']:
                 flash(f"This item was already returned on {transaction['returned_date']}", "info")
-                conn.close()
                 return redirect(url_for('return_item'))
             
             # Get item details to display
             c.execute("SELECT * FROM library_items WHERE item_id = ?", (transaction['item_id'],))
             item = c.fetchone()
             
-            conn.close()
             return render_template('return_item.html', transaction=transaction, item=item)
         
         # Case 2: Confirming the return
         elif transaction_id and returned_date:
-            # Fetch the transaction details
-            c.execute("SELECT * FROM borrowing WHERE transaction_id = ?", (transaction_id,))
-            transaction = c.fetchone()
-            
-            if not transaction:
-                flash("Transaction not found.", "danger")
-                conn.close()
+            # Close the loan once, even if the form is submitted twice
+            try:
+                amount_of_fine, held_for = return_loan(conn, transaction_id, returned_date)
+            except AlreadyReturned as e:
+                flash(str(e), "info")
                 return redirect(url_for('return_item'))
-            
-            # Calculate fine based on return date
-            # If return date is more than 3 weeks after borrowed date, add fine
-            borrowed_date_obj = datetime.strptime(transaction['borrowed_date'], '%Y-%m-%d')
-            returned_date_obj = datetime.strptime(returned_date, '%Y-%m-%d')
-            
-            # Calculate days difference
-            days_difference = (returned_date_obj - borrowed_date_obj).days
-            
-            # Set fine if more than 2 weeks (15 days)
-            amount_of_fine = 0.0
-            if days_difference > 15:
-                # $1 per day after the 15-day period
-                amount_of_fine = (days_difference - 15) * 1.0
-            
-            # Record fine if applicable
+            except CirculationError as e:
+                flash(str(e), "danger")
+                return redirect(url_for('return_item'))
+
             if amount_of_fine > 0:
-                c.execute('''
-                    INSERT INTO fines (transaction_id, customer_id, amount_of_fine)
-                    VALUES (?, ?, ?)
-                ''', (transaction_id, transaction['customer_id'], amount_of_fine))
-                
                 flash(f"A fine of ${amount_of_fine:.2f} has been applied for late return.", "info")
-            
-            # Update the borrowing record with the returned date
-            c.execute('''
-                UPDATE borrowing
-                SET returned_date = ?, amount_of_fine = ?
-                WHERE transaction_id = ?
-            ''', (returned_date, amount_of_fine, transaction_id))
-            
-            conn.commit()
-            conn.close()
-            
+            if held_for is not None:
+                flash(f"Please set this item aside: it is on hold for customer {held_for}.", "info")
             flash("Item returned successfully!", "success")
             return redirect(url_for('list_items'))
         
         else:
             flash("Please enter a valid Transaction ID.", "danger")
-            conn.close()
             return redirect(url_for('return_item'))
         
 # -----------------------------------------------------
@@ -375,17 +547,12 @@ def donate_item():
         restriction = request.form.get('restriction', 0)
         is_future_item = 0
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO library_items (
-                title, author, item_type, format, genre, published_date, availability,
-                is_future_item, restriction
-            )
-            VALUES (?, ?, ?, ?, ?, ?, 'Available', ?, ?)
-        ''', (title, author, item_type, format_, genre, published_date, is_future_item, restriction))
-        conn.commit()
-        conn.close()
+        def record_donation(conn):
+            # Another copy of a title we hold goes on that title's record
+            add_item(conn, (title, author, item_type, format_, genre, published_date, 'Available',
+                            is_future_item, restriction))
+
+        write_db(record_donation)
 
         flash("Thank you for donating the item!", "success")
         return redirect(url_for('list_items'))
@@ -393,41 +560,68 @@ def donate_item():
 # -----------------------------------------------------
 # (5) FIND AN EVENT /events
 # -----------------------------------------------------
-@app.route('/events', methods=['GET', 'POST'])
+@app.route('/events')
+@cached_view('events', vary=signed_in_key)
 def list_events():
+    """Upcoming events by date, optionally for one audience or age.
+
+    A signed-in customer only sees the events their age allows.
+    """
     conn = get_db_connection()
-    c = conn.cursor()
     search_query = request.args.get('q', '')
-
+    audience = request.args.get('audience', '')
+    age = request.args.get('age', type=int)
+    customer = signed_in()
+    if customer:
+        age = customer[1] if age is None else min(age, customer[1])
+    after = decode_event_cursor(request.args.get('after'))
+    before = decode_event_cursor(request.args.get('before'))
+
+    conditions, params = [], []
     if search_query:
-        c.execute(
-            """
-            SELECT * FROM events
-            WHERE event_name LIKE ? OR event_description LIKE ?
-            """,
-            (f'%{search_query}%', f'%{search_query}%')
-        )
+        conditions.append("(event_name LIKE ? OR event_description LIKE ?)")
+        params += [f'%{search_query}%', f'%{search_query}%']
+    if audience:
+        # 'All Ages' events are for every audience
+        conditions.append("targeted_customers IN (?, 'All Ages')")
+        params.append(audience)
+    if age is not None:
+        conditions.append("restriction <= ?")
+        params.append(age)
+    where = ' AND '.join(conditions)
+
+    events, prev_cursor, next_cursor = fetch_page(
+        conn, 'upcoming_events', ('datetime', 'event_id'), after=after, before=before,
+        where=where, params=params
+    )
+    total_count = cached_count(conn, 'upcoming_events', where, params, tables=('events',))
+
+    return render_template('events.html', events=events, search_query=search_query,
+                           audience=audience, age=age, audiences=EVENT_AUDIENCES,
+                           prev_cursor=encode_event_cursor(prev_cursor),
+                           next_cursor=encode_event_cursor(next_cursor),
+                           total_count=total_count)
+
+def encode_event_cursor(cursor):
+    return f"{cursor[0]}|{cursor[1]}" if cursor else None
+
+def decode_event_cursor(value):
+    """'datetime|event_id' from a page link -> (datetime, event_id), or None."""
+    when, _, event_id = (value or '').rpartition('|')
+    return (when, int(event_id)) if when and event_id.isdigit() else None
+
+def flash_registration(event_id, customer_id):
+    """Registers through the seat engine and flashes the outcome; False on error."""
+    try:
+        status, position = register(get_db_connection(), event_id, customer_id)
+    except RegistrationError as e:
+        flash(str(e), "danger")
+        return False
+    if status == WAITLISTED:
+        flash(f"This event is full. You are number {position} on the waitlist.", "info")
     else:
-        c.execute("SELECT * FROM events")
-    events = c.fetchall()
-
-    # Handle registration form submission
-    if request.method == 'POST':
-        event_id = request.form.get('event_id')
-        customer_id = request.form.get('customer_id')
-
-        # Insert registration into the database
-        c.execute('''
-            INSERT INTO register (event_id, customer_id)
-            VALUES (?, ?)
-        ''', (event_id, customer_id))
-        conn.commit()
-        flash("You have successfully registered for the event!", "success")
-        conn.close()
-        return redirect(url_for('list_events'))
-
-    conn.close()
-    return render_template('events.html', events=events)
+        flash("You have registered for the event!", "success")
+    return True
 
 # -----------------------------------------------------
 # (6) REGISTER FOR AN EVENT /register_event/<event_id>
@@ -442,20 +636,13 @@ def register_event(event_id):
         event = c.fetchone()
         if not event:
             flash("Event not found.", "danger")
-            conn.close()
             return redirect(url_for('list_events'))
-        conn.close()
-        return render_template('register_event.html', event=event)
+        return render_template('register_event.html', event=event, seats_left=seats_left(event))
 
     if request.method == 'POST':
         customer_id = request.form.get('customer_id')
-        c.execute('''
-            INSERT INTO register (event_id, customer_id)
-            VALUES (?, ?)
-        ''', (event_id, customer_id))
-        conn.commit()
-        conn.close()
-        flash("You have registered for the event!", "success")
+        if not flash_registration(event_id, customer_id):
+            return redirect(url_for('register_event', event_id=event_id))
         return redirect(url_for('list_events'))
 
 # -----------------------------------------------------
@@ -476,23 +663,18 @@ def volunteer():
         salary = 0.0  # Default salary for volunteers
         job_role = "Volunteer"  # Default job role for volunteers
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''
+        # Insert the application and get the new employee ID
+        employee_id = write_db(lambda conn: conn.execute('''
             INSERT INTO personnel (name, dob, address, email, phone, salary, job_role)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, dob, address, email, phone, salary, job_role))
-        
-        # Get the employee ID of the newly inserted record
-        employee_id = c.lastrowid
+        ''', (name, dob, address, email, phone, salary, job_role)).lastrowid)
         
         # Get personnel details for the confirmation page
+        conn = get_db_connection()
+        c = conn.cursor()
         c.execute("SELECT * FROM personnel WHERE employee_id = ?", (employee_id,))
         personnel = c.fetchone()
         
-        conn.commit()
-        conn.close()
-        
         # Render a confirmation page with application details
         return render_template('volunteer_confirmation.html', personnel=personnel)
 
@@ -528,35 +710,151 @@ def add_customer():
         dob = request.form.get('dob')
         address = request.form.get('address')
         preferences = request.form.get('preferences')
-        outstanding_fine_balance = request.form.get('outstanding_fine_balance', 0.0)
+        # New members start with no fines; the balance only moves with the fines table
+        outstanding_fine_balance = 0.0
 
         # Insert the new customer into the database
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('''
+        customer_id = write_db(lambda conn: conn.execute('''
             INSERT INTO customers (name, email, phone, dob, address, preferences, outstanding_fine_balance)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, email, phone, dob, address, preferences, outstanding_fine_balance))
-        conn.commit()
+        ''', (name, email, phone, dob, address, preferences, outstanding_fine_balance)).lastrowid)
 
         # Fetch the newly created customer's information
-        customer_id = c.lastrowid
+        conn = get_db_connection()
+        c = conn.cursor()
         c.execute('SELECT * FROM customers WHERE customer_id = ?', (customer_id,))
         customer = c.fetchone()
-        conn.close()
 
         # Redirect to the completion page with customer details
         return render_template('completion.html', customer=customer)
 
-if __name__ == '__main__':
-    # Initialize the DB
-    if not os.path.exists(DATABASE):
-        init_db()
-    else:
-        # If DB exists, we could call init_db() again if we want to ensure tables
-        # but that might drop data in some designs. We won't call it by default.
-        init_db()
+# -----------------------------------------------------
+# (10) BULK CATALOG IMPORT /import
+# -----------------------------------------------------
+@app.route('/import', methods=['POST'])
+def import_catalog():
+    """Streams an uploaded .csv/.jsonl file into library_items; returns a JSON report."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify(error="Upload a .csv or .jsonl file in the 'file' field."), 400
+    try:
+        fmt = request.form.get('format') or detect_format(upload.filename)
+    except BulkImportError as e:
+        return jsonify(error=str(e)), 400
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    # Indexes stay in place: dropping them would slow every other request and
+    # make each upload rebuild them over the whole catalog
+    report = import_items(get_db_connection(), stream, fmt,
+                          chunk_size=app.config['IMPORT_CHUNK_SIZE'], defer_indexes=False)
+    return jsonify(report.as_dict())
+
+# -----------------------------------------------------
+# (11) CUSTOMER ACCOUNT /account/<customer_id>
+# -----------------------------------------------------
+@app.route('/account')
+def find_account():
+    """Customer ID form; redirects to that customer's account page."""
+    customer_id = request.args.get('customer_id', '').strip()
+    if not customer_id:
+        return render_template('account_lookup.html')
+    if not customer_id.isdigit():
+        flash("Enter a valid Customer ID.", "danger")
+        return render_template('account_lookup.html')
+    return redirect(url_for('account', customer_id=int(customer_id)))
+
+@app.route('/account/<int:customer_id>')
+def account(customer_id):
+    """Balance, open loans, paged loan and fine history, holds, registrations and recommendations."""
+    conn = get_db_connection()
+    summary = accounts.summary(conn, customer_id)
+    if summary is None:
+        flash(f"Customer {customer_id} not found.", "danger")
+        return redirect(url_for('find_account'))
+
+    loans, next_cursor = accounts.loan_history(
+        conn, customer_id, before=accounts.decode_cursor(request.args.get('before')),
+        limit=app.config['PAGE_SIZE']
+    )
+    return render_template('account.html', account=summary, loans=loans,
+                           fine_blocked=eligibility(conn, customer_id)[1],
+                           holds=accounts.holds(conn, customer_id),
+                           registrations=accounts.registrations(conn, customer_id),
+                           recommended=recommended_for(conn, customer_id),
+                           next_cursor=accounts.encode_cursor(next_cursor),
+                           paged='before' in request.args)
+
+@app.route('/sign_in', methods=['POST'])
+def sign_in():
+    """Signs a customer in for this session; /items and /events then show what they can use."""
+    customer_id = request.form.get('customer_id', type=int)
+    conn = get_db_connection()
+    if customer_id is None or conn.execute(
+            "SELECT 1 FROM customers WHERE customer_id = ?", (customer_id,)).fetchone() is None:
+        flash("Enter a valid Customer ID.", "danger")
+        return redirect(url_for('find_account'))
+    session['customer_id'] = customer_id
+    flash("You are signed in.", "success")
+    return redirect(url_for('account', customer_id=customer_id))
+
+@app.route('/sign_out', methods=['POST'])
+def sign_out():
+    session.pop('customer_id', None)
+    flash("You are signed out.", "info")
+    return redirect(url_for('list_items'))
 
+# -----------------------------------------------------
+# (12) CIRCULATION REPORTS /reports
+# -----------------------------------------------------
+@app.route('/reports')
+def reports():
+    """Dashboard over the daily rollups kept by reporting.py."""
+    conn = get_db_connection()
+    try:
+        start, end = reporting.parse_range(request.args.get('from'), request.args.get('to'))
+    except reporting.ReportError as e:
+        flash(str(e), "danger")
+        start, end = reporting.parse_range()
+
+    open_loans, overdue = reporting.overdue_now(conn)
+    return render_template('reports.html', start=start, end=end,
+                           by_month=reporting.circulation(conn, start, end, 'month').fetchall(),
+                           by_genre=reporting.circulation(conn, start, end, 'genre').fetchall(),
+                           by_type=reporting.circulation(conn, start, end, 'item_type').fetchall(),
+                           events=reporting.event_attendance(conn, start, end).fetchall(),
+                           open_loans=open_loans, overdue=overdue,
+                           pending=reporting.pending(conn), exports=sorted(reporting.REPORTS))
+
+@app.route('/reports/<name>.csv')
+def export_report(name):
+    """Streams one report as CSV, a batch of rows at a time."""
+    if name not in reporting.REPORTS:
+        flash(f"There is no {name} report.", "danger")
+        return redirect(url_for('reports'))
+    try:
+        start, end = reporting.parse_range(request.args.get('from'), request.args.get('to'))
+    except reporting.ReportError as e:
+        return str(e), e.status
+
+    cursor = reporting.REPORTS[name](get_db_connection(), start, end)
+    # stream_with_context keeps the pooled connection checked out until the
+    # last row is sent
+    return Response(stream_with_context(reporting.stream_csv(cursor)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={name}_{start}_{end}.csv'})
+
+# -----------------------------------------------------
+# (13) OPERATIONAL METRICS /metrics
+# -----------------------------------------------------
+@app.route('/metrics')
+def metrics():
+    """JSON snapshot of runtime counters for monitoring."""
+    return jsonify(db_pool=get_pool().stats(), db_writes=write_stats(),
+                   response_cache=get_cache().stats(), count_cache=get_count_cache().stats(),
+                   instrumentation=instrument.get_metrics().snapshot())
+
+if __name__ == '__main__':
+    # Development server; use serve.py in production
+    create_app()
     app.run(debug=True)
 
 
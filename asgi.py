@@ -0,0 +1,185 @@
+# asgi.py
+"""ASGI entry point serving the same Flask routes from an event loop.
+
+The routes stay synchronous; each request runs start to finish (including
+streaming its body) on one thread from a pool, so the event loop only moves
+bytes. Requests that write (anything but GET, HEAD and
+OPTIONS) go to a single writer thread, since SQLite allows one writer at a
+time anyway and queueing them here is cheaper than retrying on SQLITE_BUSY.
+Reads get their own pool, so a slow import or a burst of borrows does not
+hold up catalog pages (WAL lets them read while the writer works).
+
+    pip install uvicorn
+    uvicorn asgi:application --port 8000
+    python asgi.py --port 8000 --read-threads 8
+"""
+import argparse
+import asyncio
+import contextvars
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, setup_schema
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+SPOOL_BYTES = 1024 * 1024  # request bodies larger than this go to a temp file
+
+
+class WsgiToAsgi:
+    """Runs a WSGI app under an ASGI server with separate read and write threads."""
+
+    def __init__(self, wsgi_app, read_threads=8, write_threads=1, on_startup=None):
+        self.wsgi_app = wsgi_app
+        self.on_startup = on_startup
+        self.readers = ThreadPoolExecutor(read_threads, thread_name_prefix='db-read')
+        self.writers = ThreadPoolExecutor(write_threads, thread_name_prefix='db-write')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError(f"unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.on_startup:
+                    await asyncio.get_running_loop().run_in_executor(self.writers, self.on_startup)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.readers.shutdown(wait=True)
+                self.writers.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        length = body.tell()
+        body.seek(0)
+
+        environ = build_environ(scope, body)
+        # The body is buffered, so its length is known even if it was chunked
+        environ['CONTENT_LENGTH'] = str(length)
+        executor = self.readers if scope['method'] in SAFE_METHODS else self.writers
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        def respond(message):
+            # Called from the worker thread; waits until the loop has sent it,
+            # so a slow client holds back the response rather than buffering it
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            # Begin, iteration and close all run here, so the app and request
+            # contexts a streamed response pushes are popped where they were
+            # pushed and its pooled connection is released on teardown
+            result = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if not chunk:
+                        continue
+                    if 'sent' not in started:
+                        respond({'type': 'http.response.start', 'status': started['status'],
+                                 'headers': started['headers']})
+                        started['sent'] = True
+                    respond({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            if 'sent' not in started:
+                respond({'type': 'http.response.start', 'status': started['status'],
+                         'headers': started['headers']})
+            respond({'type': 'http.response.body', 'body': b''})
+
+        try:
+            await loop.run_in_executor(executor, contextvars.copy_context().run, run)
+        finally:
+            body.close()
+
+
+def build_environ(scope, body):
+    """The WSGI environ for an ASGI http scope (PEP 3333 string rules)."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def create_asgi_app(flask_app, on_startup=None):
+    """Wraps flask_app, sizing the read pool to its DB connection pool."""
+    return WsgiToAsgi(flask_app.wsgi_app,
+                      read_threads=flask_app.config.get('ASGI_READ_THREADS', flask_app.config['DB_POOL_SIZE']),
+                      write_threads=flask_app.config.get('ASGI_WRITE_THREADS', 1),
+                      on_startup=on_startup)
+
+
+# The schema is set up when the server starts (ASGI lifespan)
+application = create_asgi_app(app, on_startup=setup_schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve The Book Nook over ASGI (needs uvicorn).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--read-threads', type=int)
+    parser.add_argument('--write-threads', type=int, default=1)
+    parser.add_argument('--database')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is not installed: pip install uvicorn")
+
+    if args.database:
+        app.config['DATABASE'] = args.database
+    if args.read_threads:
+        app.config['ASGI_READ_THREADS'] = args.read_threads
+    app.config['ASGI_WRITE_THREADS'] = args.write_threads
+    uvicorn.run(create_asgi_app(app, on_startup=setup_schema), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
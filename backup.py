@@ -0,0 +1,382 @@
+# backup.py
+"""Online backup, streaming export and restore of the library database.
+
+backup() copies the live database with SQLite's backup API, a few pages per
+step with a pause in between, so a copy is never torn and writers only wait
+for one step at a time (in WAL mode they do not wait at all). If a writer
+changes the database mid-copy SQLite restarts the copy; after MAX_RESTARTS
+the rest is taken in a single step, which only holds a read transaction.
+
+export() writes every table to a gzipped JSON Lines or CSV file, all from
+one read transaction so the tables agree with each other, with rows pulled
+from the cursor EXPORT_BATCH_ROWS at a time. manifest.json, written last,
+holds the schema, row counts and schema version.
+
+restore() loads an export into a new database file: tables first, then the
+rows in batches inside one transaction, then indexes, triggers and views,
+so no trigger fires and each index is built once. The full-text indexes
+are rebuilt from the tables they index at the end.
+
+    python backup.py backup backups/library.db
+    python backup.py export exports/2025-06-01 --format csv
+    python backup.py restore exports/2025-06-01 restored.db
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+BACKUP_PAGES_PER_STEP = 1024  # 4 MB with the default page size
+BACKUP_PAUSE = 0.01  # seconds between steps
+MAX_RESTARTS = 3
+EXPORT_BATCH_ROWS = 1000
+EXPORT_COMPRESSION = 6  # gzip level; 9 is much slower for little gain
+RESTORE_BATCH_ROWS = 5000
+FORMATS = ('jsonl', 'csv')
+CSV_NULL = r'\N'  # how NULL is written in CSV, so it differs from ''
+# Text starting with a backslash is written with one more in front, so a
+# real '\N' (written '\\N') is not read back as NULL
+CSV_ESCAPE = '\\'
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class BackupReport:
+    def __init__(self, dest):
+        self.dest = dest
+        self.pages = 0
+        self.steps = 0
+        self.restarts = 0
+        self.one_step = False
+        self.seconds = 0.0
+
+    def __str__(self):
+        finish = ', finished in one step' if self.one_step else ''
+        return (f"{self.pages} pages to {self.dest} in {self.steps} steps, "
+                f"{self.restarts} restarts{finish}, {self.seconds:.1f}s")
+
+
+def backup(conn, dest, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_PAUSE, verify=True):
+    """Copies the database of conn to dest while the app keeps running.
+
+    The copy goes to dest + '.partial' and is renamed into place once it is
+    complete (and, with verify, passes PRAGMA quick_check). Returns a
+    BackupReport.
+    """
+    report = BackupReport(dest)
+    start = time.perf_counter()
+    partial = dest + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+    target = sqlite3.connect(partial)
+    remaining_before = None
+
+    def step_done(status, remaining, total):
+        nonlocal remaining_before
+        report.steps += 1
+        report.pages = total
+        # Remaining going up means a writer changed the source and SQLite
+        # started the copy over
+        if remaining_before is not None and remaining > remaining_before:
+            report.restarts += 1
+            if report.restarts > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        remaining_before = remaining
+        if remaining:
+            time.sleep(pause)
+
+    try:
+        try:
+            conn.backup(target, pages=pages, progress=step_done)
+        except _TooManyRestarts:
+            report.one_step = True
+            conn.backup(target, pages=-1)
+        if verify:
+            result = target.execute("PRAGMA quick_check").fetchone()[0]
+            if result != 'ok':
+                raise BackupError(f"backup failed quick_check: {result}")
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    target.close()
+    os.replace(partial, dest)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+# -----------------------------------------------------
+# Export
+# -----------------------------------------------------
+def _schema(conn):
+    """(type, name, tbl_name, sql) of every schema object, in creation order."""
+    return conn.execute('''
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL OR name IN ('sqlite_sequence', 'sqlite_stat1')
+        ORDER BY rowid
+    ''').fetchall()
+
+
+def _data_tables(schema):
+    """Tables whose rows are exported: not virtual tables or their shadow tables."""
+    virtual = [name for kind, name, _, sql in schema
+               if kind == 'table' and (sql or '').upper().startswith('CREATE VIRTUAL TABLE')]
+    return [name for kind, name, _, sql in schema
+            if kind == 'table' and name not in virtual
+            and not any(name.startswith(v + '_') for v in virtual)]
+
+
+def iter_rows(cursor, batch_rows=EXPORT_BATCH_ROWS):
+    """Yields a cursor's rows, fetching batch_rows at a time."""
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            return
+        yield from rows
+
+
+def _export_table(conn, table, path, fmt):
+    cursor = conn.execute(f'SELECT * FROM "{table}"')
+    columns = [d[0] for d in cursor.description]
+    count = 0
+    with gzip.open(path, 'wt', EXPORT_COMPRESSION, encoding='utf-8', newline='') as out:
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in iter_rows(cursor):
+                writer.writerow([_csv_field(value) for value in row])
+                count += 1
+        else:
+            for row in iter_rows(cursor):
+                out.write(json.dumps(dict(zip(columns, row)), separators=(',', ':')))
+                out.write('\n')
+                count += 1
+    return columns, count
+
+
+def _csv_field(value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, str) and value.startswith(CSV_ESCAPE):
+        return CSV_ESCAPE + value
+    return value
+
+
+def export(conn, directory, fmt='jsonl', progress=None):
+    """Writes every table of conn to directory as <table>.<fmt>.gz plus manifest.json.
+
+    Returns the manifest. `progress(table, rows)` is called after each table.
+    """
+    if fmt not in FORMATS:
+        raise BackupError(f"format must be one of {', '.join(FORMATS)}")
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'format': fmt, 'created': datetime.now().isoformat(timespec='seconds'), 'tables': {}}
+
+    # One read transaction: every table is read as of the same moment, and
+    # in WAL mode writers carry on meanwhile
+    conn.execute("BEGIN")
+    try:
+        manifest['user_version'] = conn.execute("PRAGMA user_version").fetchone()[0]
+        schema = _schema(conn)
+        manifest['schema'] = [list(row) for row in schema]
+        for table in _data_tables(schema):
+            filename = f'{table}.{fmt}.gz'
+            columns, count = _export_table(conn, table, os.path.join(directory, filename), fmt)
+            manifest['tables'][table] = {'file': filename, 'columns': columns, 'rows': count}
+            if progress:
+                progress(table, count)
+    finally:
+        conn.rollback()
+
+    # Written last, so an export that stopped part way cannot be restored
+    with open(os.path.join(directory, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=1)
+    return manifest
+
+
+# -----------------------------------------------------
+# Restore
+# -----------------------------------------------------
+def _read_rows(path, fmt, columns, numeric):
+    """Yields tuples in `columns` order from an exported table file.
+
+    numeric is the set of column positions with no declared type, whose CSV
+    text is turned back into numbers.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as rows:
+        if fmt == 'jsonl':
+            for line in rows:
+                record = json.loads(line)
+                yield tuple(record.get(column) for column in columns)
+            return
+        reader = csv.reader(rows)
+        header = next(reader)
+        order = [header.index(column) for column in columns]
+        for record in reader:
+            values = [_csv_value(record[i]) for i in order]
+            for i in numeric:
+                values[i] = _number(values[i])
+            yield tuple(values)
+
+
+def _csv_value(field):
+    """The value a CSV field was written from by _csv_field (as text)."""
+    if field == CSV_NULL:
+        return None
+    if field.startswith(CSV_ESCAPE):
+        return field[len(CSV_ESCAPE):]
+    return field
+
+
+def _number(value):
+    if value is None:
+        return None
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _insert_rows(conn, table, columns, rows):
+    names = ', '.join(f'"{column}"' for column in columns)
+    sql = f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * len(columns))})'
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= RESTORE_BATCH_ROWS:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def restore(directory, dest, progress=None):
+    """Builds a new database at dest from an export written by export().
+
+    dest must not exist. The database is built in dest + '.partial' and
+    renamed into place once loaded and checked. Returns the manifest.
+    """
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if os.path.exists(dest):
+        raise BackupError(f"{dest} already exists")
+    partial = dest + '.partial'
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    conn = sqlite3.connect(partial, isolation_level=None)
+    try:
+        # A half-built file is thrown away, so skip the journal
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        schema = [tuple(row) for row in manifest['schema']]
+        tables = manifest['tables']
+        internal = ('sqlite_sequence', 'sqlite_stat1')
+        virtual = [name for kind, name, _, sql in schema
+                   if kind == 'table' and (sql or '').upper().startswith('CREATE VIRTUAL TABLE')]
+        created = set(virtual) | set(_data_tables(schema))
+        conn.execute("BEGIN")
+        for kind, name, _, sql in schema:
+            if kind == 'table' and name in created and name not in internal:
+                conn.execute(sql)
+        if 'sqlite_stat1' in tables:
+            # Creates an empty sqlite_stat1 without analysing anything
+            conn.execute("ANALYZE sqlite_master")
+
+        # sqlite_sequence last: loading the AUTOINCREMENT tables writes to it
+        for table in sorted(tables, key=lambda table: table in internal):
+            info = tables[table]
+            declared = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+            # sqlite_stat1 is all text, though its columns have no declared type
+            numeric = {i for i, column in enumerate(info['columns'])
+                       if not declared.get(column) and table != 'sqlite_stat1'}
+            rows = _read_rows(os.path.join(directory, info['file']), manifest['format'],
+                              info['columns'], numeric)
+            if table in internal:
+                conn.execute(f"DELETE FROM {table}")
+            _insert_rows(conn, table, info['columns'], rows)
+            if progress:
+                progress(table, info['rows'])
+
+        # Indexes are built once over the loaded rows, and triggers created
+        # only now so none of them fired during the load
+        for kind in ('index', 'view', 'trigger'):
+            for object_kind, _, _, sql in schema:
+                if object_kind == kind and sql:
+                    conn.execute(sql)
+        # Full-text indexes are rebuilt from their content tables; an
+        # fts5vocab table reads its index directly and has nothing to rebuild
+        for kind, name, _, sql in schema:
+            if name in virtual and re.search(r'USING\s+fts5\s*\(', sql, re.IGNORECASE):
+                conn.execute(f"INSERT INTO \"{name}\" (\"{name}\") VALUES ('rebuild')")
+        conn.execute(f"PRAGMA user_version = {int(manifest['user_version'])}")
+        conn.execute("COMMIT")
+
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if result != 'ok':
+            raise BackupError(f"restored database failed quick_check: {result}")
+    except BaseException:
+        conn.close()
+        os.remove(partial)
+        raise
+    conn.close()
+    os.replace(partial, dest)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Back up, export and restore the library database.')
+    parser.add_argument('--database', default='library.db')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    copy = commands.add_parser('backup', help='online copy with the SQLite backup API')
+    copy.add_argument('dest')
+    copy.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help='pages copied per step')
+    copy.add_argument('--pause', type=float, default=BACKUP_PAUSE, help='seconds between steps')
+    copy.add_argument('--no-verify', action='store_true', help='skip the quick_check of the copy')
+
+    dump = commands.add_parser('export', help='every table as gzipped JSON Lines or CSV')
+    dump.add_argument('directory')
+    dump.add_argument('--format', choices=FORMATS, default='jsonl')
+
+    load = commands.add_parser('restore', help='build a new database from an export')
+    load.add_argument('directory')
+    load.add_argument('dest')
+    args = parser.parse_args()
+
+    def show_progress(table, rows):
+        print(f"  {table}: {rows} rows")
+
+    start = time.perf_counter()
+    if args.command == 'restore':
+        manifest = restore(args.directory, args.dest, show_progress)
+        print(f"Restored {len(manifest['tables'])} tables to {args.dest} "
+              f"in {time.perf_counter() - start:.1f}s")
+        return
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    if args.command == 'backup':
+        print(backup(conn, args.dest, args.pages, args.pause, verify=not args.no_verify))
+    else:
+        manifest = export(conn, args.directory, args.format, show_progress)
+        print(f"Exported {len(manifest['tables'])} tables to {args.directory} "
+              f"in {time.perf_counter() - start:.1f}s")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
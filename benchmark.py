@@ -0,0 +1,1104 @@
+# benchmark.py
+"""Benchmarks for The Book Nook.
+
+Each scenario builds its own throwaway database, so library.db is never touched.
+
+    python benchmark.py storage --readers 8 --writers 4 --seconds 5
+    python benchmark.py routes --clients 8 --seconds 10 --items 100000
+    python benchmark.py borrow-stress --clients 32 --rounds 50 --items 5
+    python benchmark.py register-stress --clients 32 --events 5 --capacity 100
+    python benchmark.py holds --queue 100,10000,50000
+    python benchmark.py recommend --loans 1000000
+    python benchmark.py reports --loans 1000000
+    python benchmark.py backup --loans 1000000 --writers 4
+    python benchmark.py search --items 1000000
+    python benchmark.py eligibility --customers 100000
+    python benchmark.py servers --concurrency 1,4,16,64   # asgi needs uvicorn
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import app as library
+import backup
+import populate
+import reporting
+from circulation import CirculationError, NotEligible, borrow, return_loan
+from db import configure_storage, run_write, storage_pragmas
+from eligibility import FINE_LIMIT_RULE, eligibility, refresh_ages
+from fines import assess_overdue_fines
+from holds import add_hold
+from recommend import also_borrowed, build_neighbors, recommended_for
+from search import FACETS, correct_query, facet_counts, refresh_terms, search_items
+
+
+def build_database(path, items=20000, customers=2000):
+    """Creates the schema at path and fills it with enough rows to page through."""
+    library.app.config['DATABASE'] = path
+    library.init_db()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO customers (name, email, dob) VALUES (?, ?, '1990-01-01')",
+        ((f'Customer {i}', f'customer{i}@example.com') for i in range(customers))
+    )
+    conn.executemany(
+        "INSERT INTO library_items (title, author, item_type, format, genre) "
+        "VALUES (?, ?, 'Book', 'Print', ?)",
+        ((f'Title {i}', f'Author {i % 500}', f'Genre {i % 20}') for i in range(items))
+    )
+    conn.commit()
+    conn.close()
+
+
+# -----------------------------------------------------
+# storage: rollback journal vs WAL + tuned PRAGMAs
+# -----------------------------------------------------
+def _storage_run(path, tuned, readers, writers, seconds, items, customers):
+    config = library.app.config
+    if tuned:
+        conn = sqlite3.connect(path)
+        configure_storage(conn, config)
+        conn.close()
+    else:
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False)
+        if tuned:
+            for pragma in storage_pragmas(config):
+                conn.execute(pragma)
+        return conn
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def reader():
+        conn = connect()
+        done = errors = 0
+        while time.monotonic() < stop:
+            try:
+                conn.execute(
+                    "SELECT * FROM library_items WHERE item_id > ? ORDER BY item_id LIMIT 25",
+                    (random.randint(0, items),)
+                ).fetchall()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def borrow_and_return(conn):
+        c = conn.cursor()
+        c.execute(
+            "INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date) "
+            "VALUES (?, ?, '2025-01-01', '2025-01-15')",
+            (random.randint(1, items), random.randint(1, customers))
+        )
+        c.execute(
+            "UPDATE borrowing SET returned_date = '2025-01-10' WHERE transaction_id = ?",
+            (c.lastrowid,)
+        )
+
+    def writer():
+        conn = connect()
+        done = errors = 0
+        while time.monotonic() < stop:
+            try:
+                if tuned:
+                    run_write(conn, borrow_and_return)
+                else:
+                    borrow_and_return(conn)
+                    conn.commit()
+                done += 1
+            except sqlite3.OperationalError:
+                if conn.in_transaction:
+                    conn.rollback()
+                errors += 1
+        conn.close()
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts
+
+
+def bench_storage(args):
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds}s per run")
+    print(f"{'mode':<22}{'reads/s':>12}{'writes/s':>12}{'errors':>10}")
+    for label, tuned in (('rollback journal', False), ('WAL + tuned PRAGMAs', True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_database(path, args.items, args.customers)
+            counts = _storage_run(path, tuned, args.readers, args.writers,
+                                  args.seconds, args.items, args.customers)
+        print(f"{label:<22}{counts['reads'] / args.seconds:>12.0f}"
+              f"{counts['writes'] / args.seconds:>12.0f}{counts['errors']:>10}")
+
+
+# -----------------------------------------------------
+# routes: latency percentiles per endpoint through the Flask test client
+# -----------------------------------------------------
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def route_mix(conn, write_weight):
+    """(name, weight, request function) for each endpoint in the load mix."""
+    max_item = conn.execute("SELECT COALESCE(MAX(item_id), 1) FROM library_items").fetchone()[0]
+    max_event = conn.execute("SELECT COALESCE(MAX(event_id), 1) FROM events").fetchone()[0]
+    max_loan = conn.execute("SELECT COALESCE(MAX(transaction_id), 1) FROM borrowing").fetchone()[0]
+    max_customer = conn.execute("SELECT COALESCE(MAX(customer_id), 1) FROM customers").fetchone()[0]
+
+    def borrow(client, rng):
+        return client.post(f'/borrow/{rng.randint(1, max_item)}', data={
+            'customer_id': rng.randint(1, max_customer), 'borrowed_date': '2025-06-01'})
+
+    def donate(client, rng):
+        return client.post('/donate', data={
+            'title': f'Donated {rng.choice(populate.WORDS)}', 'author': 'Benchmark',
+            'item_type': 'Book', 'format': 'Print', 'genre': rng.choice(populate.GENRES),
+            'published_date': '2020-01-01'})
+
+    mix = [
+        ('GET /items', 20, lambda client, rng: client.get('/items')),
+        ('GET /items?after', 15, lambda client, rng: client.get(f'/items?after={rng.randint(0, max_item)}')),
+        ('GET /items?q', 25, lambda client, rng: client.get(f'/items?q={rng.choice(populate.WORDS).lower()}')),
+        ('GET /events', 10, lambda client, rng: client.get('/events')),
+        ('GET /borrow/<id>', 10, lambda client, rng: client.get(f'/borrow/{rng.randint(1, max_item)}')),
+        ('GET /register_event/<id>', 5,
+         lambda client, rng: client.get(f'/register_event/{rng.randint(1, max_event)}')),
+        ('POST /return (lookup)', 5,
+         lambda client, rng: client.post('/return', data={'transaction_id': rng.randint(1, max_loan)})),
+    ]
+    if write_weight:
+        mix += [('POST /borrow/<id>', write_weight, borrow), ('POST /donate', write_weight, donate)]
+    return mix
+
+
+def bench_routes(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.database
+        if path is None:
+            path = os.path.join(tmp, 'bench.db')
+            populate.generate_tables(path, customers=args.customers, items=args.items,
+                                     loans=args.loans, events=args.events,
+                                     registrations=args.events * 20, seed=args.seed)
+        library.app.config['DATABASE'] = path
+        library.app.config['INSTRUMENT_ENABLED'] = args.instrument
+        library.app.extensions.pop('db_pool', None)
+        library.init_db()
+
+        conn = sqlite3.connect(path)
+        mix = route_mix(conn, args.write_weight)
+        conn.close()
+        names = [name for name, _, _ in mix]
+        weights = [weight for _, weight, _ in mix]
+        requests = {name: fn for name, _, fn in mix}
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        stop = time.monotonic() + args.seconds
+
+        def client_loop(seed):
+            rng = random.Random(seed)
+            client = library.app.test_client()
+            mine = defaultdict(list)
+            failed = defaultdict(int)
+            while time.monotonic() < stop:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                response = requests[name](client, rng)
+                mine[name].append(time.perf_counter() - start)
+                if response.status_code >= 500:
+                    failed[name] += 1
+            with lock:
+                for name, values in mine.items():
+                    latencies[name].extend(values)
+                for name, count in failed.items():
+                    errors[name] += count
+
+        threads = [threading.Thread(target=client_loop, args=(args.seed + i,))
+                   for i in range(args.clients)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+        library.app.extensions.pop('db_pool', None)
+
+    print(f"{args.clients} clients for {elapsed:.1f}s")
+    print(f"{'endpoint':<26}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'5xx':>6}")
+    total = 0
+    for name in names:
+        values = sorted(latencies[name])
+        total += len(values)
+        print(f"{name:<26}{len(values):>8}{len(values) / elapsed:>9.1f}"
+              f"{percentile(values, 50) * 1000:>9.2f}{percentile(values, 95) * 1000:>9.2f}"
+              f"{percentile(values, 99) * 1000:>9.2f}{errors[name]:>6}")
+    print(f"{'total':<26}{total:>8}{total / elapsed:>9.1f}")
+
+
+# -----------------------------------------------------
+# borrow-stress: many clients racing for the same few items
+# -----------------------------------------------------
+def bench_borrow_stress(args):
+    """Fires concurrent POST /borrow at a handful of items, returning the
+    winners' loans between rounds, and checks no copy was ever lent twice
+    and no item lent more times than it has copies."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_database(path, items=args.items, customers=args.customers)
+        conn = sqlite3.connect(path)
+        for _ in range(args.copies - 1):
+            conn.execute("INSERT INTO item_copies (item_id) SELECT item_id FROM library_items")
+        conn.commit()
+        conn.close()
+        library.app.config['DATABASE'] = path
+        library.app.extensions.pop('db_pool', None)
+
+        outcomes = defaultdict(int)
+        latencies = []
+        lock = threading.Lock()
+
+        def attempt(item_id, customer_id, barrier):
+            client = library.app.test_client()
+            barrier.wait()
+            start = time.perf_counter()
+            response = client.post(f'/borrow/{item_id}', data={
+                'customer_id': customer_id, 'borrowed_date': '2025-06-01'})
+            elapsed = time.perf_counter() - start
+            with lock:
+                outcomes[response.status_code] += 1
+                latencies.append(elapsed)
+
+        conn = sqlite3.connect(path)
+        double_lent = over_lent = 0
+        started = time.monotonic()
+        for round_number in range(args.rounds):
+            rng = random.Random(args.seed + round_number)
+            barrier = threading.Barrier(args.clients)
+            threads = [threading.Thread(target=attempt, args=(
+                rng.randint(1, args.items), rng.randint(1, args.customers), barrier))
+                for _ in range(args.clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            double_lent += conn.execute('''
+                SELECT COUNT(*) FROM (
+                    SELECT copy_id FROM borrowing WHERE returned_date IS NULL
+                    GROUP BY copy_id HAVING COUNT(*) > 1
+                )
+            ''').fetchone()[0]
+            over_lent += conn.execute('''
+                SELECT COUNT(*) FROM library_items i
+                WHERE (SELECT COUNT(*) FROM borrowing b
+                       WHERE b.item_id = i.item_id AND b.returned_date IS NULL) > i.total_copies
+                   OR i.available_copies <> (SELECT COUNT(*) FROM item_copies c
+                                             WHERE c.item_id = i.item_id AND c.status = 'Available')
+            ''').fetchone()[0]
+            conn.execute("UPDATE borrowing SET returned_date = '2025-06-02' WHERE returned_date IS NULL")
+            conn.commit()
+        elapsed = time.monotonic() - started
+
+        loans = conn.execute("SELECT COUNT(*) FROM borrowing").fetchone()[0]
+        conn.close()
+        library.app.extensions.pop('db_pool', None)
+
+    attempts = sum(outcomes.values())
+    latencies.sort()
+    print(f"{args.clients} clients x {args.rounds} rounds on {args.items} items "
+          f"x {args.copies} copies, {elapsed:.1f}s")
+    print(f"attempts {attempts}, borrowed {outcomes[200]}, conflicts {outcomes[409]}, "
+          f"other {attempts - outcomes[200] - outcomes[409]}")
+    print(f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"loans recorded {loans}, copies lent twice {double_lent}, "
+          f"items over-lent or miscounted {over_lent}")
+    if double_lent or over_lent or loans != outcomes[200]:
+        raise SystemExit("FAILED: loans do not match successful borrows")
+
+
+# -----------------------------------------------------
+# register-stress: a popular event opening for registration
+# -----------------------------------------------------
+def bench_register_stress(args):
+    """Many clients register at once for a few small events, some twice,
+    then checks capacity, seat counts and waitlists are all consistent."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_database(path, items=100, customers=args.customers)
+        conn = sqlite3.connect(path)
+        conn.executemany(
+            "INSERT INTO events (event_name, event_type, datetime, capacity) "
+            "VALUES (?, 'Workshop', '2030-01-01 10:00', ?)",
+            ((f'Event {i}', args.capacity) for i in range(args.events)))
+        conn.commit()
+        library.app.config['DATABASE'] = path
+        library.app.extensions.pop('db_pool', None)
+
+        outcomes = defaultdict(int)
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.clients)
+
+        def client_loop(seed):
+            rng = random.Random(seed)
+            client = library.app.test_client()
+            mine = []
+            seen = defaultdict(int)
+            barrier.wait()
+            for _ in range(args.requests):
+                event_id = rng.randint(1, args.events)
+                start = time.perf_counter()
+                response = client.post(f'/api/v1/events/{event_id}/registrations',
+                                       json={'customer_id': rng.randint(1, args.customers)})
+                mine.append(time.perf_counter() - start)
+                body = response.get_json() or {}
+                seen[body.get('status') or response.status_code] += 1
+            with lock:
+                latencies.extend(mine)
+                for key, count in seen.items():
+                    outcomes[key] += count
+
+        threads = [threading.Thread(target=client_loop, args=(args.seed + i,)) for i in range(args.clients)]
+        started = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - started
+
+        over_capacity = conn.execute(
+            "SELECT COUNT(*) FROM events WHERE registered_count > capacity").fetchone()[0]
+        miscounted = conn.execute('''
+            SELECT COUNT(*) FROM events e
+            WHERE registered_count <> (SELECT COUNT(*) FROM register r WHERE r.event_id = e.event_id)
+        ''').fetchone()[0]
+        duplicates = conn.execute('''
+            SELECT COUNT(*) FROM (SELECT 1 FROM register GROUP BY event_id, customer_id HAVING COUNT(*) > 1)
+        ''').fetchone()[0]
+        waitlisted_with_seat = conn.execute('''
+            SELECT COUNT(*) FROM event_waitlist w
+            JOIN register r ON r.event_id = w.event_id AND r.customer_id = w.customer_id
+        ''').fetchone()[0]
+        waitlisted_with_room = conn.execute('''
+            SELECT COUNT(DISTINCT w.event_id) FROM event_waitlist w
+            JOIN events e ON e.event_id = w.event_id WHERE e.registered_count < e.capacity
+        ''').fetchone()[0]
+        seats, registered = conn.execute(
+            "SELECT SUM(capacity), SUM(registered_count) FROM events").fetchone()
+        conn.close()
+        library.app.extensions.pop('db_pool', None)
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"{args.clients} clients x {args.requests} registrations over {args.events} events "
+          f"of {args.capacity} seats: {total / elapsed:.0f} req/s, "
+          f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"registered {outcomes['registered']}, waitlisted {outcomes['waitlisted']}, "
+          f"already registered {outcomes[409]}, other {total - outcomes['registered'] - outcomes['waitlisted'] - outcomes[409]}")
+    print(f"seats filled {registered}/{seats}; over capacity {over_capacity}, miscounted {miscounted}, "
+          f"duplicates {duplicates}, waitlisted with a seat {waitlisted_with_seat}, "
+          f"waitlists beside free seats {waitlisted_with_room}")
+    if over_capacity or miscounted or duplicates or waitlisted_with_seat or waitlisted_with_room \
+            or registered != outcomes['registered']:
+        raise SystemExit("FAILED: registrations are inconsistent")
+
+
+# -----------------------------------------------------
+# holds: promotion cost against queue length
+# -----------------------------------------------------
+def bench_holds(args):
+    """Queues many holds on one single-copy title, then times returns (each
+    promoting the head of the queue) and checks holds are served in order."""
+    for queue in [int(length) for length in args.queue.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            build_database(path, items=10, customers=queue + 1)
+            conn = sqlite3.connect(path)
+            holder = queue + 1
+            transaction_id, _ = borrow(conn, 1, holder, '2025-06-01')
+            started = time.perf_counter()
+            run_write(conn, lambda conn: [add_hold(conn, 1, customer_id)
+                                          for customer_id in range(1, queue + 1)])
+            queued = time.perf_counter() - started
+
+            latencies, served = [], []
+            for _ in range(min(args.cycles, queue)):
+                start = time.perf_counter()
+                _, held_for = return_loan(conn, transaction_id, '2025-06-10')
+                latencies.append(time.perf_counter() - start)
+                served.append(held_for)
+                transaction_id, _ = borrow(conn, 1, held_for, '2025-06-10')
+            waiting = conn.execute("SELECT holds_waiting FROM library_items WHERE item_id = 1").fetchone()[0]
+            conn.close()
+
+        latencies.sort()
+        in_order = served == list(range(1, len(served) + 1))
+        print(f"queue {queue:>6}: queued in {queued:.2f}s; return + promote "
+              f"p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms; "
+              f"served in order {in_order}, still waiting {waiting}")
+        if not in_order or waiting != queue - len(served):
+            raise SystemExit("FAILED: holds were not served first come, first served")
+
+
+# -----------------------------------------------------
+# recommend: neighbor build time and lookup latency
+# -----------------------------------------------------
+def _snapshot(conn):
+    return [conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+            for table in ('item_pairs', 'item_neighbors', 'item_popularity')]
+
+
+def bench_recommend(args):
+    """Times a full build of the item neighbors, an incremental run after
+    more loans arrive (backdated ones too), and the lookups the pages make.
+    Fails if the incremental counts differ from a rebuild."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items,
+                                 loans=args.loans, events=0, registrations=0, seed=args.seed)
+        conn = sqlite3.connect(path)
+        full = build_neighbors(conn)
+        print(f"full build:  {full} ({full.loans_scanned / full.seconds:,.0f} loans/s)")
+
+        rng = random.Random(args.seed)
+        loans = []
+        for _ in range(args.new_loans):
+            borrowed = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            loans.append((rng.randint(1, args.customers), rng.randint(1, args.items), borrowed, borrowed))
+        run_write(conn, lambda conn: conn.executemany('''
+            INSERT INTO borrowing (customer_id, item_id, borrowed_date, due_date, returned_date)
+            VALUES (?, ?, ?, date(?, '+14 days'), date(?, '+7 days'))
+        ''', [loan + (loan[2],) for loan in loans]))
+        incremental = build_neighbors(conn)
+        print(f"incremental: {incremental}")
+        counts = _snapshot(conn)
+        build_neighbors(conn, rebuild=True)
+        matches = counts == _snapshot(conn)
+
+        latencies = defaultdict(list)
+        for _ in range(args.lookups):
+            start = time.perf_counter()
+            also_borrowed(conn, rng.randint(1, args.items))
+            latencies['readers also borrowed'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            recommended_for(conn, rng.randint(1, args.customers))
+            latencies['recommended for you'].append(time.perf_counter() - start)
+        conn.close()
+
+    for name, values in latencies.items():
+        values.sort()
+        print(f"{name:<22} p50 {percentile(values, 50) * 1000:.2f} ms, p99 {percentile(values, 99) * 1000:.2f} ms")
+    print(f"incremental counts match a rebuild: {matches}")
+    if not matches:
+        raise SystemExit("FAILED: incremental build differs from a full rebuild")
+
+
+# -----------------------------------------------------
+# reports: rollup maintenance and dashboard query time
+# -----------------------------------------------------
+# The by-genre report straight from the base tables, for comparison
+_GENRE_FROM_BASE_TABLES = '''
+    SELECT i.genre, COUNT(*) FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+    WHERE b.borrowed_date BETWEEN ? AND ? GROUP BY i.genre
+'''
+
+
+def bench_reports(args):
+    """Times a full rollup build, an incremental run after returns, fine
+    accrual and new loans, and the dashboard queries against the same report
+    from the base tables. Fails if the incremental rollup differs from a
+    rebuild."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items,
+                                 loans=args.loans, events=100, registrations=1000, seed=args.seed)
+        conn = sqlite3.connect(path)
+        print(f"full build:  {reporting.update_rollups(conn)}")
+
+        rng = random.Random(args.seed)
+        open_loans = [row[0] for row in conn.execute(
+            "SELECT transaction_id FROM borrowing WHERE returned_date IS NULL")]
+        for transaction_id in rng.sample(open_loans, min(args.changes, len(open_loans))):
+            return_loan(conn, transaction_id, date.today().isoformat())
+        assess_overdue_fines(conn, (date.today() + timedelta(days=30)).isoformat())
+        run_write(conn, lambda conn: conn.execute(
+            "UPDATE fines SET fine_status = 'Paid' WHERE fine_id IN "
+            "(SELECT fine_id FROM fines WHERE fine_status = 'Unpaid' ORDER BY random() LIMIT ?)",
+            (args.changes,)))
+        for _ in range(args.changes):
+            try:
+                borrow(conn, rng.randint(1, args.items), rng.randint(1, args.customers),
+                       date.today().isoformat())
+            except CirculationError:
+                pass
+        print(f"incremental: {reporting.update_rollups(conn)}")
+
+        def snapshot():
+            return [tuple(round(value, 6) if isinstance(value, float) else value for value in row)
+                    for row in conn.execute("SELECT * FROM daily_circulation ORDER BY 1, 2, 3")
+                    if any(row[3:])]
+        counts = snapshot()
+        reporting.update_rollups(conn, rebuild=True)
+        matches = counts == snapshot()
+
+        start, end = reporting.parse_range((date.today() - timedelta(days=365)).isoformat())
+        timings = {}
+        for name, run in (('rollup, by genre', lambda: reporting.circulation(conn, start, end, 'genre')),
+                          ('rollup, by month', lambda: reporting.circulation(conn, start, end, 'month')),
+                          ('base tables, by genre', lambda: conn.execute(_GENRE_FROM_BASE_TABLES, (start, end)))):
+            latencies = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                run().fetchall()
+                latencies.append(time.perf_counter() - started)
+            timings[name] = sorted(latencies)
+        conn.close()
+
+    for name, latencies in timings.items():
+        print(f"{name:<24} p50 {percentile(latencies, 50) * 1000:.2f} ms")
+    print(f"incremental rollup matches a rebuild: {matches}")
+    if not matches:
+        raise SystemExit("FAILED: incremental rollup differs from a rebuild")
+
+
+# -----------------------------------------------------
+# search: facet filters, facet counts and spelling correction
+# -----------------------------------------------------
+def _facet_counts_from_items(conn):
+    return sorted((facet, value, items) for facet in FACETS for value, items in conn.execute(
+        f"SELECT COALESCE({facet}, ''), COUNT(*) FROM library_items GROUP BY 1"))
+
+
+def _misspell(word, rng):
+    """word with two neighbouring letters swapped or one letter changed."""
+    i = rng.randrange(len(word) - 1)
+    if rng.random() < 0.5:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice([ch for ch in 'aeiourstln' if ch != word[i]]) + word[i + 1:]
+
+
+def bench_search(args):
+    """Times filtered listing pages, facet counts (kept vs GROUP BY) and
+    corrected searches for misspelled author names. Fails if the kept facet
+    counts differ from a recount after borrows, returns, edits and deletes."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items, loans=args.loans,
+                                 events=0, registrations=0, seed=args.seed)
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        start = time.perf_counter()
+        refresh_terms(conn)
+        refreshed = time.perf_counter() - start
+        terms = conn.execute("SELECT COUNT(*) FROM search_terms").fetchone()[0]
+
+        rng = random.Random(args.seed)
+        for _ in range(args.changes):
+            try:
+                borrow(conn, rng.randint(1, args.items), rng.randint(1, args.customers),
+                       date.today().isoformat())
+            except CirculationError:
+                pass
+        open_loans = [row[0] for row in conn.execute(
+            "SELECT transaction_id FROM borrowing WHERE returned_date IS NULL LIMIT ?", (args.changes,))]
+        for transaction_id in open_loans[::2]:
+            return_loan(conn, transaction_id, date.today().isoformat())
+        run_write(conn, lambda conn: conn.execute(
+            "UPDATE library_items SET genre = 'Poetry', format = 'Audio' WHERE item_id % 97 = 0"))
+        run_write(conn, lambda conn: conn.execute(
+            "DELETE FROM library_items WHERE item_id % 101 = 0 AND item_id NOT IN (SELECT item_id FROM borrowing)"))
+        kept = sorted(tuple(row) for row in conn.execute("SELECT facet, value, items FROM item_facets WHERE items <> 0"))
+        matches = kept == _facet_counts_from_items(conn)
+
+        page = "SELECT * FROM library_items WHERE {} AND item_id > ? ORDER BY item_id LIMIT 26"
+        queries = {
+            'page: genre + type': (page.format("genre = ? AND item_type = ?"), ('Poetry', 'Record')),
+            'page: type + format': (page.format("item_type = ? AND format = ?"), ('Journal', 'Online')),
+            'page: availability': (page.format("availability = ?"), ('Borrowed',)),
+            'page: restriction': (page.format("restriction = ?"), (18,)),
+        }
+        timings = defaultdict(list)
+        for _ in range(args.repeat):
+            for name, (sql, params) in queries.items():
+                started = time.perf_counter()
+                conn.execute(sql, params + (rng.randint(0, args.items // 2),)).fetchall()
+                timings[name].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            facet_counts(conn)
+            timings['facet counts: item_facets'].append(time.perf_counter() - started)
+        for _ in range(max(args.repeat // 10, 1)):
+            started = time.perf_counter()
+            _facet_counts_from_items(conn)
+            timings['facet counts: GROUP BY'].append(time.perf_counter() - started)
+
+        # Typos that are themselves someone's name are found as typed
+        typos = []
+        for (author,) in conn.execute("SELECT author FROM library_items ORDER BY random() LIMIT ?",
+                                      (args.repeat,)):
+            surname = author.split()[-1].lower()
+            typo = _misspell(surname, rng)
+            if not conn.execute("SELECT 1 FROM search_terms WHERE term = ?", (typo,)).fetchone():
+                typos.append((surname, typo))
+        corrected = intended = 0
+        for surname, typo in typos:
+            started = time.perf_counter()
+            rows = search_items(conn, typo, 20)
+            fixed = None if rows else correct_query(conn, typo)
+            timings['misspelling corrected'].append(time.perf_counter() - started)
+            if fixed:
+                rows = search_items(conn, fixed, 20)
+            # Ranking every title of a prolific author dominates this one
+            timings['... and its titles found'].append(time.perf_counter() - started)
+            corrected += bool(fixed and rows)
+            intended += fixed == surname
+        conn.close()
+
+    print(f"{args.items} items, {terms} distinct title/author words indexed in {refreshed:.1f}s")
+    for name, latencies in timings.items():
+        latencies.sort()
+        print(f"{name:<28} p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"misspelled surnames corrected: {corrected} of {len(typos)}, {intended} to the intended one "
+          f"(the rest to another name as few edits away)")
+    print(f"kept facet counts match a recount: {matches}")
+    if not matches:
+        raise SystemExit("FAILED: item_facets differs from the library_items it counts")
+
+
+# -----------------------------------------------------
+# eligibility: cached age and fine block checks
+# -----------------------------------------------------
+def _eligibility_from_customers(conn, day, limit):
+    """{customer_id: (age, blocked)} worked out in Python, to check the cache against."""
+    today = datetime.strptime(day, '%Y-%m-%d').date()
+    expected = {}
+    for customer_id, dob, balance in conn.execute(
+            "SELECT customer_id, dob, outstanding_fine_balance FROM customers"):
+        born = datetime.strptime(dob, '%Y-%m-%d').date()
+        age = today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+        expected[customer_id] = (max(age, 0), balance >= limit)
+    return expected
+
+
+def bench_eligibility(args):
+    """Times the eligibility check on the borrow path (cached, and worked out
+    from dob for a day outside the cached range) against parsing dob in
+    Python, and borrows with the checks. Fails if the cached ages and fine
+    blocks differ from a recount after fines, payments, dob edits and an
+    age refresh a year on."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items, loans=args.loans,
+                                 events=0, registrations=0, seed=args.seed)
+        conn = sqlite3.connect(path)
+        rng = random.Random(args.seed)
+        limit = conn.execute("SELECT value FROM eligibility_rules WHERE name = ?", (FINE_LIMIT_RULE,)).fetchone()[0]
+        customer_ids = [rng.randint(1, args.customers) for _ in range(args.repeat)]
+        today = date.today().isoformat()
+
+        def naive(customer_id):
+            dob, balance = conn.execute(
+                "SELECT dob, outstanding_fine_balance FROM customers WHERE customer_id = ?", (customer_id,)
+            ).fetchone()
+            born = datetime.strptime(dob, '%Y-%m-%d').date()
+            now = date.today()
+            return now.year - born.year - ((now.month, now.day) < (born.month, born.day)), balance >= limit
+
+        timings = defaultdict(list)
+        checks = {
+            'dob parsed in Python': naive,
+            'cached': lambda customer_id: eligibility(conn, customer_id, today),
+            'outside the cached range': lambda customer_id: eligibility(conn, customer_id, '1900-01-01'),
+        }
+        for name, check in checks.items():
+            for customer_id in customer_ids:
+                started = time.perf_counter()
+                check(customer_id)
+                timings[f"check: {name}"].append(time.perf_counter() - started)
+
+        turned_away = 0
+        for customer_id in customer_ids:
+            started = time.perf_counter()
+            try:
+                borrow(conn, rng.randint(1, args.items), customer_id, today)
+            except NotEligible:
+                turned_away += 1
+            except CirculationError:
+                pass
+            timings['borrow with checks'].append(time.perf_counter() - started)
+
+        # Fines assessed a month on, some paid, some birthdays corrected
+        assess_overdue_fines(conn, (date.today() + timedelta(days=30)).isoformat())
+        run_write(conn, lambda conn: conn.execute(
+            "UPDATE fines SET fine_status = 'Paid' WHERE fine_status = 'Unpaid' AND fine_id % 3 = 0"))
+        run_write(conn, lambda conn: conn.execute(
+            "UPDATE customers SET dob = date(dob, '-200 days') WHERE customer_id % 50 = 0"))
+        later = (date.today() + timedelta(days=365)).isoformat()
+        started = time.perf_counter()
+        moved_on = refresh_ages(conn, later)
+        refreshed = time.perf_counter() - started
+        cached = {customer_id: (age, bool(blocked)) for customer_id, age, blocked in conn.execute(
+            "SELECT customer_id, age, fine_blocked FROM customer_eligibility")}
+        matches = cached == _eligibility_from_customers(conn, later, limit)
+        blocked = sum(blocked for _, blocked in cached.values())
+        conn.close()
+
+    print(f"{args.customers} customers, {blocked} blocked by fines of ${limit:.2f} or more")
+    for name, latencies in timings.items():
+        latencies.sort()
+        print(f"{name:<34} p50 {percentile(latencies, 50) * 1000:.3f} ms, p99 {percentile(latencies, 99) * 1000:.3f} ms")
+    print(f"{turned_away} of {len(customer_ids)} borrows turned away by age or fines")
+    print(f"ages a year on: {moved_on} moved on in {refreshed:.2f}s; cache matches a recount: {matches}")
+    if not matches:
+        raise SystemExit("FAILED: customer_eligibility differs from the customers it caches")
+
+
+# -----------------------------------------------------
+# backup: writer latency during an online backup, export/restore round trip
+# -----------------------------------------------------
+def _table_checksums(path):
+    """Row count and an order-independent hash of every exported table."""
+    conn = sqlite3.connect(path)
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                          "AND name NOT LIKE 'library_items_fts%'").fetchall()
+    sums = {}
+    for (table,) in tables:
+        rows = conn.execute(f'SELECT * FROM "{table}"').fetchall()
+        sums[table] = (len(rows), sum(hash(row) for row in rows))
+    conn.close()
+    return sums
+
+
+def bench_backup(args):
+    """Times writers with no backup running, during a paged online backup and
+    during a one-step backup, then an export and restore in each format.
+    Fails if a copy is not identical to the database it came from."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items,
+                                 loans=args.loans, events=100, registrations=1000, seed=args.seed)
+        conn = sqlite3.connect(path)
+        configure_storage(conn, library.app.config)
+        conn.close()
+
+        def write_while(task):
+            """Runs task() with args.writers threads borrowing and returning; returns
+            task's result and the sorted write latencies."""
+            latencies = []
+            lock = threading.Lock()
+            done = threading.Event()
+
+            def writer(seed):
+                rng = random.Random(seed)
+                conn = sqlite3.connect(path)
+                for pragma in storage_pragmas(library.app.config):
+                    conn.execute(pragma)
+                mine = []
+                while not done.is_set():
+                    start = time.perf_counter()
+                    run_write(conn, lambda conn: conn.execute(
+                        "INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date, returned_date) "
+                        "VALUES (?, ?, date('now'), date('now', '+14 days'), date('now'))",
+                        (rng.randint(1, args.items), rng.randint(1, args.customers))))
+                    mine.append(time.perf_counter() - start)
+                conn.close()
+                with lock:
+                    latencies.extend(mine)
+
+            threads = [threading.Thread(target=writer, args=(args.seed + i,)) for i in range(args.writers)]
+            for t in threads:
+                t.start()
+            try:
+                result = task()
+            finally:
+                done.set()
+                for t in threads:
+                    t.join()
+            return result, sorted(latencies)
+
+        source = sqlite3.connect(path)
+        runs = [('no backup', write_while(lambda: time.sleep(args.seconds))[1])]
+        for label, pages in ((f'paged backup ({args.pages} pages/step)', args.pages),
+                             ('one-step backup', -1)):
+            dest = os.path.join(tmp, f'copy{pages}.db')
+            report, latencies = write_while(lambda: backup.backup(source, dest, pages=pages))
+            finish = ', then one step' if report.one_step else ''
+            runs.append((f"{label}: {report.seconds:.1f}s, {report.restarts} restarts{finish}", latencies))
+        source.close()
+
+        original = _table_checksums(path)
+        round_trips = []
+        for fmt in backup.FORMATS:
+            conn = sqlite3.connect(path)
+            start = time.perf_counter()
+            backup.export(conn, os.path.join(tmp, fmt), fmt)
+            exported = time.perf_counter() - start
+            conn.close()
+            start = time.perf_counter()
+            restored = os.path.join(tmp, f'restored-{fmt}.db')
+            backup.restore(os.path.join(tmp, fmt), restored)
+            round_trips.append((fmt, exported, time.perf_counter() - start,
+                                _table_checksums(restored) == original))
+
+    for label, latencies in runs:
+        print(f"{label:<66}{len(latencies):>7} writes, p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.2f} ms, max {latencies[-1] * 1000:.1f} ms")
+    for fmt, exported, restored, matches in round_trips:
+        print(f"{fmt:<6} export {exported:.1f}s, restore {restored:.1f}s, identical: {matches}")
+    if not all(matches for *_, matches in round_trips):
+        raise SystemExit("FAILED: a restored database differs from the original")
+
+
+# -----------------------------------------------------
+# servers: app.run (threaded WSGI) vs the ASGI entry point
+# -----------------------------------------------------
+# Each server runs in its own process against the same database file
+SERVERS = {
+    'wsgi': ("import app as library\n"
+             "library.app.config['DATABASE'] = {database!r}\n"
+             "library.init_db()\n"
+             "library.app.run(port={port}, threaded=True)\n"),
+    'asgi': ("import uvicorn, asgi\n"
+             "asgi.app.config['DATABASE'] = {database!r}\n"
+             "uvicorn.run(asgi.application, port={port}, log_level='warning')\n"),
+}
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"server on port {port} did not start")
+
+
+def _http_load(port, clients, seconds, write_pct, max_item, max_customer, seed):
+    """Drives the server over HTTP; returns (elapsed, read latencies, write latencies, errors)."""
+    reads, writes, errors = [], [], [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def client_loop(n):
+        rng = random.Random(seed + n)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine_reads, mine_writes, failed = [], [], 0
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            try:
+                if rng.random() * 100 < write_pct:
+                    body = urllib.parse.urlencode({'customer_id': rng.randint(1, max_customer),
+                                                   'borrowed_date': '2025-06-01'})
+                    conn.request('POST', f'/borrow/{rng.randint(1, max_item)}', body,
+                                 {'Content-Type': 'application/x-www-form-urlencoded'})
+                    target = mine_writes
+                else:
+                    path = rng.choice((f'/items?after={rng.randint(0, max_item)}',
+                                       f'/items?q={rng.choice(populate.WORDS).lower()}',
+                                       f'/api/v1/items/{rng.randint(1, max_item)}'))
+                    conn.request('GET', path)
+                    target = mine_reads
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                continue
+            target.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            reads.extend(mine_reads)
+            writes.extend(mine_writes)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.monotonic() - started, sorted(reads), sorted(writes), errors[0]
+
+
+def bench_servers(args):
+    servers = args.servers.split(',')
+    if 'asgi' in servers and importlib.util.find_spec('uvicorn') is None:
+        print("uvicorn is not installed; skipping asgi (pip install uvicorn)")
+        servers.remove('asgi')
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        populate.generate_tables(path, customers=args.customers, items=args.items,
+                                 loans=args.loans, events=100, registrations=1000, seed=args.seed)
+
+        print(f"{'server':<8}{'clients':>8}{'req/s':>9}{'read p50':>10}{'read p99':>10}"
+              f"{'write p50':>11}{'write p99':>11}{'errors':>8}")
+        for name in servers:
+            script = SERVERS[name].format(database=path, port=args.port)
+            server = subprocess.Popen([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                _wait_for_port(args.port)
+                for clients in levels:
+                    elapsed, reads, writes, errors = _http_load(
+                        args.port, clients, args.seconds, args.write_pct,
+                        args.items, args.customers, args.seed)
+                    print(f"{name:<8}{clients:>8}{(len(reads) + len(writes)) / elapsed:>9.1f}"
+                          f"{percentile(reads, 50) * 1000:>10.2f}{percentile(reads, 99) * 1000:>10.2f}"
+                          f"{percentile(writes, 50) * 1000:>11.2f}{percentile(writes, 99) * 1000:>11.2f}"
+                          f"{errors:>8}")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    scenarios = parser.add_subparsers(dest='scenario', required=True)
+
+    storage = scenarios.add_parser('storage', help='mixed readers/writers, journal vs WAL')
+    storage.add_argument('--readers', type=int, default=8)
+    storage.add_argument('--writers', type=int, default=4)
+    storage.add_argument('--seconds', type=float, default=5.0)
+    storage.add_argument('--items', type=int, default=20000)
+    storage.add_argument('--customers', type=int, default=2000)
+    storage.set_defaults(run=bench_storage)
+
+    routes = scenarios.add_parser('routes', help='latency percentiles per endpoint')
+    routes.add_argument('--clients', type=int, default=8)
+    routes.add_argument('--seconds', type=float, default=10.0)
+    routes.add_argument('--database', help='use an existing database (written to unless --write-weight 0)')
+    routes.add_argument('--customers', type=int, default=10000)
+    routes.add_argument('--items', type=int, default=50000)
+    routes.add_argument('--loans', type=int, default=200000)
+    routes.add_argument('--events', type=int, default=500)
+    routes.add_argument('--write-weight', type=int, default=2,
+                        help='relative weight of POST /borrow and POST /donate (0 = read only)')
+    routes.add_argument('--seed', type=int, default=42)
+    routes.add_argument('--instrument', action='store_true',
+                        help='run with query/render instrumentation on, to measure its overhead')
+    routes.set_defaults(run=bench_routes)
+
+    stress = scenarios.add_parser('borrow-stress', help='concurrent borrows of the same items')
+    stress.add_argument('--clients', type=int, default=32)
+    stress.add_argument('--rounds', type=int, default=50)
+    stress.add_argument('--items', type=int, default=5)
+    stress.add_argument('--customers', type=int, default=500)
+    stress.add_argument('--copies', type=int, default=1, help='copies of each item')
+    stress.add_argument('--seed', type=int, default=42)
+    stress.set_defaults(run=bench_borrow_stress)
+
+    holds = scenarios.add_parser('holds', help='hold promotion time against queue length')
+    holds.add_argument('--queue', default='100,10000,50000', help='comma-separated queue lengths')
+    holds.add_argument('--cycles', type=int, default=200, help='returns timed per queue length')
+    holds.set_defaults(run=bench_holds)
+
+    recommend = scenarios.add_parser('recommend', help='item neighbor build time and lookup latency')
+    recommend.add_argument('--customers', type=int, default=10000)
+    recommend.add_argument('--items', type=int, default=50000)
+    recommend.add_argument('--loans', type=int, default=200000)
+    recommend.add_argument('--new-loans', type=int, default=10000, help='loans added before the incremental run')
+    recommend.add_argument('--lookups', type=int, default=1000)
+    recommend.add_argument('--seed', type=int, default=42)
+    recommend.set_defaults(run=bench_recommend)
+
+    reports = scenarios.add_parser('reports', help='rollup maintenance and dashboard query time')
+    reports.add_argument('--customers', type=int, default=10000)
+    reports.add_argument('--items', type=int, default=50000)
+    reports.add_argument('--loans', type=int, default=200000)
+    reports.add_argument('--changes', type=int, default=1000,
+                         help='returns, payments and loans before the incremental run')
+    reports.add_argument('--repeat', type=int, default=20, help='times each dashboard query is run')
+    reports.add_argument('--seed', type=int, default=42)
+    reports.set_defaults(run=bench_reports)
+
+    search = scenarios.add_parser('search', help='facet filters, facet counts and spelling correction')
+    search.add_argument('--customers', type=int, default=10000)
+    search.add_argument('--items', type=int, default=1000000)
+    search.add_argument('--loans', type=int, default=0)
+    search.add_argument('--changes', type=int, default=1000, help='borrows, then returns of half, before the check')
+    search.add_argument('--repeat', type=int, default=200)
+    search.add_argument('--seed', type=int, default=42)
+    search.set_defaults(run=bench_search)
+
+    allowed = scenarios.add_parser('eligibility', help='cached age and fine block checks on borrow')
+    allowed.add_argument('--customers', type=int, default=100000)
+    allowed.add_argument('--items', type=int, default=50000)
+    allowed.add_argument('--loans', type=int, default=200000)
+    allowed.add_argument('--repeat', type=int, default=2000, help='checks and borrows timed')
+    allowed.add_argument('--seed', type=int, default=42)
+    allowed.set_defaults(run=bench_eligibility)
+
+    copies = scenarios.add_parser('backup', help='writer latency during backups, export/restore time')
+    copies.add_argument('--customers', type=int, default=10000)
+    copies.add_argument('--items', type=int, default=50000)
+    copies.add_argument('--loans', type=int, default=200000)
+    copies.add_argument('--writers', type=int, default=4)
+    copies.add_argument('--pages', type=int, default=backup.BACKUP_PAGES_PER_STEP, help='pages per backup step')
+    copies.add_argument('--seconds', type=float, default=3.0, help='writes timed with no backup running')
+    copies.add_argument('--seed', type=int, default=42)
+    copies.set_defaults(run=bench_backup)
+
+    seats = scenarios.add_parser('register-stress', help='concurrent registrations for small events')
+    seats.add_argument('--clients', type=int, default=32)
+    seats.add_argument('--requests', type=int, default=50, help='registrations per client')
+    seats.add_argument('--events', type=int, default=5)
+    seats.add_argument('--capacity', type=int, default=100)
+    seats.add_argument('--customers', type=int, default=2000)
+    seats.add_argument('--seed', type=int, default=42)
+    seats.set_defaults(run=bench_register_stress)
+
+    servers = scenarios.add_parser('servers', help='app.run vs ASGI under rising concurrency')
+    servers.add_argument('--servers', default='wsgi,asgi')
+    servers.add_argument('--concurrency', default='1,4,16,64')
+    servers.add_argument('--seconds', type=float, default=5.0)
+    servers.add_argument('--write-pct', type=float, default=10.0, help='percent of requests that borrow')
+    servers.add_argument('--customers', type=int, default=5000)
+    servers.add_argument('--items', type=int, default=20000)
+    servers.add_argument('--loans', type=int, default=50000)
+    servers.add_argument('--port', type=int, default=8765)
+    servers.add_argument('--seed', type=int, default=42)
+    servers.set_defaults(run=bench_servers)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+# bulk_import.py
+"""Streaming bulk import of catalog records into library_items.
+
+Reads CSV (with a header row) or JSON Lines one record at a time, validates
+each record against the library_items CHECK constraints in Python, and inserts
+the good ones in large batches, one transaction per batch. A record for a
+title the catalog already holds adds a copy to it, as a donation does. Bad
+records are counted and reported instead of aborting the import.
+
+    python bulk_import.py branch_collection.csv
+    python bulk_import.py branch_collection.jsonl --chunk-size 20000
+"""
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import time
+from datetime import date
+
+from db import get_watermark, run_write, set_watermark
+from holds import promote_next
+from search import add_terms, fts5_available, pause_terms, resume_terms
+
+# Must match the CHECK constraints on library_items in init_db
+ITEM_TYPES = ('Book', 'CD', 'DVD', 'Magazine', 'Journal', 'Record')
+FORMATS = ('Print', 'Online', 'Audio', 'Video')
+AVAILABILITY = ('Available', 'Borrowed')
+
+COLUMNS = ('title', 'author', 'item_type', 'format', 'genre', 'published_date',
+           'availability', 'is_future_item', 'restriction')
+
+# watermarks entry: the first item_id inserted while indexes are deferred
+DEFERRED_FROM = 'deferred_import_from'
+
+INSERT_SQL = f'''
+    INSERT INTO library_items ({', '.join(COLUMNS)})
+    VALUES ({', '.join('?' for _ in COLUMNS)})
+'''
+
+# A title the library already holds: every descriptive column agrees, as in
+# migration 10. Parameters are a row in COLUMNS order, less availability. The
+# title is far more selective than the filter indexes on the other columns
+# the planner would otherwise pick.
+FIND_TITLE_SQL = '''
+    SELECT item_id FROM library_items INDEXED BY idx_items_title_author
+    WHERE title = ? AND author IS ? AND item_type IS ? AND format IS ? AND genre IS ?
+      AND published_date IS ? AND is_future_item = ? AND restriction IS ?
+    LIMIT 1
+'''
+
+
+class BulkImportError(Exception):
+    """Raised for problems with the import as a whole (not a single row)."""
+
+
+class ImportReport:
+    """Counters for one import run."""
+
+    def __init__(self, max_rejects=100):
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.copies_added = 0  # rows that were another copy of a title already held
+        self.rows_rejected = 0
+        self.rejected = []  # (line number, reason), first max_rejects only
+        self.max_rejects = max_rejects
+        self.seconds = 0.0
+
+    def reject(self, line_no, reason):
+        self.rows_rejected += 1
+        if len(self.rejected) < self.max_rejects:
+            self.rejected.append((line_no, reason))
+
+    @property
+    def rows_per_second(self):
+        return self.rows_imported / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows_read': self.rows_read,
+            'rows_imported': self.rows_imported,
+            'copies_added': self.copies_added,
+            'rows_rejected': self.rows_rejected,
+            'rejected': [{'line': line, 'reason': reason} for line, reason in self.rejected],
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def detect_format(filename):
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise BulkImportError(f"Can't tell the format of {filename!r}; use .csv or .jsonl")
+
+
+def read_records(stream, fmt):
+    """Yields (line number, record dict or None, parse error) from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, "expected a JSON object"
+                continue
+            yield line_no, record, None
+    else:
+        raise BulkImportError(f"Unknown format {fmt!r}")
+
+
+def _text(record, key):
+    value = record.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate(record):
+    """Returns (row tuple, None) for a valid record or (None, reason)."""
+    title = _text(record, 'title')
+    if not title:
+        return None, "title is required"
+
+    item_type = _text(record, 'item_type')
+    if item_type is not None and item_type not in ITEM_TYPES:
+        return None, f"item_type {item_type!r} is not one of {', '.join(ITEM_TYPES)}"
+
+    format_ = _text(record, 'format')
+    if format_ is not None and format_ not in FORMATS:
+        return None, f"format {format_!r} is not one of {', '.join(FORMATS)}"
+
+    availability = _text(record, 'availability') or 'Available'
+    if availability not in AVAILABILITY:
+        return None, f"availability {availability!r} is not one of {', '.join(AVAILABILITY)}"
+
+    is_future_item = _text(record, 'is_future_item') or '0'
+    if is_future_item.lower() in ('0', 'false', 'no'):
+        is_future_item = 0
+    elif is_future_item.lower() in ('1', 'true', 'yes'):
+        is_future_item = 1
+    else:
+        return None, f"is_future_item {is_future_item!r} must be 0 or 1"
+
+    try:
+        restriction = int(_text(record, 'restriction') or 0)
+    except ValueError:
+        return None, "restriction must be a whole number"
+    if restriction < 0:
+        return None, "restriction must be >= 0"
+
+    return (title, _text(record, 'author'), item_type, format_, _text(record, 'genre'),
+            _text(record, 'published_date'), availability, is_future_item, restriction), None
+
+
+def add_item(conn, row):
+    """Adds a row (in COLUMNS order) to the catalog inside the caller's transaction.
+
+    Another copy of a title the library already holds goes on that title's
+    record, or is set aside for the first customer holding it, as a returned
+    copy is; anything else becomes a new title with one copy. Returns True if
+    it added a copy to an existing title.
+    """
+    availability = row[COLUMNS.index('availability')]
+    existing = conn.execute(FIND_TITLE_SQL, [value for column, value in zip(COLUMNS, row)
+                                             if column != 'availability']).fetchone()
+    if existing:
+        conn.execute("INSERT INTO item_copies (item_id, status) VALUES (?, ?)", (existing[0], availability))
+        promote_next(conn, existing[0], date.today().isoformat())
+        return True
+    conn.execute(INSERT_SQL, row)
+    return False
+
+
+def defer_index_maintenance(conn):
+    """Drops library_items secondary indexes and the FTS insert trigger.
+
+    idx_items_title_author stays: add_item looks each row's title up in it.
+
+    What is dropped is saved in deferred_indexes in the same transaction, with
+    the first item_id inserted after it in watermarks, so an import that dies
+    part way is finished by restore_index_maintenance at the next startup.
+    Returns False, dropping nothing, if another import has already deferred
+    them.
+    """
+    def drop(conn):
+        if conn.execute("SELECT 1 FROM deferred_indexes LIMIT 1").fetchone():
+            return False
+        set_watermark(conn, DEFERRED_FROM, conn.execute(
+            "SELECT COALESCE(MAX(item_id), 0) + 1 FROM library_items").fetchone()[0])
+        conn.execute('''
+            INSERT INTO deferred_indexes (name, sql)
+            SELECT name, sql FROM sqlite_master
+            WHERE tbl_name = 'library_items' AND sql IS NOT NULL
+              AND ((type = 'index' AND name <> 'idx_items_title_author') OR name = 'library_items_fts_insert')
+        ''')
+        for kind, name in conn.execute('''
+            SELECT type, name FROM sqlite_master WHERE name IN (SELECT name FROM deferred_indexes)
+        ''').fetchall():
+            conn.execute(f"DROP {kind.upper()} {name}")
+        return True
+
+    return run_write(conn, drop)
+
+
+def restore_index_maintenance(conn):
+    """Recreates what defer_index_maintenance dropped and indexes the rows added since.
+
+    Does nothing when nothing is deferred. Returns True if it restored anything.
+    """
+    def restore(conn):
+        deferred = conn.execute("SELECT name, sql FROM deferred_indexes").fetchall()
+        if not deferred:
+            return False
+        if fts5_available():
+            conn.execute('''
+                INSERT INTO library_items_fts (rowid, title, author, genre)
+                SELECT item_id, title, author, genre FROM library_items WHERE item_id >= ?
+            ''', (get_watermark(conn, DEFERRED_FROM),))
+        for name, sql in deferred:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone():
+                conn.execute(sql)
+        conn.execute("DELETE FROM deferred_indexes")
+        conn.execute("DELETE FROM watermarks WHERE name = ?", (DEFERRED_FROM,))
+        return True
+
+    return run_write(conn, restore)
+
+
+def import_items(conn, stream, fmt, chunk_size=10000, defer_indexes=True, progress=None):
+    """Streams records from a text stream into library_items.
+
+    Only one chunk of validated rows is held in memory at a time. With
+    defer_indexes, secondary indexes and search indexing are suspended for the
+    duration and caught up once at the end, which is much cheaper than
+    maintaining them row by row. That is for offline loads only: every other
+    connection loses the indexes meanwhile. `progress(report)` is called
+    after each chunk.
+    """
+    report = ImportReport()
+    start = time.perf_counter()
+    deferred = defer_index_maintenance(conn) if defer_indexes else False
+
+    def insert_rows(conn, rows):
+        # The new titles' words are added in one statement, not row by row
+        first = conn.execute("SELECT COALESCE(MAX(item_id), 0) + 1 FROM library_items").fetchone()[0]
+        pause_terms(conn)
+        copies = sum(add_item(conn, row) for row in rows)
+        resume_terms(conn)
+        add_terms(conn, first)
+        return copies
+
+    def insert_chunk(rows):
+        report.copies_added += run_write(conn, lambda conn: insert_rows(conn, rows))
+        report.rows_imported += len(rows)
+        if progress:
+            report.seconds = time.perf_counter() - start
+            progress(report)
+
+    try:
+        chunk = []
+        for line_no, record, error in read_records(stream, fmt):
+            report.rows_read += 1
+            row = None
+            if error is None:
+                row, error = validate(record)
+            if error:
+                report.reject(line_no, error)
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            insert_chunk(chunk)
+    finally:
+        if deferred:
+            restore_index_maintenance(conn)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import catalog records into library_items.')
+    parser.add_argument('path', help='a .csv (with header) or .jsonl file')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='override the file extension')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--no-defer-indexes', action='store_true',
+                        help='maintain indexes row by row (for small imports into a big catalog)')
+    args = parser.parse_args()
+
+    import app as library
+    library.setup_schema()
+    conn = sqlite3.connect(library.app.config['DATABASE'])
+    for pragma in library.db.storage_pragmas(library.app.config):
+        conn.execute(pragma)
+
+    def show_progress(report):
+        print(f"  {report.rows_imported} rows imported ({report.rows_per_second:.0f} rows/s), "
+              f"{report.rows_rejected} rejected")
+
+    fmt = args.format or detect_format(args.path)
+    with io.open(args.path, encoding='utf-8', newline='') as stream:
+        report = import_items(conn, stream, fmt, chunk_size=args.chunk_size,
+                              defer_indexes=not args.no_defer_indexes, progress=show_progress)
+    conn.close()
+
+    print(f"Imported {report.rows_imported} of {report.rows_read} rows in {report.seconds:.1f}s "
+          f"({report.rows_per_second:.0f} rows/s); {report.rows_rejected} rejected.")
+    for line_no, reason in report.rejected:
+        print(f"  line {line_no}: {reason}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# cache.py
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request, session
+
+from db import get_db
+
+
+class ResponseCache:
+    """A bounded LRU cache with a time-to-live per entry.
+
+    Holds at most `max_entries` values; adding one more evicts the least
+    recently used. Entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, max_entries=512, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, time stored)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored = entry
+            if time.monotonic() - stored > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def data_versions(conn, names):
+    """Returns the current version counters for names, in order.
+
+    The counters live in the data_versions table and are bumped by triggers on
+    every write to the table they are named after, in the same transaction, so
+    a changed version means the data really changed - whichever route, process
+    or script made the write.
+    """
+    if not names:
+        return ()
+    rows = dict(conn.execute(
+        f"SELECT name, version FROM data_versions WHERE name IN ({', '.join('?' for _ in names)})",
+        names
+    ).fetchall())
+    return tuple(rows.get(name, 0) for name in names)
+
+
+def get_cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get('response_cache')
+    if cache is None:
+        cache = app.extensions.setdefault('response_cache', ResponseCache(
+            app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL']))
+    return cache
+
+
+def cached_view(*tables, vary=None):
+    """Caches a view's rendered HTML until one of `tables` changes.
+
+    The cache key is the endpoint, the query string and the data versions of
+    `tables`, so a write to any of them makes the old pages unreachable (they
+    age out of the LRU). `vary`, if given, is called per request and its
+    result added to the key, for pages that differ by who is asking. Only
+    plain GETs are cached, and never a page that is about to show flash
+    messages.
+    """
+    names = tuple(tables)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if (request.method != 'GET' or not current_app.config['RESPONSE_CACHE_ENABLED']
+                    or '_flashes' in session):
+                return view(*args, **kwargs)
+
+            cache = get_cache()
+            key = (request.endpoint, tuple(sorted(kwargs.items())), request.query_string,
+                   data_versions(get_db(), names), vary() if vary else None)
+            body = cache.get(key)
+            if body is None:
+                body = view(*args, **kwargs)
+                if not isinstance(body, str):
+                    return body  # redirects and errors are not cached
+                cache.set(key, body)
+            return body
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    app.config.setdefault('RESPONSE_CACHE_ENABLED', True)
+    app.config.setdefault('RESPONSE_CACHE_SIZE', 512)
+    app.config.setdefault('RESPONSE_CACHE_TTL', 300.0)
@@ -0,0 +1,193 @@
+# circulation.py
+"""Borrowing and returning items.
+
+Each operation is a single write transaction started with BEGIN IMMEDIATE
+(see db.run_write), so checks and changes cannot interleave with another
+request: a copy of the item is claimed with a conditional UPDATE that only
+succeeds while it is still Available, and two requests for the last copy
+get one loan and one ItemUnavailable. The loan records the copy, and the
+update_item_returned trigger puts that copy back when the loan is closed.
+Both are single-row indexed writes, however many copies a title has. A
+returned copy then goes to the first customer holding the item, if any
+(see holds.py), in the same transaction. A customer under the item's age
+restriction or blocked by unpaid fines is turned away first, from the
+cached eligibility (see eligibility.py).
+"""
+from datetime import datetime, timedelta
+
+from db import run_write
+from eligibility import eligibility
+from fines import finalize_fine
+from holds import clear_hold, held_copy, promote_next
+
+LOAN_DAYS = 14
+
+
+class CirculationError(Exception):
+    """A borrow or return that cannot go ahead; `status` is the HTTP status."""
+    status = 400
+
+
+class NotFound(CirculationError):
+    status = 404
+
+
+class ItemUnavailable(CirculationError):
+    status = 409
+
+
+class AlreadyReturned(CirculationError):
+    status = 409
+
+
+class NotEligible(CirculationError):
+    status = 403
+
+
+def parse_date(value, field):
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d')
+    except ValueError:
+        raise CirculationError(f"Enter the {field} as YYYY-MM-DD.")
+
+
+def parse_id(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CirculationError(f"Enter a valid {field}.")
+
+
+def due_date_for(borrowed_date):
+    """Due date of a loan made on borrowed_date (YYYY-MM-DD)."""
+    return (parse_date(borrowed_date, 'borrow date') + timedelta(days=LOAN_DAYS)).strftime('%Y-%m-%d')
+
+
+def claim_item(conn, item_id, customer_id, borrowed_date, due_date):
+    """Records a loan inside the caller's write transaction; returns its transaction_id."""
+    allowed = eligibility(conn, customer_id, borrowed_date)
+    if allowed is None:
+        raise NotFound(f"Customer {customer_id} not found.")
+    age, fine_blocked = allowed
+    if fine_blocked:
+        raise NotEligible("Your unpaid fines are over the limit. Please pay them before borrowing.")
+    restriction = conn.execute("SELECT restriction FROM library_items WHERE item_id = ?", (item_id,)).fetchone()
+    if restriction and (restriction[0] or 0) > age:
+        raise NotEligible(f"This item is for ages {restriction[0]} and over.")
+
+    # A copy set aside for this customer's hold is already theirs
+    copy_id = held_copy(conn, item_id, customer_id)
+    if copy_id is None:
+        copy = conn.execute('''
+            SELECT c.copy_id FROM library_items i
+            JOIN item_copies c ON c.item_id = i.item_id AND c.status = 'Available'
+            WHERE i.item_id = ? AND i.is_future_item = 0
+            LIMIT 1
+        ''', (item_id,)).fetchone()
+        # Only one request can flip a copy Available -> Borrowed
+        claimed = copy is not None and conn.execute(
+            "UPDATE item_copies SET status = 'Borrowed' WHERE copy_id = ? AND status = 'Available'",
+            (copy[0],)
+        ).rowcount
+        if not claimed:
+            if conn.execute("SELECT 1 FROM library_items WHERE item_id = ?", (item_id,)).fetchone() is None:
+                raise NotFound("Item not found.")
+            raise ItemUnavailable("Sorry, this item is not available to borrow right now.")
+        copy_id = copy[0]
+    clear_hold(conn, item_id, customer_id)
+
+    return conn.execute('''
+        INSERT INTO borrowing (item_id, copy_id, customer_id, borrowed_date, due_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (item_id, copy_id, customer_id, borrowed_date, due_date)).lastrowid
+
+
+def close_loan(conn, transaction_id, returned_date):
+    """Closes a loan inside the caller's write transaction.
+
+    Returns (fine amount, customer_id the returned copy is now held for or None).
+    """
+    # Settle the fine ($1/day after 15 days), including any the overdue
+    # job has already accrued
+    amount_of_fine = finalize_fine(conn, transaction_id, returned_date)
+
+    # Update the borrowing record with the returned date, once
+    closed = conn.execute('''
+        UPDATE borrowing
+        SET returned_date = ?, amount_of_fine = ?
+        WHERE transaction_id = ? AND returned_date IS NULL
+    ''', (returned_date, amount_of_fine, transaction_id)).rowcount
+    if not closed:
+        row = conn.execute(
+            "SELECT returned_date FROM borrowing WHERE transaction_id = ?", (transaction_id,)
+        ).fetchone()
+        if row is None:
+            raise NotFound("Transaction not found.")
+        raise AlreadyReturned(f"This item was already returned on {row[0]}")
+
+    item_id = conn.execute(
+        "SELECT item_id FROM borrowing WHERE transaction_id = ?", (transaction_id,)
+    ).fetchone()[0]
+    return amount_of_fine, promote_next(conn, item_id, returned_date)
+
+
+def borrow(conn, item_id, customer_id, borrowed_date):
+    """Lends item_id to customer_id; returns (transaction_id, due_date).
+
+    Raises NotFound for an unknown item or customer, NotEligible if the
+    customer is too young for the item or blocked by fines, and
+    ItemUnavailable if every copy is out or the item is not yet in the
+    collection.
+    """
+    customer_id = parse_id(customer_id, 'Customer ID')
+    due_date = due_date_for(borrowed_date)
+    return run_write(conn, lambda conn: claim_item(conn, item_id, customer_id, borrowed_date, due_date)), due_date
+
+
+def return_loan(conn, transaction_id, returned_date):
+    """Closes a loan and settles its fine; returns (fine amount, held for), see close_loan.
+
+    Raises NotFound for an unknown transaction and AlreadyReturned if the loan
+    was closed already (including by a concurrent request).
+    """
+    transaction_id = parse_id(transaction_id, 'Transaction ID')
+    parse_date(returned_date, 'return date')
+    return run_write(conn, lambda conn: close_loan(conn, transaction_id, returned_date))
+
+
+def run_batch(conn, entries, apply):
+    """Runs apply(conn, entry) for every entry in one write transaction.
+
+    Each entry gets its own savepoint, so one that fails with a
+    CirculationError is undone on its own and the rest still commit together.
+    Returns a list of (result, None) or (None, error), in entry order.
+    """
+    def run(conn):
+        results = []
+        for entry in entries:
+            conn.execute("SAVEPOINT batch_entry")
+            try:
+                results.append((apply(conn, entry), None))
+            except CirculationError as e:
+                conn.execute("ROLLBACK TO batch_entry")
+                results.append((None, e))
+            conn.execute("RELEASE batch_entry")
+        return results
+    return run_write(conn, run)
+
+
+def borrow_many(conn, loans, borrowed_date):
+    """Lends each (item_id, customer_id) pair in one transaction; see run_batch.
+
+    Successful results are (transaction_id, due_date).
+    """
+    due_date = due_date_for(borrowed_date)
+    return run_batch(conn, loans, lambda conn, loan: (
+        claim_item(conn, loan[0], loan[1], borrowed_date, due_date), due_date))
+
+
+def return_many(conn, transaction_ids, returned_date):
+    """Closes each loan in one transaction; see run_batch. Results are as for close_loan."""
+    parse_date(returned_date, 'return date')
+    return run_batch(conn, transaction_ids,
+                     lambda conn, transaction_id: close_loan(conn, transaction_id, returned_date))
@@ -0,0 +1,321 @@
+# db.py
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+
+from flask import current_app, g
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the pool timeout."""
+
+
+class ConnectionPool:
+    """A bounded pool of SQLite connections shared by request threads.
+
+    Connections are opened lazily up to `size`, set up once (row_factory and
+    `pragmas`) and then reused, so a request only pays for a queue get/put
+    instead of a file open. When every connection is checked out, acquire()
+    waits up to `timeout` seconds for one to be released.
+
+    A pool belongs to the process that created it (`pid`): SQLite connections
+    must not be used on both sides of a fork.
+    """
+
+    def __init__(self, database, size=5, timeout=10.0, pragmas=()):
+        self.pid = os.getpid()
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = tuple(pragmas)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._checkout_seconds = 0.0
+        self._max_checkout_seconds = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Checks out a connection, opening a new one if the pool has room."""
+        start = time.perf_counter()
+        conn = None
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._waits += 1
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f"no database connection free after {self.timeout}s "
+                        f"(pool size {self.size})"
+                    )
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._waits += waited
+            self._checkout_seconds += elapsed
+            self._max_checkout_seconds = max(self._max_checkout_seconds, elapsed)
+        return conn
+
+    def release(self, conn):
+        """Returns a connection to the pool, rolling back anything left open."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # A broken connection is dropped rather than handed out again
+            conn.close()
+            with self._lock:
+                self._in_use -= 1
+                self._opened -= 1
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Closes idle connections; checked-out ones are closed on release."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def stats(self):
+        """Returns a snapshot of pool usage counters."""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'in_use': self._in_use,
+                'idle': self._opened - self._in_use,
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'avg_checkout_ms': round(self._checkout_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+                'max_checkout_ms': round(self._max_checkout_seconds * 1000, 3),
+            }
+
+
+# -----------------------------------------------------
+# Storage configuration
+# -----------------------------------------------------
+def storage_pragmas(config):
+    """Per-connection PRAGMAs for the DB_* storage settings in config."""
+    return (
+        f"PRAGMA synchronous = {config['DB_SYNCHRONOUS']}",
+        f"PRAGMA cache_size = {int(config['DB_CACHE_SIZE'])}",
+        f"PRAGMA mmap_size = {int(config['DB_MMAP_SIZE'])}",
+        f"PRAGMA temp_store = {config['DB_TEMP_STORE']}",
+        f"PRAGMA busy_timeout = {int(config['DB_BUSY_TIMEOUT_MS'])}",
+    )
+
+
+def configure_storage(conn, config):
+    """Sets the journal mode, which is stored in the database file itself.
+
+    In WAL mode readers keep reading the last committed snapshot while a
+    writer appends to the log, so /items no longer waits on borrows/returns.
+    """
+    conn.execute(f"PRAGMA journal_mode = {config['DB_JOURNAL_MODE']}")
+
+
+_write_lock = threading.Lock()
+_write_stats = {'commits': 0, 'retries': 0, 'busy_failures': 0, 'checkpoints': 0}
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def checkpoint(conn, mode='PASSIVE'):
+    """Copies committed WAL pages back into the database file.
+
+    PASSIVE never blocks readers or writers; TRUNCATE also resets the WAL file
+    and is meant for maintenance windows. Returns (busy, log pages, checkpointed
+    pages) as reported by SQLite.
+    """
+    row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    with _write_lock:
+        _write_stats['checkpoints'] += 1
+    return tuple(row)
+
+
+def run_write(conn, work, retries=5, backoff=0.05, checkpoint_every=1000):
+    """Runs work(conn) in a write transaction and commits it.
+
+    The transaction starts with BEGIN IMMEDIATE so the write lock is taken
+    before any statement runs; if another process holds it, SQLite waits for
+    busy_timeout and we then retry the whole transaction up to `retries` times
+    with jittered exponential backoff. `work` may therefore run more than once
+    and must not have side effects outside the database. Every
+    `checkpoint_every` commits a PASSIVE checkpoint keeps the WAL short.
+    """
+    for attempt in range(retries + 1):
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            result = work(conn)
+            conn.commit()
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not _is_busy(e):
+                raise
+            if attempt == retries:
+                with _write_lock:
+                    _write_stats['busy_failures'] += 1
+                raise
+            with _write_lock:
+                _write_stats['retries'] += 1
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            continue
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        with _write_lock:
+            _write_stats['commits'] += 1
+            due = checkpoint_every and _write_stats['commits'] % checkpoint_every == 0
+        if due:
+            try:
+                checkpoint(conn)
+            except sqlite3.OperationalError:
+                pass  # not in WAL mode, or another checkpoint is running
+        return result
+
+
+def write_db(work):
+    """run_write() on the current request's connection with app settings."""
+    config = current_app.config
+    return run_write(
+        get_db(), work,
+        retries=config['DB_WRITE_RETRIES'],
+        backoff=config['DB_WRITE_BACKOFF'],
+        checkpoint_every=config['DB_CHECKPOINT_EVERY'],
+    )
+
+
+def write_stats():
+    """Returns a snapshot of write transaction counters."""
+    with _write_lock:
+        return dict(_write_stats)
+
+
+def get_watermark(conn, name):
+    """Returns the high-water mark `name` from the watermarks table (0 if unset)."""
+    row = conn.execute("SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def set_watermark(conn, name, value):
+    conn.execute('''
+        INSERT INTO watermarks (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+    ''', (name, value))
+
+
+# -----------------------------------------------------
+# Flask integration
+# -----------------------------------------------------
+_pool_lock = threading.Lock()
+
+
+def get_pool(app=None):
+    """Returns the app's connection pool, creating it on first use.
+
+    A worker forked from a process that already had a pool gets a fresh one;
+    the inherited connections are abandoned, not closed, since closing them
+    could disturb the parent's locks.
+    """
+    app = app or current_app
+    pool = app.extensions.get('db_pool')
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            pool = app.extensions.get('db_pool')
+            if pool is None or pool.pid != os.getpid():
+                pool = ConnectionPool(
+                    app.config['DATABASE'],
+                    size=app.config['DB_POOL_SIZE'],
+                    timeout=app.config['DB_POOL_TIMEOUT'],
+                    pragmas=storage_pragmas(app.config) + tuple(app.config['DB_PRAGMAS']),
+                )
+                app.extensions['db_pool'] = pool
+    return pool
+
+
+def get_db():
+    """Returns the connection for the current app context.
+
+    The first call in a request checks a connection out of the pool; later
+    calls reuse it. It goes back to the pool when the app context tears down,
+    so routes never have to close it themselves.
+    """
+    if 'db' not in g:
+        conn = get_pool().acquire()
+        # e.g. instrument.wrap_connection; the wrapper keeps the pooled
+        # connection in `raw`
+        wrap = current_app.extensions.get('db_wrapper')
+        g.db = wrap(conn) if wrap else conn
+    return g.db
+
+
+def release_db(exception=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(getattr(conn, 'raw', conn))
+
+
+def init_app(app):
+    """Registers pool/storage defaults and the teardown that releases connections."""
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+    app.config.setdefault('DB_PRAGMAS', ())
+    app.config.setdefault('DB_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('DB_SYNCHRONOUS', 'NORMAL')  # durable at checkpoints in WAL mode
+    app.config.setdefault('DB_CACHE_SIZE', -64000)  # negative = KiB, so 64 MB
+    app.config.setdefault('DB_MMAP_SIZE', 256 * 1024 * 1024)
+    app.config.setdefault('DB_TEMP_STORE', 'MEMORY')
+    app.config.setdefault('DB_BUSY_TIMEOUT_MS', 5000)
+    app.config.setdefault('DB_WRITE_RETRIES', 5)
+    app.config.setdefault('DB_WRITE_BACKOFF', 0.05)
+    app.config.setdefault('DB_CHECKPOINT_EVERY', 1000)
+    app.teardown_appcontext(release_db)
@@ -0,0 +1,118 @@
+# eligibility.py
+"""Who may borrow an item or register for an event.
+
+library_items.restriction and events.restriction are minimum ages, and a
+customer whose unpaid fines reach the fine block limit cannot borrow.
+Working a customer's age out of customers.dob on every borrow would put
+date arithmetic on the busiest write paths, so customer_eligibility keeps
+each customer's age with the days it holds for (from their last birthday up
+to their next) and whether they are blocked by fines. Triggers on customers
+keep it current in the same transaction as the change: a new customer or a
+corrected dob recomputes the age, and every move of outstanding_fine_balance
+(which the fine triggers maintain) re-tests the block.
+
+A check for a day inside the cached range is one primary key read; only a
+day outside it (a backdated loan, a birthday since the last refresh) works
+the age out from dob, in SQL. Run this module daily to move ages on past
+birthdays so that stays rare.
+
+    python eligibility.py                     # refresh ages as of today
+    python eligibility.py --fine-limit 25     # change the fine block limit
+"""
+import argparse
+import sqlite3
+from datetime import date
+
+from db import run_write
+
+FINE_LIMIT_RULE = 'fine_block_limit'
+
+# Whole years on :day of someone born on dob; NULL if dob is not a date
+_AGE = ("(CAST(strftime('%Y', :day) AS INTEGER) - CAST(strftime('%Y', dob) AS INTEGER)"
+        " - (strftime('%m-%d', :day) < strftime('%m-%d', dob)))")
+_FINE_LIMIT = f"(SELECT value FROM eligibility_rules WHERE name = '{FINE_LIMIT_RULE}')"
+
+
+def eligibility(conn, customer_id, day=None):
+    """(age on day, fine blocked) for customer_id, or None if there is no such customer.
+
+    `day` is YYYY-MM-DD and defaults to today. A customer whose dob is not
+    a date counts as age 0, so only unrestricted items and events are open
+    to them.
+    """
+    params = {'day': day or date.today().isoformat(), 'customer_id': customer_id}
+    row = conn.execute('''
+        SELECT CASE WHEN :day >= age_from AND :day < age_until THEN age END, fine_blocked
+        FROM customer_eligibility WHERE customer_id = :customer_id
+    ''', params).fetchone()
+    if row is None or row[0] is None:
+        # Outside the cached range: from the customer row itself
+        row = conn.execute(f'''
+            SELECT {_AGE}, outstanding_fine_balance >= {_FINE_LIMIT}
+            FROM customers WHERE customer_id = :customer_id
+        ''', params).fetchone()
+        if row is None:
+            return None
+    return max(row[0] or 0, 0), bool(row[1])
+
+
+def refresh_ages(conn, today=None):
+    """Moves the cached age on for customers whose birthday has come.
+
+    Finds them on idx_eligibility_age_until, so a daily run touches only that
+    day's birthdays. Returns the number of customers updated.
+    """
+    today = today or date.today().isoformat()
+
+    def refresh(conn):
+        return conn.execute(f'''
+            UPDATE customer_eligibility
+            SET age = due.age,
+                age_from = date(due.dob, '+' || due.age || ' years'),
+                age_until = date(due.dob, '+' || (due.age + 1) || ' years')
+            FROM (
+                SELECT c.customer_id, c.dob, {_AGE} AS age
+                FROM customer_eligibility e JOIN customers c ON c.customer_id = e.customer_id
+                WHERE e.age_until <= :day
+            ) AS due
+            WHERE customer_eligibility.customer_id = due.customer_id
+        ''', {'day': today}).rowcount
+
+    return run_write(conn, refresh)
+
+
+def set_fine_limit(conn, limit):
+    """Sets the unpaid fine balance that blocks borrowing and re-tests every customer.
+
+    Returns the number of customers whose block changed.
+    """
+    def change(conn):
+        conn.execute("UPDATE eligibility_rules SET value = ? WHERE name = ?", (limit, FINE_LIMIT_RULE))
+        return conn.execute('''
+            UPDATE customer_eligibility SET fine_blocked = NOT fine_blocked
+            FROM customers c
+            WHERE c.customer_id = customer_eligibility.customer_id
+              AND customer_eligibility.fine_blocked IS NOT (c.outstanding_fine_balance >= ?)
+        ''', (limit,)).rowcount
+
+    return run_write(conn, change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the cached customer eligibility.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--as-of', help='date to refresh ages as of, YYYY-MM-DD (default today)')
+    parser.add_argument('--fine-limit', type=float, help='unpaid fines that block borrowing')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    if args.fine_limit is not None:
+        print(f"Fine block limit set to ${args.fine_limit:.2f}; "
+              f"{set_fine_limit(conn, args.fine_limit)} customers changed")
+    print(f"{refresh_ages(conn, args.as_of)} customer ages moved on")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
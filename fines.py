@@ -0,0 +1,177 @@
+# fines.py
+"""Overdue fine assessment.
+
+Fines accrue at FINE_PER_DAY for every day a loan has been out beyond
+GRACE_DAYS. assess_overdue_fines() brings the fines of all open loans up to
+date in set-based SQL passes over borrowing, one chunk of loans per
+transaction; customer balances follow through the fine triggers.
+
+    python fines.py                     # assess as of today
+    python fines.py --as-of 2025-06-01
+    python fines.py --every 3600        # keep running, once an hour
+"""
+import argparse
+import sqlite3
+import time
+from datetime import date
+
+from db import run_write
+
+GRACE_DAYS = 15  # days a loan can be out before it is fined
+FINE_PER_DAY = 1.0
+
+# Fine owed on a loan as of the first parameter; NULL/negative means none
+_FINE_AMOUNT = "(CAST(julianday(?) - julianday(borrowed_date) AS INTEGER) - ?) * ?"
+
+
+def finalize_fine(conn, transaction_id, returned_date):
+    """Brings a loan's fines to their final amount at return time.
+
+    Sets the accrued unpaid fine so the loan's fines add up to what it owes,
+    or, if there is none (the loan was on time, or what the batch job charged
+    was already paid), inserts an unpaid fine for the rest. Returns the total
+    the loan's fines now come to (0.0 if the return was on time); never less
+    than has been paid. Call inside the return's write transaction.
+    """
+    row = conn.execute(
+        f"SELECT customer_id, {_FINE_AMOUNT} FROM borrowing WHERE transaction_id = ?",
+        (returned_date, GRACE_DAYS, FINE_PER_DAY, transaction_id)
+    ).fetchone()
+    if row is None:
+        return 0.0
+    customer_id, amount = row[0], max(row[1] or 0.0, 0.0)
+
+    paid, unpaid_id = conn.execute('''
+        SELECT COALESCE(SUM(CASE WHEN fine_status = 'Paid' THEN amount_of_fine END), 0.0),
+               MAX(CASE WHEN fine_status = 'Unpaid' THEN fine_id END)
+        FROM fines WHERE transaction_id = ?
+    ''', (transaction_id,)).fetchone()
+    if unpaid_id is not None:
+        conn.execute("UPDATE fines SET amount_of_fine = ? WHERE fine_id = ?",
+                     (max(amount - paid, 0.0), unpaid_id))
+    elif amount > paid:
+        conn.execute('''
+            INSERT INTO fines (transaction_id, customer_id, amount_of_fine)
+            VALUES (?, ?, ?)
+        ''', (transaction_id, customer_id, amount - paid))
+    return max(amount, paid)
+
+
+class AssessmentReport:
+    def __init__(self, as_of):
+        self.as_of = as_of
+        self.loans_scanned = 0
+        self.fines_created = 0
+        self.fines_updated = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (f"as of {self.as_of}: {self.loans_scanned} overdue loans, "
+                f"{self.fines_created} fines created, {self.fines_updated} updated "
+                f"in {self.chunks} chunks, {self.seconds:.1f}s")
+
+
+def assess_overdue_fines(conn, as_of=None, chunk_size=10000, progress=None):
+    """Accrues fines on every open loan that is overdue as of `as_of`.
+
+    Overdue open loans are walked in (borrowed_date, transaction_id) order on
+    the idx_borrowing_open_borrowed partial index. Each chunk of up to
+    chunk_size loans is one transaction with two statements: raise existing
+    unpaid fines to the amount now owed, and insert fines for loans that have
+    no unpaid one (for the part not already paid). Only the chunk boundary is
+    read into Python, so memory does not grow with the number of loans.
+    `progress(report)` is called per chunk.
+    """
+    as_of = as_of or date.today().isoformat()
+    report = AssessmentReport(as_of)
+    start = time.perf_counter()
+    # borrowed_date before this is more than GRACE_DAYS out
+    cutoff = conn.execute("SELECT date(?, ?)", (as_of, f'-{GRACE_DAYS} days')).fetchone()[0]
+    last = ('', 0)
+
+    while True:
+        boundary = conn.execute('''
+            SELECT borrowed_date, transaction_id FROM borrowing
+            WHERE returned_date IS NULL AND borrowed_date < ?
+              AND (borrowed_date, transaction_id) > (?, ?)
+            ORDER BY borrowed_date, transaction_id
+            LIMIT 1 OFFSET ?
+        ''', (cutoff, last[0], last[1], chunk_size - 1)).fetchone()
+        # The last chunk runs to the end of the overdue loans
+        end = tuple(boundary) if boundary else ('9999-12-31', 2 ** 63 - 1)
+
+        chunk = f'''
+            SELECT transaction_id, customer_id, {_FINE_AMOUNT} AS amount FROM borrowing
+            WHERE returned_date IS NULL AND borrowed_date < ?
+              AND (borrowed_date, transaction_id) > (?, ?)
+              AND (borrowed_date, transaction_id) <= (?, ?)
+        '''
+        params = (as_of, GRACE_DAYS, FINE_PER_DAY, cutoff, last[0], last[1], end[0], end[1])
+
+        def assess_chunk(conn):
+            scanned = conn.execute(f"SELECT COUNT(*) FROM ({chunk})", params).fetchone()[0]
+            # A loan has at most one unpaid fine; it covers what is owed
+            # beyond any fines already paid
+            updated = conn.execute(f'''
+                UPDATE fines SET amount_of_fine = due.amount - due.paid
+                FROM (SELECT owed.*, (SELECT COALESCE(SUM(paid.amount_of_fine), 0.0) FROM fines paid
+                                      WHERE paid.transaction_id = owed.transaction_id
+                                        AND paid.fine_status = 'Paid') AS paid
+                      FROM ({chunk}) AS owed) AS due
+                WHERE fines.transaction_id = due.transaction_id
+                  AND fines.fine_status = 'Unpaid' AND fines.amount_of_fine < due.amount - due.paid
+            ''', params).rowcount
+            # Loans with no unpaid fine: a first fine, or the rest of one paid early
+            created = conn.execute(f'''
+                INSERT INTO fines (transaction_id, customer_id, amount_of_fine)
+                SELECT transaction_id, customer_id, amount - charged
+                FROM (SELECT owed.*, (SELECT COALESCE(SUM(charged.amount_of_fine), 0.0) FROM fines charged
+                                      WHERE charged.transaction_id = owed.transaction_id) AS charged
+                      FROM ({chunk}) AS owed
+                      WHERE NOT EXISTS (SELECT 1 FROM fines WHERE fines.transaction_id = owed.transaction_id
+                                                               AND fines.fine_status = 'Unpaid'))
+                WHERE amount > charged
+            ''', params).rowcount
+            return scanned, updated, created
+
+        scanned, updated, created = run_write(conn, assess_chunk)
+        report.loans_scanned += scanned
+        report.fines_updated += updated
+        report.fines_created += created
+        report.chunks += 1
+        report.seconds = time.perf_counter() - start
+        if progress:
+            progress(report)
+        if boundary is None:
+            break
+        last = end
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Accrue fines on overdue open loans.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--as-of', help='assessment date, YYYY-MM-DD (default today)')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--every', type=float, help='repeat every N seconds instead of exiting')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+
+    def show_progress(report):
+        print(f"  chunk {report.chunks}: {report.loans_scanned} loans, "
+              f"{report.fines_created} created, {report.fines_updated} updated")
+
+    while True:
+        print(assess_overdue_fines(conn, args.as_of, args.chunk_size, show_progress))
+        if not args.every:
+            break
+        time.sleep(args.every)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# holds.py
+"""Holds: a first-come queue per item for customers waiting for a copy.
+
+A hold can be placed while no copy of the item is on the shelf, by a
+customer who could borrow it (see eligibility.py). When a loan is closed
+(circulation.close_loan), the head of the item's queue gets the returned
+copy in the same transaction. The head is the first entry for the
+item in idx_holds_queue, found with one index seek however long the queue
+is. The copy stays out of circulation (status Borrowed) and the hold is
+Ready for HOLD_PICKUP_DAYS; borrowing the item then takes the held copy.
+Holds not picked up in time are released by `python holds.py --expire`,
+which passes each copy on to the next customer in line.
+library_items.holds_waiting, kept by triggers, is the length of the queue.
+
+    python holds.py --expire                  # release holds past pickup
+    python holds.py --expire --as-of 2025-06-01
+"""
+import argparse
+import sqlite3
+from datetime import date, datetime, timedelta
+
+from db import run_write
+from eligibility import eligibility
+
+HOLD_PICKUP_DAYS = 7
+WAITING = 'Waiting'
+READY = 'Ready'
+
+
+class HoldError(Exception):
+    """A hold that cannot be placed or cancelled; `status` is the HTTP status."""
+    status = 400
+
+
+class NotFound(HoldError):
+    status = 404
+
+
+class AlreadyHeld(HoldError):
+    status = 409
+
+
+class ItemAvailable(HoldError):
+    status = 409
+
+
+class NotEligible(HoldError):
+    status = 403
+
+
+def parse_id(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HoldError(f"Enter a valid {field}.")
+
+
+def add_hold(conn, item_id, customer_id):
+    """Queues customer_id for item_id inside the caller's write transaction.
+
+    Returns (hold_id, position in the queue).
+    """
+    allowed = eligibility(conn, customer_id)
+    if allowed is None:
+        raise NotFound(f"Customer {customer_id} not found.")
+    item = conn.execute(
+        "SELECT available_copies, is_future_item, restriction FROM library_items WHERE item_id = ?", (item_id,)
+    ).fetchone()
+    if item is None:
+        raise NotFound("Item not found.")
+    # A copy set aside for someone who cannot borrow it would sit unused
+    age, fine_blocked = allowed
+    if fine_blocked:
+        raise NotEligible("Your unpaid fines are over the limit. Please pay them before placing holds.")
+    if (item[2] or 0) > age:
+        raise NotEligible(f"This item is for ages {item[2]} and over.")
+    if item[1]:
+        raise HoldError("This item is not in the collection yet.")
+    if item[0] > 0:
+        raise ItemAvailable("A copy is on the shelf - you can borrow it now.")
+    if conn.execute(
+        "SELECT 1 FROM item_holds WHERE item_id = ? AND customer_id = ?", (item_id, customer_id)
+    ).fetchone():
+        raise AlreadyHeld("You already have a hold on this item.")
+
+    hold_id = conn.execute(
+        "INSERT INTO item_holds (item_id, customer_id) VALUES (?, ?)", (item_id, customer_id)
+    ).lastrowid
+    # A new hold is last in line
+    position = conn.execute(
+        "SELECT holds_waiting FROM library_items WHERE item_id = ?", (item_id,)
+    ).fetchone()[0]
+    return hold_id, position
+
+
+def place_hold(conn, item_id, customer_id):
+    """Places a hold in its own transaction; see add_hold."""
+    item_id = parse_id(item_id, 'Item ID')
+    customer_id = parse_id(customer_id, 'Customer ID')
+    return run_write(conn, lambda conn: add_hold(conn, item_id, customer_id))
+
+
+def promote_next(conn, item_id, from_date):
+    """Sets an Available copy of item_id aside for the head of its queue.
+
+    Runs inside the caller's write transaction. The hold is Ready until
+    HOLD_PICKUP_DAYS after from_date (YYYY-MM-DD). Returns the customer_id
+    the copy is held for, or None if nobody is waiting or no copy is free.
+    """
+    head = conn.execute('''
+        SELECT hold_id, customer_id FROM item_holds
+        WHERE item_id = ? AND status = 'Waiting' ORDER BY hold_id LIMIT 1
+    ''', (item_id,)).fetchone()
+    if head is None:
+        return None
+    copy = conn.execute(
+        "SELECT copy_id FROM item_copies WHERE item_id = ? AND status = 'Available' LIMIT 1", (item_id,)
+    ).fetchone()
+    if copy is None:
+        return None
+
+    ready_until = (datetime.strptime(from_date, '%Y-%m-%d') + timedelta(days=HOLD_PICKUP_DAYS)).strftime('%Y-%m-%d')
+    conn.execute("UPDATE item_copies SET status = 'Borrowed' WHERE copy_id = ?", (copy[0],))
+    conn.execute('''
+        UPDATE item_holds SET status = 'Ready', copy_id = ?, ready_until = ?
+        WHERE hold_id = ?
+    ''', (copy[0], ready_until, head[0]))
+    return head[1]
+
+
+def held_copy(conn, item_id, customer_id):
+    """The copy of item_id set aside for customer_id, or None."""
+    row = conn.execute('''
+        SELECT copy_id FROM item_holds
+        WHERE item_id = ? AND customer_id = ? AND status = 'Ready'
+    ''', (item_id, customer_id)).fetchone()
+    return row[0] if row else None
+
+
+def clear_hold(conn, item_id, customer_id):
+    """Drops customer_id's hold on item_id once they have borrowed it."""
+    conn.execute("DELETE FROM item_holds WHERE item_id = ? AND customer_id = ?", (item_id, customer_id))
+
+
+def _release(conn, hold_id, item_id, copy_id, today):
+    """Deletes a hold; a copy it was holding goes to the next in line."""
+    conn.execute("DELETE FROM item_holds WHERE hold_id = ?", (hold_id,))
+    if copy_id is None:
+        return None
+    conn.execute("UPDATE item_copies SET status = 'Available' WHERE copy_id = ?", (copy_id,))
+    return promote_next(conn, item_id, today)
+
+
+def cancel_hold(conn, item_id, customer_id, today=None):
+    """Cancels a hold in its own transaction.
+
+    Returns the customer_id a released copy went to, or None.
+    """
+    item_id = parse_id(item_id, 'Item ID')
+    customer_id = parse_id(customer_id, 'Customer ID')
+    today = today or date.today().isoformat()
+
+    def cancel(conn):
+        row = conn.execute(
+            "SELECT hold_id, copy_id FROM item_holds WHERE item_id = ? AND customer_id = ?",
+            (item_id, customer_id)
+        ).fetchone()
+        if row is None:
+            raise NotFound("No hold found for this customer.")
+        return _release(conn, row[0], item_id, row[1], today)
+
+    return run_write(conn, cancel)
+
+
+def expire_holds(conn, today=None):
+    """Releases Ready holds not picked up by their ready_until date.
+
+    Each released copy goes to the next customer in its queue. Returns
+    (holds expired, copies passed on).
+    """
+    today = today or date.today().isoformat()
+
+    def expire(conn):
+        expired = conn.execute('''
+            SELECT hold_id, item_id, copy_id FROM item_holds
+            WHERE status = 'Ready' AND ready_until < ?
+        ''', (today,)).fetchall()
+        passed_on = sum(1 for hold_id, item_id, copy_id in expired
+                        if _release(conn, hold_id, item_id, copy_id, today) is not None)
+        return len(expired), passed_on
+
+    return run_write(conn, expire)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the item holds queues.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--expire', action='store_true', help='release holds past their pickup date')
+    parser.add_argument('--as-of', help='date to expire holds as of, YYYY-MM-DD (default today)')
+    args = parser.parse_args()
+    if not args.expire:
+        parser.error("nothing to do; pass --expire")
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    expired, passed_on = expire_holds(conn, args.as_of)
+    print(f"{expired} holds expired, {passed_on} copies passed to the next in line")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
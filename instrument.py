@@ -0,0 +1,231 @@
+# instrument.py
+"""Per-request profiling: query timings, query counts and template render time.
+
+When INSTRUMENT_ENABLED is set, the request connection from db.get_db is
+wrapped so every execute is timed and counted, statements slower than
+INSTRUMENT_SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN, and
+template rendering is timed through Flask's signals. Everything is
+aggregated into histograms per endpoint and shown under /metrics.
+
+When it is off, get_db hands out the plain connection and the request hooks
+return at once, so the cost is a config lookup per request.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+
+from flask import (before_render_template, current_app, g, has_request_context, request,
+                   template_rendered)
+
+# Upper bounds of the histogram buckets, in milliseconds (the last is +inf)
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    """Bucketed counts with a running sum and max."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        rank = q * self.total
+        seen = 0
+        for bound, count in zip(self.bounds + (self.max,), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.total,
+            'mean': round(self.sum / self.total, 3) if self.total else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 3),
+            'buckets': {f'le_{bound}': count
+                        for bound, count in zip(self.bounds + ('inf',), self.counts) if count},
+        }
+
+
+class Metrics:
+    """Histograms keyed by (metric, label) plus the most recent slow queries."""
+
+    def __init__(self, slow_query_log=50):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.slow_queries = deque(maxlen=slow_query_log)
+
+    def observe(self, metric, label, value, bounds=BUCKETS_MS):
+        with self._lock:
+            histogram = self._histograms.get((metric, label))
+            if histogram is None:
+                histogram = self._histograms[(metric, label)] = Histogram(bounds)
+            histogram.observe(value)
+
+    def record_slow(self, entry):
+        with self._lock:
+            self.slow_queries.append(entry)
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for (metric, label), histogram in sorted(self._histograms.items()):
+                out.setdefault(metric, {})[label] = histogram.as_dict()
+            out['slow_queries'] = list(self.slow_queries)
+            return out
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self.slow_queries.clear()
+
+
+def get_metrics(app=None):
+    app = app or current_app
+    return app.extensions['instrument_metrics']
+
+
+# -----------------------------------------------------
+# Connection and cursor wrappers
+# -----------------------------------------------------
+def _timed(raw_conn, run, sql, params):
+    start = time.perf_counter()
+    try:
+        return run()
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        g.query_count = g.get('query_count', 0) + 1
+        g.query_ms = g.get('query_ms', 0.0) + elapsed_ms
+        if elapsed_ms >= current_app.config['INSTRUMENT_SLOW_QUERY_MS']:
+            _log_slow(raw_conn, sql, params, elapsed_ms)
+
+
+def _log_slow(raw_conn, sql, params, elapsed_ms):
+    try:
+        plan = [row[-1] for row in raw_conn.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())]
+    except Exception:
+        plan = []  # executemany parameters, scripts, or statements without a plan
+    entry = {
+        'endpoint': request.endpoint if has_request_context() else None,
+        'ms': round(elapsed_ms, 3),
+        'sql': ' '.join(sql.split()),
+        'plan': plan,
+    }
+    get_metrics().record_slow(entry)
+    current_app.logger.warning("Slow query (%.1f ms) in %s: %s | plan: %s",
+                               elapsed_ms, entry['endpoint'], entry['sql'], '; '.join(plan))
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, raw_conn):
+        self._cursor = cursor
+        self._raw_conn = raw_conn
+
+    def execute(self, sql, params=()):
+        _timed(self._raw_conn, lambda: self._cursor.execute(sql, params), sql, params)
+        return self
+
+    def executemany(self, sql, seq):
+        _timed(self._raw_conn, lambda: self._cursor.executemany(sql, seq), sql, None)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Times every statement run through a pooled connection.
+
+    Everything other than the execute methods, commit and cursor is passed
+    through, and `raw` is what goes back to the pool.
+    """
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def execute(self, sql, params=()):
+        return _timed(self.raw, lambda: self.raw.execute(sql, params), sql, params)
+
+    def executemany(self, sql, seq):
+        return _timed(self.raw, lambda: self.raw.executemany(sql, seq), sql, None)
+
+    def executescript(self, script):
+        return _timed(self.raw, lambda: self.raw.executescript(script), script, None)
+
+    def commit(self):
+        return _timed(self.raw, self.raw.commit, 'COMMIT', None)
+
+    def cursor(self, *args):
+        return InstrumentedCursor(self.raw.cursor(*args), self.raw)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def wrap_connection(conn):
+    """db.get_db hook: instruments conn if INSTRUMENT_ENABLED is set."""
+    if current_app.config['INSTRUMENT_ENABLED']:
+        return InstrumentedConnection(conn)
+    return conn
+
+
+# -----------------------------------------------------
+# Request and template hooks
+# -----------------------------------------------------
+def _start_request():
+    if current_app.config['INSTRUMENT_ENABLED']:
+        g.request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    metrics = get_metrics()
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('request_ms', endpoint, (time.perf_counter() - started) * 1000)
+    metrics.observe('queries_per_request', endpoint, g.get('query_count', 0), COUNT_BUCKETS)
+    metrics.observe('query_ms_per_request', endpoint, g.get('query_ms', 0.0))
+    return response
+
+
+def _before_render(sender, template, context, **extra):
+    if 'request_started' in g:
+        g.render_started = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        get_metrics(sender).observe('render_ms', f'{request.endpoint}:{template.name}',
+                                    (time.perf_counter() - started) * 1000)
+
+
+def init_app(app):
+    app.config.setdefault('INSTRUMENT_ENABLED', False)
+    app.config.setdefault('INSTRUMENT_SLOW_QUERY_MS', 100.0)
+    app.config.setdefault('INSTRUMENT_SLOW_QUERY_LOG', 50)  # slow queries kept for /metrics
+    app.extensions['instrument_metrics'] = Metrics(app.config['INSTRUMENT_SLOW_QUERY_LOG'])
+    app.extensions['db_wrapper'] = wrap_connection
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,948 @@
+# migrations.py
+"""Versioned schema changes applied on top of the tables created by init_db.
+
+The schema version is kept in PRAGMA user_version. Each migration runs in its
+own transaction together with the version bump, so an existing library.db is
+upgraded in place and a failed step leaves the file at the previous version.
+
+    python migrations.py    # upgrade library.db
+
+tests/test_query_plans.py checks that the hot queries use their indexes.
+"""
+import argparse
+import sqlite3
+
+from search import create_search_index, fts5_available, term_counts_sql
+
+DATABASE = 'library.db'
+
+# (version, description, function taking a cursor), in version order
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers the decorated function as schema version `version`."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def latest_version():
+    """The version a fully migrated database is at."""
+    return max((version for version, _, _ in MIGRATIONS), default=0)
+
+
+def migrate(conn):
+    """Applies every migration newer than the database. Returns the new version."""
+    version = current_version(conn)
+    for target, description, apply in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if target <= version:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            apply(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = target
+    return version
+
+
+# -----------------------------------------------------
+# MIGRATIONS
+# -----------------------------------------------------
+@migration(1, 'Index the foreign keys of borrowing, fines, register and manage')
+def _index_foreign_keys(c):
+    # customer_id leads so per-customer history is read in date order
+    c.execute("CREATE INDEX IF NOT EXISTS idx_borrowing_customer ON borrowing (customer_id, borrowed_date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_borrowing_item ON borrowing (item_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fines_transaction ON fines (transaction_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fines_customer ON fines (customer_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_register_event ON register (event_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_register_customer ON register (customer_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_manage_event ON manage (event_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_manage_employee ON manage (employee_id)")
+
+
+@migration(2, 'Partial indexes for open loans and unpaid fines')
+def _index_open_loans(c):
+    # Open loans are a small, hot slice of borrowing: who has this item,
+    # what is overdue, what does this customer still hold.
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrowing_open_item
+        ON borrowing (item_id) WHERE returned_date IS NULL
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrowing_open_due
+        ON borrowing (due_date) WHERE returned_date IS NULL
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrowing_open_customer
+        ON borrowing (customer_id) WHERE returned_date IS NULL
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fines_unpaid_customer
+        ON fines (customer_id) WHERE fine_status = 'Unpaid'
+    ''')
+    c.execute("ANALYZE")
+
+
+@migration(3, 'Data version counters for cache invalidation')
+def _data_versions(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    for table in ('library_items', 'events'):
+        c.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)", (table,))
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END;
+            ''')
+
+
+@migration(4, 'Support batch fine accrual on open loans')
+def _fine_accrual(c):
+    # Walk order of fines.assess_overdue_fines (rowid = transaction_id)
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_borrowing_open_borrowed
+        ON borrowing (borrowed_date) WHERE returned_date IS NULL
+    ''')
+    # An unpaid fine that grows (or is settled lower at return) moves the
+    # customer's balance by the difference.
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS update_customer_fine_balance_accrued
+        AFTER UPDATE OF amount_of_fine ON fines
+        WHEN NEW.fine_status = 'Unpaid' AND OLD.fine_status = 'Unpaid'
+        BEGIN
+            UPDATE customers
+            SET outstanding_fine_balance = outstanding_fine_balance + NEW.amount_of_fine - OLD.amount_of_fine
+            WHERE customer_id = NEW.customer_id;
+        END;
+    ''')
+
+
+@migration(5, 'Fine ledger, change log and watermarks for balance reconciliation')
+def _fine_reconciliation(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS watermarks (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fine_ledger (
+            customer_id INTEGER PRIMARY KEY,
+            expected_balance REAL NOT NULL DEFAULT 0.0
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fine_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fine_id INTEGER NOT NULL,
+            customer_id INTEGER NOT NULL,
+            delta REAL NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fine_changes_fine ON fine_changes (fine_id)")
+
+    # Each row is the change in what the fine contributes to the balance
+    # (its amount while Unpaid, nothing once Paid).
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_fine_change
+        AFTER UPDATE OF amount_of_fine, fine_status, customer_id ON fines
+        WHEN OLD.customer_id = NEW.customer_id
+        BEGIN
+            INSERT INTO fine_changes (fine_id, customer_id, delta)
+            SELECT NEW.fine_id, NEW.customer_id,
+                   (CASE WHEN NEW.fine_status = 'Unpaid' THEN NEW.amount_of_fine ELSE 0 END)
+                 - (CASE WHEN OLD.fine_status = 'Unpaid' THEN OLD.amount_of_fine ELSE 0 END)
+            WHERE NEW.amount_of_fine IS NOT OLD.amount_of_fine OR NEW.fine_status IS NOT OLD.fine_status;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_fine_customer_change
+        AFTER UPDATE OF customer_id ON fines
+        WHEN OLD.customer_id <> NEW.customer_id
+        BEGIN
+            INSERT INTO fine_changes (fine_id, customer_id, delta)
+            VALUES (OLD.fine_id, OLD.customer_id,
+                    -(CASE WHEN OLD.fine_status = 'Unpaid' THEN OLD.amount_of_fine ELSE 0 END)),
+                   (NEW.fine_id, NEW.customer_id,
+                    CASE WHEN NEW.fine_status = 'Unpaid' THEN NEW.amount_of_fine ELSE 0 END);
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS log_fine_delete
+        AFTER DELETE ON fines
+        WHEN OLD.fine_status = 'Unpaid'
+        BEGIN
+            INSERT INTO fine_changes (fine_id, customer_id, delta)
+            VALUES (OLD.fine_id, OLD.customer_id, -OLD.amount_of_fine);
+        END;
+    ''')
+
+    # A fine recorded as already Paid never owed anything; the original
+    # trigger added it to the balance regardless.
+    c.execute("DROP TRIGGER IF EXISTS update_customer_fine_balance")
+    c.execute('''
+        CREATE TRIGGER update_customer_fine_balance
+        AFTER INSERT ON fines
+        WHEN NEW.fine_status = 'Unpaid'
+        BEGIN
+            UPDATE customers
+            SET outstanding_fine_balance = outstanding_fine_balance + NEW.amount_of_fine
+            WHERE customer_id = NEW.customer_id;
+        END;
+    ''')
+
+
+@migration(6, 'Data version counters for customers, borrowing and fines')
+def _more_data_versions(c):
+    # Read endpoints of the JSON API use these as ETags
+    for table in ('customers', 'borrowing', 'fines'):
+        c.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)", (table,))
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END;
+            ''')
+
+
+@migration(7, 'Unique registrations, maintained seat counts and event waitlists')
+def _event_seats(c):
+    # Keep the first of any duplicate registrations, then forbid them
+    c.execute('''
+        DELETE FROM register WHERE register_id NOT IN (
+            SELECT MIN(register_id) FROM register GROUP BY event_id, customer_id
+        )
+    ''')
+    c.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_register_event_customer
+        ON register (event_id, customer_id)
+    ''')
+    c.execute("DROP INDEX IF EXISTS idx_register_event")  # a prefix of the unique index
+
+    # Seats taken, so seats left is one row read instead of a COUNT
+    c.execute("ALTER TABLE events ADD COLUMN registered_count INTEGER NOT NULL DEFAULT 0")
+    c.execute('''
+        UPDATE events SET registered_count = (
+            SELECT COUNT(*) FROM register WHERE register.event_id = events.event_id
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS register_count_insert
+        AFTER INSERT ON register
+        BEGIN
+            UPDATE events SET registered_count = registered_count + 1 WHERE event_id = NEW.event_id;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS register_count_delete
+        AFTER DELETE ON register
+        BEGIN
+            UPDATE events SET registered_count = registered_count - 1 WHERE event_id = OLD.event_id;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS register_count_move
+        AFTER UPDATE OF event_id ON register
+        WHEN NEW.event_id <> OLD.event_id
+        BEGIN
+            UPDATE events SET registered_count = registered_count - 1 WHERE event_id = OLD.event_id;
+            UPDATE events SET registered_count = registered_count + 1 WHERE event_id = NEW.event_id;
+        END;
+    ''')
+    # Whatever writes to register, a full event takes no more
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS register_capacity
+        BEFORE INSERT ON register
+        WHEN (SELECT capacity IS NOT NULL AND registered_count >= capacity
+              FROM events WHERE event_id = NEW.event_id)
+        BEGIN
+            SELECT RAISE(ABORT, 'event is full');
+        END;
+    ''')
+
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS event_waitlist (
+            waitlist_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            customer_id INTEGER NOT NULL,
+            joined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (event_id, customer_id),
+            FOREIGN KEY (event_id) REFERENCES events(event_id) ON DELETE CASCADE,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id) ON DELETE CASCADE
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_event ON event_waitlist (event_id, waitlist_id)")
+
+
+@migration(8, 'Date index and upcoming_events view for the events listing')
+def _upcoming_events(c):
+    # rowid (event_id) is the implicit last column, so the index also
+    # serves keyset paging on (datetime, event_id)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_datetime ON events (datetime)")
+    # events.datetime is stored as 'YYYY-MM-DD HH:MM' local time
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS upcoming_events AS
+        SELECT * FROM events
+        WHERE datetime >= strftime('%Y-%m-%d %H:%M', 'now', 'localtime')
+    ''')
+
+
+def _bump_customer_version(ref, where=''):
+    """Trigger statement adding 1 to the 'customer:<id>' counter of ref (NEW or OLD)."""
+    # UPSERT after INSERT ... SELECT needs a WHERE clause to parse unambiguously
+    return f'''
+        INSERT INTO data_versions (name, version)
+        SELECT 'customer:' || {ref}.customer_id, 1 WHERE {where or 'true'}
+        ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    '''
+
+
+@migration(9, 'Per-customer data versions for the account pages')
+def _customer_versions(c):
+    # Any change to a customer's own rows bumps their counter, so their cached
+    # account summary is dropped without touching anyone else's.
+    watched = {
+        'customers': ('UPDATE',),
+        'borrowing': ('INSERT', 'UPDATE', 'DELETE'),
+        'fines': ('INSERT', 'UPDATE', 'DELETE'),
+        'register': ('INSERT', 'DELETE'),
+        'event_waitlist': ('INSERT', 'DELETE'),
+    }
+    for table, actions in watched.items():
+        for action in actions:
+            if action == 'UPDATE':
+                body = (_bump_customer_version('NEW')
+                        + _bump_customer_version('OLD', 'OLD.customer_id <> NEW.customer_id'))
+            else:
+                body = _bump_customer_version('OLD' if action == 'DELETE' else 'NEW')
+            c.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_customer_version_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN {body} END;
+            ''')
+    # Where a customer is waiting, for the account page
+    c.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_customer ON event_waitlist (customer_id)")
+
+
+@migration(10, 'Item copies with maintained copy counts; collapse duplicate titles')
+def _item_copies(c):
+    # library_items becomes the title record; each physical copy is a row here
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_copies (
+            copy_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Available' CHECK (status IN ('Available', 'Borrowed')),
+            FOREIGN KEY (item_id) REFERENCES library_items(item_id) ON DELETE CASCADE
+        )
+    ''')
+    # Finds an Available copy to lend, or a Borrowed one to take back
+    c.execute("CREATE INDEX IF NOT EXISTS idx_copies_item_status ON item_copies (item_id, status)")
+    c.execute("ALTER TABLE library_items ADD COLUMN total_copies INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE library_items ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE borrowing ADD COLUMN copy_id INTEGER REFERENCES item_copies(copy_id)")
+    # The old triggers flip library_items.availability per loan
+    c.execute("DROP TRIGGER IF EXISTS update_item_borrowed")
+    c.execute("DROP TRIGGER IF EXISTS update_item_returned")
+
+    # Rows that agree on every descriptive column are copies of one title; the
+    # lowest item_id becomes the record. Each old row becomes a copy with the
+    # same id, so loans keep pointing at the physical copy they lent.
+    c.execute('''
+        CREATE TEMP TABLE copy_source (
+            source_id INTEGER PRIMARY KEY,
+            record_id INTEGER NOT NULL,
+            status TEXT NOT NULL
+        )
+    ''')
+    c.execute('''
+        INSERT INTO copy_source (source_id, record_id, status)
+        SELECT item_id,
+               MIN(item_id) OVER (PARTITION BY title, author, item_type, format, genre,
+                                               published_date, restriction, is_future_item),
+               availability
+        FROM library_items
+    ''')
+    c.execute('''
+        INSERT INTO item_copies (copy_id, item_id, status)
+        SELECT source_id, record_id, status FROM copy_source
+    ''')
+    c.execute("UPDATE borrowing SET copy_id = item_id WHERE item_id IN (SELECT source_id FROM copy_source)")
+    c.execute('''
+        UPDATE borrowing
+        SET item_id = (SELECT record_id FROM copy_source WHERE source_id = borrowing.item_id)
+        WHERE item_id IN (SELECT source_id FROM copy_source WHERE source_id <> record_id)
+    ''')
+    c.execute("DELETE FROM library_items WHERE item_id IN (SELECT source_id FROM copy_source WHERE source_id <> record_id)")
+    c.execute("DROP TABLE copy_source")
+    c.execute('''
+        UPDATE library_items SET
+            total_copies = (SELECT COUNT(*) FROM item_copies WHERE item_copies.item_id = library_items.item_id),
+            available_copies = (SELECT COUNT(*) FROM item_copies
+                                WHERE item_copies.item_id = library_items.item_id AND status = 'Available')
+    ''')
+    c.execute('''
+        UPDATE library_items
+        SET availability = CASE WHEN available_copies > 0 THEN 'Available' ELSE 'Borrowed' END
+    ''')
+
+    # The copy counts, and availability derived from them, follow item_copies
+    for action, item, delta_total, delta_available in (
+        ('INSERT', 'NEW', '+ 1', "+ (NEW.status = 'Available')"),
+        ('DELETE', 'OLD', '- 1', "- (OLD.status = 'Available')"),
+    ):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS item_copies_count_{action.lower()}
+            AFTER {action} ON item_copies
+            BEGIN
+                UPDATE library_items SET
+                    total_copies = total_copies {delta_total},
+                    available_copies = available_copies {delta_available},
+                    availability = CASE WHEN available_copies {delta_available} > 0
+                                        THEN 'Available' ELSE 'Borrowed' END
+                WHERE item_id = {item}.item_id;
+            END;
+        ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_copies_count_status
+        AFTER UPDATE OF status ON item_copies
+        WHEN NEW.status <> OLD.status AND NEW.item_id = OLD.item_id
+        BEGIN
+            UPDATE library_items SET
+                available_copies = available_copies + (NEW.status = 'Available') - (OLD.status = 'Available'),
+                availability = CASE WHEN available_copies + (NEW.status = 'Available')
+                                         - (OLD.status = 'Available') > 0
+                                    THEN 'Available' ELSE 'Borrowed' END
+            WHERE item_id = NEW.item_id;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_copies_count_move
+        AFTER UPDATE OF item_id ON item_copies
+        WHEN NEW.item_id <> OLD.item_id
+        BEGIN
+            UPDATE library_items SET
+                total_copies = total_copies - 1,
+                available_copies = available_copies - (OLD.status = 'Available'),
+                availability = CASE WHEN available_copies - (OLD.status = 'Available') > 0
+                                    THEN 'Available' ELSE 'Borrowed' END
+            WHERE item_id = OLD.item_id;
+            UPDATE library_items SET
+                total_copies = total_copies + 1,
+                available_copies = available_copies + (NEW.status = 'Available'),
+                availability = CASE WHEN available_copies + (NEW.status = 'Available') > 0
+                                    THEN 'Available' ELSE 'Borrowed' END
+            WHERE item_id = NEW.item_id;
+        END;
+    ''')
+    # A title added by any path (donations, imports, scripts) arrives with one copy
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS library_items_first_copy
+        AFTER INSERT ON library_items
+        BEGIN
+            INSERT INTO item_copies (item_id, status) VALUES (NEW.item_id, NEW.availability);
+        END;
+    ''')
+
+    # circulation.claim_item picks the copy; a loan recorded without one
+    # (e.g. by a script) takes any Available copy of the title
+    c.execute('''
+        CREATE TRIGGER update_item_borrowed
+        AFTER INSERT ON borrowing
+        WHEN NEW.returned_date IS NULL AND NEW.copy_id IS NULL
+        BEGIN
+            UPDATE item_copies SET status = 'Borrowed'
+            WHERE copy_id = (SELECT copy_id FROM item_copies
+                             WHERE item_id = NEW.item_id AND status = 'Available' LIMIT 1);
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER update_item_returned
+        AFTER UPDATE OF returned_date ON borrowing
+        WHEN NEW.returned_date IS NOT NULL AND OLD.returned_date IS NULL
+        BEGIN
+            UPDATE item_copies SET status = 'Available'
+            WHERE copy_id = COALESCE(NEW.copy_id, (SELECT copy_id FROM item_copies
+                                                   WHERE item_id = NEW.item_id AND status = 'Borrowed' LIMIT 1));
+        END;
+    ''')
+    # Donations look up an existing title to add a copy to
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_title_author ON library_items (title, author)")
+
+
+@migration(11, 'Holds queue for items with no copy on the shelf')
+def _item_holds(c):
+    # hold_id (AUTOINCREMENT, so never reused) is the queue position
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_holds (
+            hold_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            customer_id INTEGER NOT NULL,
+            placed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'Waiting' CHECK (status IN ('Waiting', 'Ready')),
+            copy_id INTEGER REFERENCES item_copies(copy_id),
+            ready_until TEXT,
+            UNIQUE (item_id, customer_id),
+            FOREIGN KEY (item_id) REFERENCES library_items(item_id) ON DELETE CASCADE,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id) ON DELETE CASCADE
+        )
+    ''')
+    # The head of an item's queue is the first entry for item_id here
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_holds_queue
+        ON item_holds (item_id, hold_id) WHERE status = 'Waiting'
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_holds_ready
+        ON item_holds (ready_until) WHERE status = 'Ready'
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_holds_customer ON item_holds (customer_id)")
+    # Queue length, so a new hold learns its place without counting the queue
+    c.execute("ALTER TABLE library_items ADD COLUMN holds_waiting INTEGER NOT NULL DEFAULT 0")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_holds_count_insert
+        AFTER INSERT ON item_holds
+        WHEN NEW.status = 'Waiting'
+        BEGIN
+            UPDATE library_items SET holds_waiting = holds_waiting + 1 WHERE item_id = NEW.item_id;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_holds_count_delete
+        AFTER DELETE ON item_holds
+        WHEN OLD.status = 'Waiting'
+        BEGIN
+            UPDATE library_items SET holds_waiting = holds_waiting - 1 WHERE item_id = OLD.item_id;
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_holds_count_ready
+        AFTER UPDATE OF status ON item_holds
+        WHEN OLD.status = 'Waiting' AND NEW.status <> 'Waiting'
+        BEGIN
+            UPDATE library_items SET holds_waiting = holds_waiting - 1 WHERE item_id = NEW.item_id;
+        END;
+    ''')
+    for action in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS item_holds_customer_version_{action.lower()}
+            AFTER {action} ON item_holds
+            BEGIN {_bump_customer_version('OLD' if action == 'DELETE' else 'NEW')} END;
+        ''')
+
+
+
+@migration(12, 'Item co-occurrence counts and top neighbors for recommendations')
+def _item_neighbors(c):
+    # The sparse item-item matrix: how often two items were borrowed by the
+    # same customer close together. Both (a, b) and (b, a) are stored so an
+    # item's row is one primary key range.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_pairs (
+            item_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            PRIMARY KEY (item_id, other_id)
+        ) WITHOUT ROWID
+    ''')
+    # The top of each row of item_pairs, in rank order
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_neighbors (
+            item_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            PRIMARY KEY (item_id, rank)
+        ) WITHOUT ROWID
+    ''')
+    # Items whose item_pairs row changed since their neighbors were ranked
+    c.execute("CREATE TABLE IF NOT EXISTS item_neighbors_stale (item_id INTEGER PRIMARY KEY)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_popularity (
+            item_id INTEGER PRIMARY KEY,
+            loans INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_popularity_loans ON item_popularity (loans)")
+    # Bumped by recommend.py once per chunk it re-ranks, not per row
+    c.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('item_neighbors', 0)")
+
+
+def _late(ref):
+    return f"COALESCE({ref}.returned_date > {ref}.due_date, 0)"
+
+
+def _paid(ref):
+    return f"CASE WHEN {ref}.fine_status = 'Paid' THEN {ref}.amount_of_fine ELSE 0 END"
+
+
+@migration(13, 'Daily circulation rollups and their change log for reporting')
+def _daily_circulation(c):
+    # Loans count on the day borrowed, returns on the day returned, and
+    # fines on the day their loan fell due. Blank genre/item_type is ''.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS daily_circulation (
+            day TEXT NOT NULL,
+            genre TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            loans INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            late_returns INTEGER NOT NULL DEFAULT 0,
+            fines_charged REAL NOT NULL DEFAULT 0.0,
+            fines_paid REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (day, genre, item_type)
+        ) WITHOUT ROWID
+    ''')
+    # Changes to loans and fines reporting.py has already counted, as deltas
+    # to daily_circulation; rows above the watermarks are ignored and dropped
+    # by the scan that counts them (as fine_changes is for the ledger).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS circulation_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id INTEGER,
+            fine_id INTEGER,
+            day TEXT NOT NULL,
+            genre TEXT NOT NULL,
+            item_type TEXT NOT NULL,
+            loans INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0,
+            late_returns INTEGER NOT NULL DEFAULT 0,
+            fines_charged REAL NOT NULL DEFAULT 0.0,
+            fines_paid REAL NOT NULL DEFAULT 0.0
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_circulation_changes_loan ON circulation_changes (transaction_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_circulation_changes_fine ON circulation_changes (fine_id)")
+
+    item = "COALESCE(i.genre, ''), COALESCE(i.item_type, '')"
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_loan_return
+        AFTER UPDATE OF returned_date ON borrowing
+        WHEN OLD.returned_date IS NOT NEW.returned_date
+        BEGIN
+            INSERT INTO circulation_changes (transaction_id, day, genre, item_type, returns, late_returns)
+            SELECT OLD.transaction_id, OLD.returned_date, {item}, -1, -{_late('OLD')}
+            FROM library_items i WHERE i.item_id = OLD.item_id AND OLD.returned_date IS NOT NULL
+            UNION ALL
+            SELECT NEW.transaction_id, NEW.returned_date, {item}, 1, {_late('NEW')}
+            FROM library_items i WHERE i.item_id = NEW.item_id AND NEW.returned_date IS NOT NULL;
+        END;
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_loan_delete
+        AFTER DELETE ON borrowing
+        BEGIN
+            INSERT INTO circulation_changes (transaction_id, day, genre, item_type, loans, returns, late_returns)
+            SELECT OLD.transaction_id, OLD.borrowed_date, {item}, -1, 0, 0
+            FROM library_items i WHERE i.item_id = OLD.item_id
+            UNION ALL
+            SELECT OLD.transaction_id, OLD.returned_date, {item}, 0, -1, -{_late('OLD')}
+            FROM library_items i WHERE i.item_id = OLD.item_id AND OLD.returned_date IS NOT NULL;
+        END;
+    ''')
+    loan = '''FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+            WHERE b.transaction_id = {ref}.transaction_id'''
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_fine_report_change
+        AFTER UPDATE OF amount_of_fine, fine_status ON fines
+        WHEN NEW.amount_of_fine IS NOT OLD.amount_of_fine OR NEW.fine_status IS NOT OLD.fine_status
+        BEGIN
+            INSERT INTO circulation_changes (fine_id, day, genre, item_type, fines_charged, fines_paid)
+            SELECT NEW.fine_id, COALESCE(b.due_date, b.borrowed_date),
+                   {item}, NEW.amount_of_fine - OLD.amount_of_fine, ({_paid('NEW')}) - ({_paid('OLD')})
+            {loan.format(ref='NEW')};
+        END;
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS log_fine_report_delete
+        AFTER DELETE ON fines
+        BEGIN
+            INSERT INTO circulation_changes (fine_id, day, genre, item_type, fines_charged, fines_paid)
+            SELECT OLD.fine_id, COALESCE(b.due_date, b.borrowed_date),
+                   {item}, -OLD.amount_of_fine, -({_paid('OLD')})
+            {loan.format(ref='OLD')};
+        END;
+    ''')
+
+
+@migration(14, 'Facet counts, filter indexes and a trigram term index for catalog search')
+def _catalog_facets(c):
+    # How many titles have each value of each filterable column. NULL is
+    # counted under ''.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS item_facets (
+            facet TEXT NOT NULL,
+            value NOT NULL,
+            items INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (facet, value)
+        ) WITHOUT ROWID
+    ''')
+    facets = ('item_type', 'format', 'genre', 'availability', 'restriction')
+    for facet in facets:
+        c.execute(f'''
+            INSERT OR REPLACE INTO item_facets (facet, value, items)
+            SELECT '{facet}', COALESCE({facet}, ''), COUNT(*) FROM library_items GROUP BY 2
+        ''')
+
+    def count(*changes):
+        """One upsert adding each (ref, facet, delta) to its value's count."""
+        values = ', '.join(f"('{facet}', COALESCE({ref}.{facet}, ''), {delta})" for ref, facet, delta in changes)
+        return f'''
+            INSERT INTO item_facets (facet, value, items) VALUES {values}
+            ON CONFLICT (facet, value) DO UPDATE SET items = items + excluded.items;'''
+
+    for action, ref, delta in (('INSERT', 'NEW', 1), ('DELETE', 'OLD', -1)):
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS item_facets_{action.lower()}
+            AFTER {action} ON library_items
+            BEGIN {count(*((ref, facet, delta) for facet in facets))}
+            END;
+        ''')
+    # One trigger per column, so an availability flip on a borrow moves only
+    # that facet's two counts
+    for facet in facets:
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS item_facets_update_{facet}
+            AFTER UPDATE OF {facet} ON library_items
+            WHEN OLD.{facet} IS NOT NEW.{facet}
+            BEGIN {count(('OLD', facet, -1), ('NEW', facet, 1))}
+            END;
+        ''')
+
+    # Filter combinations: equality on the leading columns leaves the rows in
+    # item_id order, so a filtered page is a range of one index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_genre_type ON library_items (genre, item_type, format)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_type_format ON library_items (item_type, format)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_format ON library_items (format)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_restriction ON library_items (restriction)")
+    # Few titles are out at once, so "Borrowed" would otherwise scan most of the table
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_availability ON library_items (availability)")
+
+    # Distinct title and author words, with a trigram index over them so a
+    # misspelled word finds the real ones it shares the most trigrams with
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS search_terms (
+            term_id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE,
+            docs INTEGER NOT NULL
+        )
+    ''')
+
+    # The full-text index, its vocabulary and the term trigram index.
+    # Without FTS5 there are none: search_items falls back to LIKE and
+    # correct_query suggests nothing
+    if not fts5_available():
+        return
+    create_search_index(c)
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_terms_trigrams'")
+    is_new = c.fetchone() is None
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS library_items_terms USING fts5vocab(library_items_fts, 'col')")
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_terms_trigrams USING fts5(
+            term, content='search_terms', content_rowid='term_id', tokenize='trigram'
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_terms_insert AFTER INSERT ON search_terms
+        BEGIN
+            INSERT INTO search_terms_trigrams (rowid, term) VALUES (NEW.term_id, NEW.term);
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS search_terms_delete AFTER DELETE ON search_terms
+        BEGIN
+            INSERT INTO search_terms_trigrams (search_terms_trigrams, rowid, term)
+            VALUES ('delete', OLD.term_id, OLD.term);
+        END;
+    ''')
+    if is_new:
+        c.execute('''
+            INSERT INTO search_terms (term, docs)
+            SELECT term, SUM(doc) FROM library_items_terms
+            WHERE col IN ('title', 'author') AND length(term) >= 3 AND term GLOB '*[^0-9]*'
+            GROUP BY term
+        ''')
+
+
+@migration(15, 'Cached customer ages and fine blocks for borrowing and event eligibility')
+def _customer_eligibility(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS eligibility_rules (
+            name TEXT PRIMARY KEY,
+            value NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Unpaid fines at or over this stop a customer borrowing (eligibility.py --fine-limit)
+    c.execute("INSERT OR IGNORE INTO eligibility_rules (name, value) VALUES ('fine_block_limit', 10.0)")
+    # Each customer's age in whole years, valid from their last birthday up
+    # to (not including) their next; NULLs when dob is not a date
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS customer_eligibility (
+            customer_id INTEGER PRIMARY KEY,
+            age INTEGER,
+            age_from TEXT,
+            age_until TEXT,
+            fine_blocked INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_eligibility_age_until ON customer_eligibility (age_until)")
+
+    def refresh(where):
+        """Upsert setting the age of the customers matching `where` as of today.
+
+        A new row also gets its fine block; an existing one keeps it (the
+        balance trigger below maintains that).
+        """
+        age = ("CAST(strftime('%Y', 'now', 'localtime') AS INTEGER) - CAST(strftime('%Y', dob) AS INTEGER)"
+               " - (strftime('%m-%d', 'now', 'localtime') < strftime('%m-%d', dob))")
+        return f'''
+            INSERT INTO customer_eligibility (customer_id, age, age_from, age_until, fine_blocked)
+            SELECT customer_id, age, date(dob, '+' || age || ' years'), date(dob, '+' || (age + 1) || ' years'),
+                   outstanding_fine_balance >= (SELECT value FROM eligibility_rules WHERE name = 'fine_block_limit')
+            FROM (SELECT customer_id, dob, outstanding_fine_balance, {age} AS age FROM customers WHERE {where})
+            WHERE true
+            ON CONFLICT (customer_id) DO UPDATE SET
+                age = excluded.age, age_from = excluded.age_from, age_until = excluded.age_until;'''
+
+    c.execute(refresh('true'))
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS customer_eligibility_insert
+        AFTER INSERT ON customers
+        BEGIN {refresh('customer_id = NEW.customer_id')}
+        END;
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS customer_eligibility_dob
+        AFTER UPDATE OF dob ON customers
+        WHEN OLD.dob IS NOT NEW.dob
+        BEGIN {refresh('customer_id = NEW.customer_id')}
+        END;
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS customer_eligibility_delete
+        AFTER DELETE ON customers
+        BEGIN
+            DELETE FROM customer_eligibility WHERE customer_id = OLD.customer_id;
+        END;
+    ''')
+    # The fine triggers move outstanding_fine_balance, so the block follows
+    # every fine assessed, settled or paid, in the same transaction
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS customer_eligibility_fine_block
+        AFTER UPDATE OF outstanding_fine_balance ON customers
+        BEGIN
+            UPDATE customer_eligibility SET fine_blocked = rule.blocked
+            FROM (SELECT NEW.outstanding_fine_balance >= value AS blocked
+                  FROM eligibility_rules WHERE name = 'fine_block_limit') AS rule
+            WHERE customer_id = NEW.customer_id AND fine_blocked IS NOT rule.blocked;
+        END;
+    ''')
+
+
+@migration(16, 'Triggers keeping search_terms current as titles and authors change')
+def _search_terms_triggers(c):
+    def add(ref):
+        return f'''
+            INSERT INTO search_terms (term, docs) {term_counts_sql(ref)}
+            ON CONFLICT (term) DO UPDATE SET docs = docs + excluded.docs;'''
+
+    def remove(ref):
+        return f'''
+            UPDATE search_terms SET docs = search_terms.docs - gone.docs FROM ({term_counts_sql(ref)}) AS gone
+            WHERE search_terms.term = gone.term;
+            DELETE FROM search_terms
+            WHERE docs <= 0 AND term IN (SELECT term FROM ({term_counts_sql(ref)}));'''
+
+    if not fts5_available():
+        return  # no spelling correction to keep terms for (see migration 14)
+
+    # Bulk inserts pause the insert trigger for their own transactions (see
+    # search.pause_terms) and call search.refresh_terms once at the end
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS search_terms_item_insert
+        AFTER INSERT ON library_items
+        WHEN NOT EXISTS (SELECT 1 FROM watermarks WHERE name = 'search_terms_paused')
+        BEGIN {add('NEW')}
+        END;
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS search_terms_item_delete
+        AFTER DELETE ON library_items
+        BEGIN {remove('OLD')}
+        END;
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS search_terms_item_update
+        AFTER UPDATE OF title, author ON library_items
+        WHEN OLD.title IS NOT NEW.title OR OLD.author IS NOT NEW.author
+        BEGIN {remove('OLD')} {add('NEW')}
+        END;
+    ''')
+
+    # Words added since the last search.py --refresh-terms
+    c.execute('''
+        INSERT INTO search_terms (term, docs)
+        SELECT term, SUM(doc) FROM library_items_terms
+        WHERE col IN ('title', 'author') AND length(term) >= 3 AND term GLOB '*[^0-9]*'
+        GROUP BY term
+        ON CONFLICT (term) DO UPDATE SET docs = excluded.docs WHERE docs <> excluded.docs
+    ''')
+
+
+@migration(17, 'Record the indexes a deferred bulk import has dropped')
+def _deferred_indexes(c):
+    # bulk_import.defer_index_maintenance saves each index or trigger here in
+    # the transaction that drops it; startup puts back any an import that
+    # died part way left dropped
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS deferred_indexes (
+            name TEXT PRIMARY KEY,
+            sql TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+
+@migration(18, 'Index the age filter on the catalog listing by restriction and item_id')
+def _restriction_item_index(c):
+    # With item_id spelled out the planner reads each allowed restriction as
+    # an item_id range (see search.facet_where) instead of walking the whole
+    # catalog in key order and skipping what the customer may not see
+    c.execute("CREATE INDEX IF NOT EXISTS idx_items_restriction_item ON library_items (restriction, item_id)")
+    c.execute("DROP INDEX IF EXISTS idx_items_restriction")  # a prefix of the new index
+    # Not to be put back by a deferred import that was interrupted
+    c.execute("DELETE FROM deferred_indexes WHERE name = 'idx_items_restriction'")
+
+def main():
+    parser = argparse.ArgumentParser(description='Upgrade the library database schema.')
+    parser.add_argument('--database', default=DATABASE)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    print(f"Schema version {current_version(conn)} -> {migrate(conn)}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,9 @@
+import argparse
+import bisect
+import itertools
+import random
 import sqlite3
+from datetime import date, datetime, timedelta
 
 DATABASE = 'library.db'
 
@@ -23,24 +28,7 @@ def populate_tables():
         ('Jack Ryan', 'jack@example.com', '333-222-1111', '1987-12-12', '321 Aspen St', 'Thriller', 0.0)
     ])
 
-    # Populate borrowing table
-    c.executemany('''
-        INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date, returned_date, amount_of_fine)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', [
-        (2, 1, '2025-03-01', '2025-03-15', None, 0.0),
-        (3, 2, '2025-02-20', '2025-03-05', '2025-03-06', 1.0),
-        (1, 3, '2025-03-10', '2025-03-24', None, 0.0),
-        (4, 4, '2025-03-12', '2025-03-26', None, 0.0),
-        (5, 5, '2025-03-15', '2025-03-29', None, 0.0),
-        (6, 6, '2025-03-20', '2025-04-03', None, 0.0),
-        (7, 7, '2025-03-22', '2025-04-05', None, 0.0),
-        (8, 8, '2025-03-25', '2025-04-08', None, 0.0),
-        (9, 9, '2025-03-27', '2025-04-10', None, 0.0),
-        (10, 10, '2025-03-30', '2025-04-13', None, 0.0)
-    ])
-
-        # Populate library_items table
+    # Populate library_items table (before borrowing, which references it)
     c.executemany('''
         INSERT INTO library_items (title, author, item_type, format, genre, published_date, availability, is_future_item, restriction)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
@@ -57,6 +45,22 @@ def populate_tables():
         ('The Hobbit', 'J.R.R. Tolkien', 'Book', 'Print', 'Fantasy', '1937-09-21', 'Available', 1, 0)
     ])
 
+    # Populate borrowing table
+    c.executemany('''
+        INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date, returned_date, amount_of_fine)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (2, 1, '2025-03-01', '2025-03-15', None, 0.0),
+        (3, 2, '2025-02-20', '2025-03-05', '2025-03-06', 1.0),
+        (1, 3, '2025-03-10', '2025-03-24', None, 0.0),
+        (4, 4, '2025-03-12', '2025-03-26', None, 0.0),
+        (5, 5, '2025-03-15', '2025-03-29', None, 0.0),
+        (6, 6, '2025-03-20', '2025-04-03', None, 0.0),
+        (7, 7, '2025-03-22', '2025-04-05', None, 0.0),
+        (8, 8, '2025-03-25', '2025-04-08', None, 0.0),
+        (9, 9, '2025-03-27', '2025-04-10', None, 0.0),
+        (10, 10, '2025-03-30', '2025-04-13', None, 0.0)
+    ])
 
     # Populate events table
     c.executemany('''
@@ -125,5 +129,252 @@ def populate_tables():
     conn.close()
     print("Database tables populated successfully!")
 
+# -----------------------------------------------------
+# SYNTHETIC DATA AT SCALE
+# -----------------------------------------------------
+GENRES = ['Fiction', 'Mystery', 'Fantasy', 'Sci-Fi', 'Romance', 'History', 'Science',
+          'Biography', 'Philosophy', 'Education', 'Thriller', 'Poetry', 'Music', 'Kids']
+WORDS = ['Shadow', 'River', 'Garden', 'Empire', 'Silent', 'Winter', 'Glass', 'Iron', 'Last',
+         'Hidden', 'Golden', 'Broken', 'Secret', 'Night', 'City', 'Ocean', 'Star', 'House',
+         'Fire', 'Storm', 'Letters', 'Journey', 'Kingdom', 'Memory', 'Light', 'Machine']
+FIRST_NAMES = ['Alice', 'Bob', 'Chen', 'Diana', 'Emeka', 'Fatima', 'Grace', 'Hiro', 'Ivan',
+               'Jamal', 'Kaia', 'Luis', 'Maya', 'Nils', 'Omar', 'Priya', 'Quinn', 'Rosa']
+LAST_NAMES = ['Smith', 'Nguyen', 'Garcia', 'Okafor', 'Kowalski', 'Tanaka', 'Haddad', 'Brown',
+              'Silva', 'Patel', 'Moreau', 'Larsen', 'Kim', 'Novak', 'Reyes', 'Walsh']
+# Made-up author surnames are built from these syllables, so a big catalog
+# has as many distinct author words as a real one
+SYLLABLES = [onset + vowel + coda
+             for onset in ['b', 'br', 'c', 'ch', 'd', 'dr', 'f', 'g', 'gr', 'h', 'j', 'k', 'l',
+                           'm', 'n', 'p', 'r', 's', 'sh', 'st', 't', 'th', 'tr', 'v', 'w', 'z']
+             for vowel in ['a', 'e', 'i', 'o', 'u', 'ai', 'ou']
+             for coda in ['', 'n', 'r', 'l', 's', 'm', 'k', 't']]
+# item_type -> (share of catalog, formats it comes in)
+ITEM_MIX = {
+    'Book': (0.70, ['Print', 'Print', 'Print', 'Online', 'Audio']),
+    'DVD': (0.10, ['Video']),
+    'CD': (0.07, ['Audio']),
+    'Magazine': (0.06, ['Print', 'Online']),
+    'Journal': (0.05, ['Print', 'Online']),
+    'Record': (0.02, ['Audio']),
+}
+EVENT_TYPES = ['Workshop', 'Seminar', 'Film Screening', 'Book Club', 'Art Show']
+AUDIENCES = [('All Ages', 0), ('Adults', 18), ('Teens', 13), ('Kids', 0)]
+LOAN_DAYS = 14
+GRACE_DAYS = 15  # return_item fines $1/day after this many days
+
+
+class ZipfSampler:
+    """Samples 1..n where rank k is drawn with weight 1 / k**s.
+
+    Ranks are shuffled onto ids so the popular rows are spread through the
+    table rather than being the lowest ids. Sampling is a binary search over
+    the cumulative weights.
+    """
+
+    def __init__(self, n, s, rng):
+        self.ids = list(range(1, n + 1))
+        rng.shuffle(self.ids)
+        self.cumulative = list(itertools.accumulate(1.0 / k ** s for k in range(1, n + 1)))
+        self.rng = rng
+
+    def sample(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.ids[bisect.bisect_left(self.cumulative, point)]
+
+
+def author_name(k):
+    """A pronounceable author name that is always the same for the same k."""
+    first = FIRST_NAMES[k % len(FIRST_NAMES)]
+    syllables = []
+    k += len(SYLLABLES)  # every surname has at least two syllables
+    while k:
+        k, digit = divmod(k, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+    return f"{first} {''.join(syllables).capitalize()}"
+
+
+def _insert(conn, sql, rows, chunk_size, pause_terms=False):
+    """executemany() over a row generator, committing every chunk_size rows.
+
+    With pause_terms, new titles' words are left for search.refresh_terms.
+    """
+    import search
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        if pause_terms:
+            search.pause_terms(conn)
+        conn.executemany(sql, chunk)
+        if pause_terms:
+            search.resume_terms(conn)
+        conn.commit()
+
+
+def generate_tables(database=DATABASE, customers=10000, items=50000, loans=200000,
+                    events=500, registrations=20000, days=730, zipf=1.0, seed=42,
+                    chunk_size=50000):
+    """Fills database with synthetic rows at the given scale.
+
+    Item popularity and customer activity follow Zipf distributions, so a few
+    bestsellers and heavy readers dominate the loans as they do in a real
+    branch. Loans are spread over the last `days` days; older ones are mostly
+    returned, some late enough to be fined. Rows are generated and inserted
+    in chunks, so memory stays bounded at any scale. The same seed always
+    produces the same data.
+    """
+    import app as library
+    from bulk_import import defer_index_maintenance, restore_index_maintenance
+    from search import fts5_available, refresh_terms
+    library.app.config['DATABASE'] = database
+    library.init_db()
+
+    rng = random.Random(seed)
+    today = date.today()
+    conn = sqlite3.connect(database)
+    customer_base = conn.execute("SELECT COALESCE(MAX(customer_id), 0) FROM customers").fetchone()[0]
+    item_base = conn.execute("SELECT COALESCE(MAX(item_id), 0) FROM library_items").fetchone()[0]
+    event_base = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM events").fetchone()[0]
+
+    def customer_rows():
+        for i in range(customers):
+            dob = date(1940, 1, 1) + timedelta(days=rng.randrange(78 * 365))
+            yield (f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                   f'reader{customer_base + i + 1}@example.com', f'555-{rng.randrange(10000):04d}',
+                   dob.isoformat(), f'{rng.randrange(1, 9999)} Main St', rng.choice(GENRES), 0.0)
+
+    _insert(conn, '''
+        INSERT INTO customers (name, email, phone, dob, address, preferences, outstanding_fine_balance)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', customer_rows(), chunk_size)
+
+    item_types = list(ITEM_MIX)
+    type_weights = [ITEM_MIX[t][0] for t in item_types]
+    author_sampler = ZipfSampler(max(items // 8, 1), 0.9, rng)
+
+    def item_rows():
+        for _ in range(items):
+            item_type = rng.choices(item_types, type_weights)[0]
+            title = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+            published = date(1900, 1, 1) + timedelta(days=rng.randrange(125 * 365))
+            restriction = rng.choices([0, 13, 18], [0.9, 0.07, 0.03])[0]
+            yield (f'The {title}', author_name(author_sampler.sample()), item_type,
+                   rng.choice(ITEM_MIX[item_type][1]), rng.choice(GENRES), published.isoformat(),
+                   'Available', int(rng.random() < 0.01), restriction)
+
+    # Search indexing row by row slows down as the index grows, so it is
+    # caught up once at the end, as bulk imports do
+    defer_index_maintenance(conn)
+    _insert(conn, '''
+        INSERT INTO library_items (title, author, item_type, format, genre, published_date, availability, is_future_item, restriction)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', item_rows(), chunk_size, pause_terms=True)
+    restore_index_maintenance(conn)
+
+    reader_sampler = ZipfSampler(customers, 0.8, rng) if customers else None
+    on_loan = set()  # items with an open loan; generated items have one copy
+
+    def loan_rows():
+        if not items or not customers:
+            return
+        item_sampler = ZipfSampler(items, zipf, rng)
+        for _ in range(loans):
+            item_id = item_base + item_sampler.sample()
+            customer_id = customer_base + reader_sampler.sample()
+            borrowed = today - timedelta(days=rng.randrange(days))
+            # Most items come back within the loan period, a tail comes back late
+            returned = borrowed + timedelta(days=int(rng.lognormvariate(2.2, 0.5)))
+            if returned > today and item_id not in on_loan:
+                on_loan.add(item_id)
+                returned = None
+            elif returned > today:
+                returned = today
+            fine = max((returned - borrowed).days - GRACE_DAYS, 0) * 1.0 if returned else 0.0
+            yield (item_id, customer_id, borrowed.isoformat(),
+                   (borrowed + timedelta(days=LOAN_DAYS)).isoformat(),
+                   returned.isoformat() if returned else None, fine)
+
+    _insert(conn, '''
+        INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date, returned_date, amount_of_fine)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', loan_rows(), chunk_size)
+
+    # update_item_borrowed takes a copy out for each open loan only, so
+    # availability and the copy counts are already right.
+
+    # Fines for late returns, most of them paid. Inserting them Unpaid and then
+    # paying keeps customer balances right through the fine triggers.
+    conn.execute('''
+        INSERT INTO fines (transaction_id, customer_id, amount_of_fine)
+        SELECT transaction_id, customer_id, amount_of_fine FROM borrowing
+        WHERE amount_of_fine > 0 AND customer_id > ?
+    ''', (customer_base,))
+    conn.execute('''
+        UPDATE fines SET fine_status = 'Paid'
+        WHERE customer_id > ? AND abs(random()) % 100 < 70
+    ''', (customer_base,))
+    conn.commit()
+
+    capacities = []
+
+    def event_rows():
+        for _ in range(events):
+            capacities.append(rng.choice([15, 20, 30, 50, 100, 250]))
+            audience, restriction = rng.choice(AUDIENCES)
+            when = datetime.combine(today, datetime.min.time()) + timedelta(
+                days=rng.randrange(-days // 2, 180), hours=rng.choice([10, 14, 18]))
+            yield (f'{rng.choice(WORDS)} {rng.choice(EVENT_TYPES)}', 'Generated event.',
+                   rng.choice(EVENT_TYPES), audience, restriction, f'Room {rng.choice("ABCDEFGHIJ")}',
+                   when.strftime('%Y-%m-%d %H:%M'), capacities[-1])
+
+    _insert(conn, '''
+        INSERT INTO events (event_name, event_description, event_type, targeted_customers, restriction, location, datetime, capacity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', event_rows(), chunk_size)
+
+    def registration_rows():
+        if not events or not customers:
+            return
+        event_sampler = ZipfSampler(events, 1.0, rng)
+        seen = set()
+        taken = [0] * events  # seats given out per generated event
+        for _ in range(registrations):
+            event = event_sampler.sample()
+            pair = (event_base + event, customer_base + reader_sampler.sample())
+            # Popular events fill up; the capacity trigger would refuse more
+            if pair not in seen and taken[event - 1] < capacities[event - 1]:
+                seen.add(pair)
+                taken[event - 1] += 1
+                yield pair
+
+    _insert(conn, "INSERT INTO register (event_id, customer_id) VALUES (?, ?)",
+            registration_rows(), chunk_size)
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    if fts5_available():
+        refresh_terms(conn)
+    conn.close()
+    print(f"Generated {customers} customers, {items} items, {loans} loans, "
+          f"{events} events and up to {registrations} registrations in {database}.")
+
 if __name__ == '__main__':
-    populate_tables()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Fill the library database with sample data.')
+    parser.add_argument('--generate', action='store_true',
+                        help='generate synthetic data at scale instead of the 10-row sample')
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--loans', type=int, default=200000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--registrations', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=730, help='spread loans over this many past days')
+    parser.add_argument('--zipf', type=float, default=1.0, help='skew of item popularity')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_tables(args.database, args.customers, args.items, args.loans, args.events,
+                        args.registrations, args.days, args.zipf, args.seed)
+    else:
+        populate_tables()
\ No newline at end of file
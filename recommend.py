@@ -0,0 +1,254 @@
+# recommend.py
+"""Item recommendations from borrowing history and customer preferences.
+
+Two items are related when the same customer borrowed both within
+CO_BORROW_DAYS of each other. item_pairs holds how often that happened for
+every pair (the sparse item-item co-occurrence matrix), and item_neighbors
+the NEIGHBORS_KEPT highest-scoring items of each row, so "readers also
+borrowed" is one primary key range read.
+
+The counts are built in set-based SQL passes over borrowing, one chunk of
+loans per transaction, and brought forward incrementally: loans above the
+'item_pairs.transaction_id' watermark are paired with the same customer's
+earlier loans and added to the counts, and only the items they touched are
+re-ranked. Each loan is paired with at most PAIRS_PER_LOAN others, so a
+customer with thousands of loans costs no more per loan than anyone else.
+
+    python recommend.py                 # fold in loans since the last run
+    python recommend.py --rebuild       # recount from all of borrowing
+    python recommend.py --every 3600    # keep running, once an hour
+"""
+import argparse
+import re
+import sqlite3
+import time
+
+from db import get_watermark, run_write, set_watermark
+
+WATERMARK = 'item_pairs.transaction_id'
+CO_BORROW_DAYS = 30  # loans by one customer this close together are related
+PAIRS_PER_LOAN = 20  # most recent of those a loan is paired with
+MIN_SCORE = 2  # a pair seen once is noise, not a neighbor
+NEIGHBORS_KEPT = 20
+RECENT_LOANS_USED = 20  # a customer's latest loans that seed their recommendations
+PREFERENCE_BOOST = 2  # score multiplier for items in a customer's preferred genres
+
+
+class BuildReport:
+    def __init__(self):
+        self.loans_scanned = 0
+        self.pairs_counted = 0
+        self.items_ranked = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (f"{self.loans_scanned} new loans, {self.pairs_counted} co-borrowings counted, "
+                f"{self.items_ranked} items re-ranked in {self.chunks} chunks, {self.seconds:.1f}s")
+
+
+def _count_new_loans(conn, chunk_size, report, progress):
+    """Adds the pairs of loans above the watermark to item_pairs, one chunk per transaction."""
+    while True:
+        def count_chunk(conn):
+            start = get_watermark(conn, WATERMARK)
+            end = conn.execute('''
+                SELECT MAX(transaction_id) FROM (
+                    SELECT transaction_id FROM borrowing WHERE transaction_id > ?
+                    ORDER BY transaction_id LIMIT ?
+                )
+            ''', (start, chunk_size)).fetchone()[0]
+            if end is None:
+                return 0, 0
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_pairs (item_id INTEGER, other_id INTEGER)")
+            conn.execute("DELETE FROM new_pairs")
+            # Each new loan with the customer's nearby loans recorded before it,
+            # so every pair of loans is counted once, by the later of the two
+            conn.execute('''
+                INSERT INTO new_pairs (item_id, other_id)
+                SELECT b.item_id, o.item_id
+                FROM borrowing b JOIN borrowing o ON o.transaction_id IN (
+                    SELECT e.transaction_id FROM borrowing e
+                    WHERE e.customer_id = b.customer_id
+                      AND e.borrowed_date BETWEEN date(b.borrowed_date, ?) AND date(b.borrowed_date, ?)
+                      AND e.transaction_id < b.transaction_id
+                    ORDER BY e.transaction_id DESC LIMIT ?
+                )
+                WHERE b.transaction_id > ? AND b.transaction_id <= ? AND o.item_id <> b.item_id
+            ''', (f'-{CO_BORROW_DAYS} days', f'+{CO_BORROW_DAYS} days', PAIRS_PER_LOAN, start, end))
+            conn.execute('''
+                INSERT INTO item_pairs (item_id, other_id, score)
+                SELECT item_id, other_id, COUNT(*) FROM (
+                    SELECT item_id, other_id FROM new_pairs
+                    UNION ALL
+                    SELECT other_id, item_id FROM new_pairs
+                )
+                WHERE true
+                GROUP BY item_id, other_id
+                ON CONFLICT (item_id, other_id) DO UPDATE SET score = score + excluded.score
+            ''')
+            conn.execute('''
+                INSERT OR IGNORE INTO item_neighbors_stale (item_id)
+                SELECT item_id FROM new_pairs UNION SELECT other_id FROM new_pairs
+            ''')
+            conn.execute('''
+                INSERT INTO item_popularity (item_id, loans)
+                SELECT item_id, COUNT(*) FROM borrowing
+                WHERE transaction_id > ? AND transaction_id <= ?
+                GROUP BY item_id
+                ON CONFLICT (item_id) DO UPDATE SET loans = loans + excluded.loans
+            ''', (start, end))
+            set_watermark(conn, WATERMARK, end)
+            scanned = conn.execute(
+                "SELECT COUNT(*) FROM borrowing WHERE transaction_id > ? AND transaction_id <= ?", (start, end)
+            ).fetchone()[0]
+            return scanned, conn.execute("SELECT COUNT(*) FROM new_pairs").fetchone()[0]
+
+        scanned, pairs = run_write(conn, count_chunk)
+        if not scanned:
+            return
+        report.loans_scanned += scanned
+        report.pairs_counted += pairs
+        report.chunks += 1
+        if progress:
+            progress(report)
+
+
+def _rank_stale_items(conn, chunk_size, report):
+    """Recomputes item_neighbors for items whose counts changed, one chunk per transaction."""
+    while True:
+        def rank_chunk(conn):
+            end = conn.execute('''
+                SELECT MAX(item_id) FROM (
+                    SELECT item_id FROM item_neighbors_stale ORDER BY item_id LIMIT ?
+                )
+            ''', (chunk_size,)).fetchone()[0]
+            if end is None:
+                return 0
+            conn.execute('''
+                DELETE FROM item_neighbors
+                WHERE item_id IN (SELECT item_id FROM item_neighbors_stale WHERE item_id <= ?)
+            ''', (end,))
+            conn.execute('''
+                INSERT INTO item_neighbors (item_id, rank, neighbor_id, score)
+                SELECT item_id, rank, other_id, score FROM (
+                    SELECT p.item_id, p.other_id, p.score,
+                           ROW_NUMBER() OVER (PARTITION BY p.item_id
+                                              ORDER BY p.score DESC, p.other_id) AS rank
+                    FROM item_neighbors_stale s JOIN item_pairs p ON p.item_id = s.item_id
+                    WHERE s.item_id <= ? AND p.score >= ?
+                )
+                WHERE rank <= ?
+            ''', (end, MIN_SCORE, NEIGHBORS_KEPT))
+            conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'item_neighbors'")
+            return conn.execute("DELETE FROM item_neighbors_stale WHERE item_id <= ?", (end,)).rowcount
+
+        ranked = run_write(conn, rank_chunk)
+        if not ranked:
+            return
+        report.items_ranked += ranked
+
+
+def build_neighbors(conn, rebuild=False, chunk_size=50000, progress=None):
+    """Brings item_pairs and item_neighbors up to date with borrowing.
+
+    With rebuild=True the counts are dropped and recomputed from every loan.
+    `progress(report)` is called per chunk of loans. Returns a BuildReport.
+    """
+    report = BuildReport()
+    start = time.perf_counter()
+    if rebuild:
+        def reset(conn):
+            for table in ('item_pairs', 'item_neighbors', 'item_neighbors_stale', 'item_popularity'):
+                conn.execute(f"DELETE FROM {table}")
+            set_watermark(conn, WATERMARK, 0)
+        run_write(conn, reset)
+    _count_new_loans(conn, chunk_size, report, progress)
+    _rank_stale_items(conn, chunk_size, report)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def also_borrowed(conn, item_id, limit=5):
+    """Items most often borrowed along with item_id, best first."""
+    return conn.execute('''
+        SELECT i.item_id, i.title, i.author, i.item_type, i.available_copies, n.score
+        FROM item_neighbors n JOIN library_items i ON i.item_id = n.neighbor_id
+        WHERE n.item_id = ? AND i.is_future_item = 0
+        ORDER BY n.rank LIMIT ?
+    ''', (item_id, limit)).fetchall()
+
+
+def preferred_genres(preferences):
+    """'Sci-Fi, History' -> ['sci-fi', 'history']."""
+    return [genre.strip().lower() for genre in re.split(r'[,;/]', preferences or '') if genre.strip()]
+
+
+def recommended_for(conn, customer_id, limit=10):
+    """Items for customer_id they have not borrowed yet, best first.
+
+    Neighbors of the customer's RECENT_LOANS_USED latest loans, summed, with
+    items in the genres of their preferences counted PREFERENCE_BOOST times.
+    A customer with little history is topped up with the most borrowed items
+    in their preferred genres.
+    """
+    row = conn.execute("SELECT preferences FROM customers WHERE customer_id = ?", (customer_id,)).fetchone()
+    if row is None:
+        return []
+    genres = preferred_genres(row[0])
+    in_genres = f"lower(i.genre) IN ({', '.join('?' * len(genres))})" if genres else '0'
+
+    items = conn.execute(f'''
+        SELECT i.item_id, i.title, i.author, i.item_type, i.genre, i.available_copies,
+               SUM(n.score) * CASE WHEN {in_genres} THEN {PREFERENCE_BOOST} ELSE 1 END AS score
+        FROM item_neighbors n JOIN library_items i ON i.item_id = n.neighbor_id
+        WHERE n.item_id IN (
+                SELECT item_id FROM borrowing WHERE customer_id = ?
+                ORDER BY borrowed_date DESC LIMIT ?
+              )
+          AND n.neighbor_id NOT IN (SELECT item_id FROM borrowing WHERE customer_id = ?)
+          AND i.is_future_item = 0
+        GROUP BY n.neighbor_id
+        ORDER BY score DESC, n.neighbor_id LIMIT ?
+    ''', genres + [customer_id, RECENT_LOANS_USED, customer_id, limit]).fetchall()
+    if len(items) >= limit:
+        return items
+
+    chosen = [item[0] for item in items]
+    popular = conn.execute(f'''
+        SELECT i.item_id, i.title, i.author, i.item_type, i.genre, i.available_copies, 0 AS score
+        FROM item_popularity p JOIN library_items i ON i.item_id = p.item_id
+        WHERE {in_genres if genres else 'true'} AND i.is_future_item = 0
+          AND p.item_id NOT IN (SELECT item_id FROM borrowing WHERE customer_id = ?)
+          AND p.item_id NOT IN ({', '.join('?' * len(chosen)) or 'NULL'})
+        ORDER BY p.loans DESC LIMIT ?
+    ''', genres + [customer_id] + chosen + [limit - len(items)]).fetchall()
+    return items + popular
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the item neighbors used for recommendations.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--rebuild', action='store_true', help='recount from every loan')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--every', type=float, help='repeat every N seconds instead of exiting')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+
+    def show_progress(report):
+        print(f"  chunk {report.chunks}: {report.loans_scanned} loans, {report.pairs_counted} pairs")
+
+    rebuild = args.rebuild
+    while True:
+        print(build_neighbors(conn, rebuild, args.chunk_size, show_progress))
+        if not args.every:
+            break
+        rebuild = False
+        time.sleep(args.every)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# reconcile.py
+"""Reconciliation of customers.outstanding_fine_balance against the fines table.
+
+A customer's balance should equal the sum of their unpaid fines. Rather than
+re-aggregating every fine each night, fine_ledger keeps the expected balance
+per customer and is brought forward incrementally:
+
+  * fines with fine_id above the 'fine_ledger.fine_id' watermark are new and
+    are added to the ledger in fine_id chunks;
+  * changes to fines already counted (paid, accrued, deleted) are recorded by
+    triggers in fine_changes and folded into the ledger, then removed.
+
+The ledger is then compared with customers, which costs one pass over
+customers rather than over fines.
+
+    python reconcile.py            # report mismatches
+    python reconcile.py --repair   # also set balances to the ledger
+"""
+import argparse
+import sqlite3
+import time
+
+from db import get_watermark, run_write, set_watermark
+
+WATERMARK = 'fine_ledger.fine_id'
+TOLERANCE = 0.005  # balances are REAL; ignore sub-cent rounding
+
+
+class ReconcileReport:
+    def __init__(self):
+        self.fines_scanned = 0
+        self.changes_applied = 0
+        self.mismatches = 0
+        self.repaired = 0
+        self.examples = []  # (customer_id, recorded balance, expected balance)
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (f"{self.fines_scanned} new fines, {self.changes_applied} fine changes applied, "
+                f"{self.mismatches} mismatched balances, {self.repaired} repaired, "
+                f"{self.seconds:.1f}s")
+
+
+def _scan_new_fines(conn, chunk_size, report):
+    """Adds fines above the watermark to the ledger, one chunk per transaction."""
+    while True:
+        def scan_chunk(conn):
+            start = get_watermark(conn, WATERMARK)
+            end = conn.execute('''
+                SELECT MAX(fine_id) FROM (
+                    SELECT fine_id FROM fines WHERE fine_id > ? ORDER BY fine_id LIMIT ?
+                )
+            ''', (start, chunk_size)).fetchone()[0]
+            if end is None:
+                return 0
+            conn.execute('''
+                INSERT INTO fine_ledger (customer_id, expected_balance)
+                SELECT customer_id, SUM(amount_of_fine) FROM fines
+                WHERE fine_id > ? AND fine_id <= ? AND fine_status = 'Unpaid'
+                GROUP BY customer_id
+                ON CONFLICT (customer_id) DO UPDATE
+                SET expected_balance = expected_balance + excluded.expected_balance
+            ''', (start, end))
+            # The scan saw these fines as they are now, so changes logged
+            # before it are already counted
+            conn.execute("DELETE FROM fine_changes WHERE fine_id > ? AND fine_id <= ?", (start, end))
+            set_watermark(conn, WATERMARK, end)
+            return conn.execute(
+                "SELECT COUNT(*) FROM fines WHERE fine_id > ? AND fine_id <= ?", (start, end)
+            ).fetchone()[0]
+
+        scanned = run_write(conn, scan_chunk)
+        if not scanned:
+            return
+        report.fines_scanned += scanned
+
+
+def _fold_changes(conn, end_change_id):
+    """Moves logged changes up to end_change_id for counted fines into the ledger.
+
+    Changes to fines above the watermark stay in the log; the scan that
+    counts those fines discards them. Returns the number of changes folded.
+    """
+    watermark = get_watermark(conn, WATERMARK)
+    conn.execute('''
+        INSERT INTO fine_ledger (customer_id, expected_balance)
+        SELECT customer_id, SUM(delta) FROM fine_changes
+        WHERE change_id <= ? AND fine_id <= ?
+        GROUP BY customer_id
+        ON CONFLICT (customer_id) DO UPDATE
+        SET expected_balance = expected_balance + excluded.expected_balance
+    ''', (end_change_id, watermark))
+    return conn.execute(
+        "DELETE FROM fine_changes WHERE change_id <= ? AND fine_id <= ?", (end_change_id, watermark)
+    ).rowcount
+
+
+def _apply_changes(conn, chunk_size, report):
+    """Folds the change log into the ledger, one chunk per transaction."""
+    while True:
+        def apply_chunk(conn):
+            end = conn.execute('''
+                SELECT MAX(change_id) FROM (
+                    SELECT change_id FROM fine_changes WHERE fine_id <= ?
+                    ORDER BY change_id LIMIT ?
+                )
+            ''', (get_watermark(conn, WATERMARK), chunk_size)).fetchone()[0]
+            return _fold_changes(conn, end) if end is not None else 0
+
+        applied = run_write(conn, apply_chunk)
+        if not applied:
+            return
+        report.changes_applied += applied
+
+
+def reconcile(conn, repair=False, chunk_size=50000, max_examples=20):
+    """Brings the ledger up to date and compares it with customer balances.
+
+    With repair=True, mismatched balances are set to the ledger value in the
+    same transaction as the comparison. Returns a ReconcileReport.
+    """
+    report = ReconcileReport()
+    start = time.perf_counter()
+    _scan_new_fines(conn, chunk_size, report)
+    _apply_changes(conn, chunk_size, report)
+
+    mismatch_sql = f'''
+        SELECT c.customer_id, c.outstanding_fine_balance, COALESCE(l.expected_balance, 0.0)
+        FROM customers c LEFT JOIN fine_ledger l ON l.customer_id = c.customer_id
+        WHERE abs(c.outstanding_fine_balance - COALESCE(l.expected_balance, 0.0)) > {TOLERANCE}
+    '''
+
+    def compare(conn):
+        # Fold in changes logged since the last step, so the comparison and
+        # the repair see one consistent state
+        folded = _fold_changes(conn, 2 ** 63 - 1)
+        cursor = conn.execute(mismatch_sql)
+        examples, count = [], 0
+        for row in cursor:
+            count += 1
+            if len(examples) < max_examples:
+                examples.append(tuple(row))
+        repaired = 0
+        if repair and count:
+            repaired = conn.execute('''
+                UPDATE customers
+                SET outstanding_fine_balance = COALESCE(
+                    (SELECT expected_balance FROM fine_ledger l WHERE l.customer_id = customers.customer_id), 0.0)
+                WHERE abs(outstanding_fine_balance - COALESCE(
+                    (SELECT expected_balance FROM fine_ledger l WHERE l.customer_id = customers.customer_id), 0.0)) > ?
+            ''', (TOLERANCE,)).rowcount
+        return folded, count, examples, repaired
+
+    folded, report.mismatches, report.examples, report.repaired = run_write(conn, compare)
+    report.changes_applied += folded
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile customer fine balances with fines.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--repair', action='store_true', help='set mismatched balances to the ledger')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    report = reconcile(conn, repair=args.repair, chunk_size=args.chunk_size)
+    conn.close()
+
+    print(report)
+    for customer_id, recorded, expected in report.examples:
+        print(f"  customer {customer_id}: balance {recorded:.2f}, unpaid fines {expected:.2f}")
+
+
+if __name__ == '__main__':
+    main()
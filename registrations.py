@@ -0,0 +1,151 @@
+# registrations.py
+"""Event registration with capacity limits and a waitlist.
+
+events.registered_count is kept by triggers on register, and a BEFORE
+INSERT trigger refuses a registration once it reaches capacity, so the
+limit holds for every writer. Here each registration is one BEGIN IMMEDIATE
+transaction (see db.run_write): concurrent requests for the last seat are
+serialized, one gets it and the others join the waitlist. Cancelling a
+registration hands the seat to the first customer waiting.
+"""
+import sqlite3
+
+from db import run_write
+from eligibility import eligibility
+
+REGISTERED = 'registered'
+WAITLISTED = 'waitlisted'
+
+
+class RegistrationError(Exception):
+    """A registration that cannot go ahead; `status` is the HTTP status."""
+    status = 400
+
+
+class NotFound(RegistrationError):
+    status = 404
+
+
+class AlreadyRegistered(RegistrationError):
+    status = 409
+
+
+class EventFull(RegistrationError):
+    status = 409
+
+
+class NotEligible(RegistrationError):
+    status = 403
+
+
+def parse_id(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RegistrationError(f"Enter a valid {field}.")
+
+
+def seats_left(event):
+    """Seats still free for an events row (None if capacity is unlimited)."""
+    if event['capacity'] is None:
+        return None
+    return max(event['capacity'] - event['registered_count'], 0)
+
+
+def _waitlist_position(conn, event_id, waitlist_id):
+    return conn.execute(
+        "SELECT COUNT(*) FROM event_waitlist WHERE event_id = ? AND waitlist_id <= ?",
+        (event_id, waitlist_id)
+    ).fetchone()[0]
+
+
+def take_seat(conn, event_id, customer_id, waitlist=True):
+    """Registers inside the caller's write transaction.
+
+    Returns (REGISTERED, None) or, when the event is full and `waitlist` is
+    set, (WAITLISTED, position in the queue).
+    """
+    event = conn.execute('''
+        SELECT capacity, registered_count, restriction, substr(datetime, 1, 10) FROM events
+        WHERE event_id = ?
+    ''', (event_id,)).fetchone()
+    # The customer's age on the day of the event
+    allowed = eligibility(conn, customer_id, event[3] if event else None)
+    if allowed is None:
+        raise NotFound(f"Customer {customer_id} not found.")
+    if event is None:
+        raise NotFound("Event not found.")
+    capacity, registered, restriction, _ = event
+    if (restriction or 0) > allowed[0]:
+        raise NotEligible(f"This event is for ages {restriction} and over.")
+    if conn.execute(
+        "SELECT 1 FROM register WHERE event_id = ? AND customer_id = ?", (event_id, customer_id)
+    ).fetchone():
+        raise AlreadyRegistered("You are already registered for this event.")
+
+    if capacity is None or registered < capacity:
+        try:
+            conn.execute("INSERT INTO register (event_id, customer_id) VALUES (?, ?)",
+                         (event_id, customer_id))
+            return REGISTERED, None
+        except sqlite3.IntegrityError as e:
+            if 'event is full' not in str(e):
+                raise
+
+    if not waitlist:
+        raise EventFull("Sorry, this event is full.")
+    conn.execute('''
+        INSERT INTO event_waitlist (event_id, customer_id) VALUES (?, ?)
+        ON CONFLICT (event_id, customer_id) DO NOTHING
+    ''', (event_id, customer_id))
+    waitlist_id = conn.execute(
+        "SELECT waitlist_id FROM event_waitlist WHERE event_id = ? AND customer_id = ?",
+        (event_id, customer_id)
+    ).fetchone()[0]
+    return WAITLISTED, _waitlist_position(conn, event_id, waitlist_id)
+
+
+def register(conn, event_id, customer_id, waitlist=True):
+    """Registers customer_id for event_id in its own transaction; see take_seat."""
+    event_id = parse_id(event_id, 'Event ID')
+    customer_id = parse_id(customer_id, 'Customer ID')
+    return run_write(conn, lambda conn: take_seat(conn, event_id, customer_id, waitlist))
+
+
+def cancel(conn, event_id, customer_id):
+    """Cancels a registration or waitlist entry.
+
+    A freed seat goes to the first customer on the waitlist, in the same
+    transaction. Returns the customer_id promoted, or None.
+    """
+    event_id = parse_id(event_id, 'Event ID')
+    customer_id = parse_id(customer_id, 'Customer ID')
+
+    def release(conn):
+        removed = conn.execute(
+            "DELETE FROM register WHERE event_id = ? AND customer_id = ?", (event_id, customer_id)
+        ).rowcount
+        if not removed:
+            if not conn.execute(
+                "DELETE FROM event_waitlist WHERE event_id = ? AND customer_id = ?", (event_id, customer_id)
+            ).rowcount:
+                raise NotFound("No registration found for this customer.")
+            return None
+
+        following = conn.execute('''
+            SELECT waitlist_id, customer_id FROM event_waitlist
+            WHERE event_id = ? ORDER BY waitlist_id LIMIT 1
+        ''', (event_id,)).fetchone()
+        if following is None:
+            return None
+        try:
+            conn.execute("INSERT INTO register (event_id, customer_id) VALUES (?, ?)",
+                         (event_id, following[1]))
+        except sqlite3.IntegrityError as e:
+            if 'event is full' not in str(e):
+                raise
+            return None  # still over capacity (it was lowered); keep waiting
+        conn.execute("DELETE FROM event_waitlist WHERE waitlist_id = ?", (following[0],))
+        return following[1]
+
+    return run_write(conn, release)
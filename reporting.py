@@ -0,0 +1,312 @@
+# reporting.py
+"""Circulation reports from pre-aggregated daily rollups.
+
+daily_circulation holds one row per (day, genre, item_type): loans made,
+returns (and how many were late), fines charged and fines paid. Dashboard
+queries read a date range of it with a primary key range scan instead of
+scanning borrowing and fines, so they stay fast however long the history is
+and do not hold up the live app.
+
+The rollups are brought forward incrementally, like the fine ledger in
+reconcile.py:
+
+  * loans above the 'daily_circulation.transaction_id' watermark and fines
+    above 'daily_circulation.fine_id' are new and are counted as they are
+    now, one chunk per transaction;
+  * returns, fine changes and deletes of rows already counted are logged by
+    triggers in circulation_changes and folded in, then removed.
+
+Event attendance comes from events.registered_count, which triggers already
+keep, so it needs no rollup of its own.
+
+    python reporting.py                 # bring the rollups up to date
+    python reporting.py --rebuild       # recount from borrowing and fines
+    python reporting.py --every 600     # keep running, every ten minutes
+    python reporting.py --export genre --from 2025-01-01 --to 2025-06-30 > genre.csv
+"""
+import argparse
+import csv
+import functools
+import io
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+from db import get_watermark, run_write, set_watermark
+
+LOAN_WATERMARK = 'daily_circulation.transaction_id'
+FINE_WATERMARK = 'daily_circulation.fine_id'
+DEFAULT_DAYS = 30  # reports cover the last month unless given a range
+CSV_BATCH_ROWS = 500  # rows fetched and written per chunk of a CSV export
+
+_MEASURES = ('loans', 'returns', 'late_returns', 'fines_charged', 'fines_paid')
+
+# (day, genre, item_type, measures...) for the loans with transaction_id in
+# (:start, :end]: each counts on the day borrowed and, if back, the day returned
+_LOAN_ROWS = '''
+    SELECT b.borrowed_date AS day, COALESCE(i.genre, '') AS genre,
+           COALESCE(i.item_type, '') AS item_type, 1 AS loans, 0 AS returns,
+           0 AS late_returns, 0.0 AS fines_charged, 0.0 AS fines_paid
+    FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+    WHERE b.transaction_id > :start AND b.transaction_id <= :end
+    UNION ALL
+    SELECT b.returned_date, COALESCE(i.genre, ''), COALESCE(i.item_type, ''),
+           0, 1, COALESCE(b.returned_date > b.due_date, 0), 0.0, 0.0
+    FROM borrowing b JOIN library_items i ON i.item_id = b.item_id
+    WHERE b.transaction_id > :start AND b.transaction_id <= :end AND b.returned_date IS NOT NULL
+'''
+
+# The same for fines with fine_id in (:start, :end], on the day their loan fell due
+_FINE_ROWS = '''
+    SELECT COALESCE(b.due_date, b.borrowed_date) AS day, COALESCE(i.genre, '') AS genre,
+           COALESCE(i.item_type, '') AS item_type, 0 AS loans, 0 AS returns, 0 AS late_returns,
+           f.amount_of_fine AS fines_charged,
+           CASE WHEN f.fine_status = 'Paid' THEN f.amount_of_fine ELSE 0 END AS fines_paid
+    FROM fines f
+    JOIN borrowing b ON b.transaction_id = f.transaction_id
+    JOIN library_items i ON i.item_id = b.item_id
+    WHERE f.fine_id > :start AND f.fine_id <= :end
+'''
+
+
+class ReportError(Exception):
+    """A report request that cannot be answered; `status` is the HTTP status."""
+    status = 400
+
+
+class RollupReport:
+    def __init__(self):
+        self.loans_scanned = 0
+        self.fines_scanned = 0
+        self.changes_applied = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (f"{self.loans_scanned} new loans, {self.fines_scanned} new fines, "
+                f"{self.changes_applied} changes applied, {self.seconds:.1f}s")
+
+
+def _add_to_rollup(conn, rows_sql, params):
+    """Adds the (day, genre, item_type, measures...) rows of rows_sql to daily_circulation."""
+    conn.execute(f'''
+        INSERT INTO daily_circulation (day, genre, item_type, {', '.join(_MEASURES)})
+        SELECT day, genre, item_type, {', '.join(f'SUM({m})' for m in _MEASURES)}
+        FROM ({rows_sql})
+        WHERE day IS NOT NULL
+        GROUP BY day, genre, item_type
+        ON CONFLICT (day, genre, item_type) DO UPDATE
+        SET {', '.join(f'{m} = {m} + excluded.{m}' for m in _MEASURES)}
+    ''', params)
+
+
+def _scan_new_rows(conn, table, key, watermark, rows_sql, chunk_size):
+    """Counts rows of table above the watermark, one chunk per transaction.
+
+    Returns the number of rows counted.
+    """
+    total = 0
+    while True:
+        def scan_chunk(conn):
+            start = get_watermark(conn, watermark)
+            end = conn.execute(f'''
+                SELECT MAX({key}) FROM (
+                    SELECT {key} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?
+                )
+            ''', (start, chunk_size)).fetchone()[0]
+            if end is None:
+                return 0
+            _add_to_rollup(conn, rows_sql, {'start': start, 'end': end})
+            # The scan saw these rows as they are now, so changes logged
+            # before it are already counted
+            conn.execute(f"DELETE FROM circulation_changes WHERE {key} > ? AND {key} <= ?", (start, end))
+            set_watermark(conn, watermark, end)
+            return conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE {key} > ? AND {key} <= ?", (start, end)
+            ).fetchone()[0]
+
+        scanned = run_write(conn, scan_chunk)
+        if not scanned:
+            return total
+        total += scanned
+
+
+# Changes to loans and fines at or below their watermarks
+_COUNTED = '(transaction_id <= :loans OR fine_id <= :fines)'
+
+
+def _apply_changes(conn, chunk_size):
+    """Folds logged changes to counted loans and fines into the rollup.
+
+    Changes to rows above the watermarks stay in the log; the scan that
+    counts those rows discards them. Returns the number of changes folded.
+    """
+    total = 0
+    while True:
+        def apply_chunk(conn):
+            params = {'loans': get_watermark(conn, LOAN_WATERMARK),
+                      'fines': get_watermark(conn, FINE_WATERMARK), 'limit': chunk_size}
+            params['end'] = conn.execute(f'''
+                SELECT MAX(change_id) FROM (
+                    SELECT change_id FROM circulation_changes WHERE {_COUNTED}
+                    ORDER BY change_id LIMIT :limit
+                )
+            ''', params).fetchone()[0]
+            if params['end'] is None:
+                return 0
+            where = f"change_id <= :end AND {_COUNTED}"
+            _add_to_rollup(conn, f'''
+                SELECT day, genre, item_type, {', '.join(_MEASURES)}
+                FROM circulation_changes WHERE {where}
+            ''', params)
+            return conn.execute(f"DELETE FROM circulation_changes WHERE {where}", params).rowcount
+
+        applied = run_write(conn, apply_chunk)
+        if not applied:
+            return total
+        total += applied
+
+
+def update_rollups(conn, rebuild=False, chunk_size=50000):
+    """Brings daily_circulation up to date with borrowing and fines.
+
+    With rebuild=True the rollup is dropped and recounted from scratch.
+    Returns a RollupReport.
+    """
+    report = RollupReport()
+    start = time.perf_counter()
+    if rebuild:
+        def reset(conn):
+            conn.execute("DELETE FROM daily_circulation")
+            conn.execute("DELETE FROM circulation_changes")
+            set_watermark(conn, LOAN_WATERMARK, 0)
+            set_watermark(conn, FINE_WATERMARK, 0)
+        run_write(conn, reset)
+    report.loans_scanned = _scan_new_rows(conn, 'borrowing', 'transaction_id', LOAN_WATERMARK,
+                                          _LOAN_ROWS, chunk_size)
+    report.fines_scanned = _scan_new_rows(conn, 'fines', 'fine_id', FINE_WATERMARK, _FINE_ROWS, chunk_size)
+    report.changes_applied = _apply_changes(conn, chunk_size)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+# -----------------------------------------------------
+# Report queries
+# -----------------------------------------------------
+GROUPINGS = {'day': 'day', 'month': 'substr(day, 1, 7)', 'genre': 'genre', 'item_type': 'item_type'}
+
+
+def parse_range(start=None, end=None):
+    """('YYYY-MM-DD' or None, ...) -> (start, end); the last DEFAULT_DAYS up to today by default."""
+    try:
+        end = date.fromisoformat(end) if end else date.today()
+        start = date.fromisoformat(start) if start else end - timedelta(days=DEFAULT_DAYS - 1)
+    except ValueError:
+        raise ReportError("Dates must be YYYY-MM-DD.")
+    if start > end:
+        raise ReportError("The start date is after the end date.")
+    return start.isoformat(), end.isoformat()
+
+
+def circulation(conn, start, end, by='day'):
+    """Loans, returns, late-return rate and fines between start and end, grouped by `by`.
+
+    Returns the cursor, so an export can stream it.
+    """
+    key = GROUPINGS[by]
+    return conn.execute(f'''
+        SELECT {key} AS {by}, SUM(loans) AS loans, SUM(returns) AS returns,
+               SUM(late_returns) AS late_returns,
+               ROUND(100.0 * SUM(late_returns) / NULLIF(SUM(returns), 0), 1) AS late_pct,
+               ROUND(SUM(fines_charged), 2) AS fines_charged, ROUND(SUM(fines_paid), 2) AS fines_paid
+        FROM daily_circulation
+        WHERE day BETWEEN ? AND ?
+        GROUP BY 1 ORDER BY 1
+    ''', (start, end))
+
+
+def event_attendance(conn, start, end):
+    """Registrations against capacity for events between start and end, by event type."""
+    return conn.execute('''
+        SELECT COALESCE(event_type, '') AS event_type, COUNT(*) AS events,
+               SUM(registered_count) AS registered, SUM(capacity) AS capacity,
+               ROUND(100.0 * SUM(registered_count) / NULLIF(SUM(capacity), 0), 1) AS fill_pct
+        FROM events
+        WHERE datetime >= ? AND datetime < date(?, '+1 day')
+        GROUP BY 1 ORDER BY 1
+    ''', (start, end))
+
+
+def overdue_now(conn, today=None):
+    """(open loans, overdue open loans) as of today, counted on the open-loan indexes."""
+    return conn.execute('''
+        SELECT (SELECT COUNT(*) FROM borrowing WHERE returned_date IS NULL),
+               (SELECT COUNT(*) FROM borrowing WHERE returned_date IS NULL AND due_date < ?)
+    ''', (today or date.today().isoformat(),)).fetchone()
+
+
+def pending(conn):
+    """Loans, fines and changes the rollup has not counted yet."""
+    return conn.execute('''
+        SELECT (SELECT COUNT(*) FROM borrowing WHERE transaction_id > ?),
+               (SELECT COUNT(*) FROM fines WHERE fine_id > ?),
+               (SELECT COUNT(*) FROM circulation_changes)
+    ''', (get_watermark(conn, LOAN_WATERMARK), get_watermark(conn, FINE_WATERMARK))).fetchone()
+
+
+# name -> function(conn, start, end) returning a cursor, for exports
+REPORTS = {by: functools.partial(circulation, by=by) for by in GROUPINGS}
+REPORTS['events'] = event_attendance
+
+
+def stream_csv(cursor, batch_rows=CSV_BATCH_ROWS):
+    """Yields a cursor's rows as CSV text, header first, batch_rows at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([d[0] for d in cursor.description])
+    while True:
+        rows = cursor.fetchmany(batch_rows)
+        writer.writerows(rows)
+        if buffer.tell():
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if not rows:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the circulation rollups and export reports.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--rebuild', action='store_true', help='recount the rollups from scratch')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--every', type=float, help='repeat every N seconds instead of exiting')
+    parser.add_argument('--export', choices=sorted(REPORTS), help='write this report as CSV to stdout')
+    parser.add_argument('--from', dest='start', help='first day of the export, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', help='last day of the export, YYYY-MM-DD (default today)')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    if args.export:
+        try:
+            start, end = parse_range(args.start, args.end)
+        except ReportError as e:
+            parser.error(str(e))
+        for text in stream_csv(REPORTS[args.export](conn, start, end)):
+            sys.stdout.write(text)
+        conn.close()
+        return
+
+    rebuild = args.rebuild
+    while True:
+        print(update_rollups(conn, rebuild, args.chunk_size))
+        if not args.every:
+            break
+        rebuild = False
+        time.sleep(args.every)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
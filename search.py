@@ -0,0 +1,424 @@
+# search.py
+"""Catalog search: full-text matching, facet filters and spelling correction.
+
+    python search.py --refresh-terms          # pick up new title and author words
+    python search.py --refresh-terms --every 3600
+"""
+import argparse
+import re
+import sqlite3
+import string
+import time
+import unicodedata
+
+from db import run_write, set_watermark
+
+# Column weights for bm25(): a hit in the title counts more than one in the
+# author, which counts more than one in the genre.
+TITLE_WEIGHT = 10.0
+AUTHOR_WEIGHT = 5.0
+GENRE_WEIGHT = 1.0
+
+# library_items columns the listing can be filtered on; item_facets keeps
+# how many titles have each value
+FACETS = ('item_type', 'format', 'genre', 'availability', 'restriction')
+
+# Spelling correction: a word with no match is replaced by the indexed term
+# fewest edits away, up to MAX_EDITS; words under TWO_EDIT_LENGTH letters
+# get one edit
+MAX_EDITS = 2
+TWO_EDIT_LENGTH = 3 * (MAX_EDITS + 1)
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+# While this watermark is set, triggers stop adding new titles' words to
+# search_terms
+TERMS_PAUSED = 'search_terms_paused'
+
+_fts5_supported = None
+
+
+def fts5_available():
+    """Returns True if this SQLite build can create FTS5 tables."""
+    global _fts5_supported
+    if _fts5_supported is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute("CREATE VIRTUAL TABLE fts5_probe USING fts5(x)")
+            _fts5_supported = True
+        except sqlite3.OperationalError:
+            _fts5_supported = False
+        finally:
+            conn.close()
+    return _fts5_supported
+
+
+def create_search_index(c):
+    """Creates the library_items_fts index and the triggers that keep it in sync.
+
+    The index is an external-content FTS5 table over library_items, so the
+    text is stored once and only the inverted index is kept here. Does nothing
+    if FTS5 is not compiled in; search_items() then falls back to LIKE.
+    """
+    if not fts5_available():
+        return
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'library_items_fts'")
+    is_new = c.fetchone() is None
+
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS library_items_fts USING fts5(
+            title, author, genre,
+            content='library_items',
+            content_rowid='item_id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS library_items_fts_insert
+        AFTER INSERT ON library_items
+        BEGIN
+            INSERT INTO library_items_fts (rowid, title, author, genre)
+            VALUES (NEW.item_id, NEW.title, NEW.author, NEW.genre);
+        END;
+    ''')
+
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS library_items_fts_delete
+        AFTER DELETE ON library_items
+        BEGIN
+            INSERT INTO library_items_fts (library_items_fts, rowid, title, author, genre)
+            VALUES ('delete', OLD.item_id, OLD.title, OLD.author, OLD.genre);
+        END;
+    ''')
+
+    # Only re-index when a searchable column changes, so availability flips
+    # from update_item_borrowed / update_item_returned stay cheap.
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS library_items_fts_update
+        AFTER UPDATE OF title, author, genre ON library_items
+        BEGIN
+            INSERT INTO library_items_fts (library_items_fts, rowid, title, author, genre)
+            VALUES ('delete', OLD.item_id, OLD.title, OLD.author, OLD.genre);
+            INSERT INTO library_items_fts (rowid, title, author, genre)
+            VALUES (NEW.item_id, NEW.title, NEW.author, NEW.genre);
+        END;
+    ''')
+
+    # Index rows that existed before the FTS table did
+    if is_new:
+        c.execute("INSERT INTO library_items_fts (library_items_fts) VALUES ('rebuild')")
+
+
+def build_match_query(search_query):
+    """Turns free text into an FTS5 MATCH expression.
+
+    Every word becomes a quoted prefix term, so "tolk hob" matches
+    "J.R.R. Tolkien" / "The Hobbit". Returns None if there are no words.
+    """
+    terms = re.findall(r'\w+', search_query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def selected_facets(args):
+    """{facet: value} for the facet filters given in request args; blank ones are skipped."""
+    selected = {}
+    for facet in FACETS:
+        value = args.get(facet, '').strip()
+        if value:
+            selected[facet] = int(value) if facet == 'restriction' and value.isdigit() else value
+    return selected
+
+
+def facet_where(selected, age=None):
+    """WHERE clause (without the keyword) and parameters for selected facets.
+
+    With `age`, only items open to a customer of that age are kept.
+    """
+    clauses = [f"library_items.{facet} = ?" for facet in selected]
+    params = list(selected.values())
+    if age is not None and not selected:
+        # Each restriction in use up to the age is an item_id range of
+        # idx_items_restriction_item, so a page reads a few rows per range
+        # however few of the items the customer may see
+        clauses.append('''library_items.restriction IN (
+            SELECT value FROM item_facets WHERE facet = 'restriction' AND value <= ?)''')
+        params.append(age)
+    elif age is not None:
+        clauses.append("library_items.restriction <= ?")
+        params.append(age)
+    return ' AND '.join(clauses), params
+
+
+def facet_counts(conn):
+    """{facet: [(value, items), ...]} over the whole catalog, most items first."""
+    counts = {facet: [] for facet in FACETS}
+    for facet, value, items in conn.execute('''
+        SELECT facet, value, items FROM item_facets
+        WHERE items > 0 AND value <> ''
+        ORDER BY facet, items DESC, value
+    '''):
+        counts[facet].append((value, items))
+    return counts
+
+
+def search_items(conn, search_query, limit, filters=None, age=None):
+    """Returns up to `limit` library_items rows matching search_query, best first.
+
+    `filters` is a {facet: value} dict, as from selected_facets(); `age`
+    keeps only items open to a customer of that age.
+    """
+    c = conn.cursor()
+    match_query = build_match_query(search_query)
+    where, params = facet_where(filters or {}, age)
+    and_where = f'AND {where}' if where else ''
+
+    if fts5_available() and match_query:
+        try:
+            c.execute(
+                f"""
+                SELECT library_items.* FROM library_items_fts
+                JOIN library_items ON library_items.item_id = library_items_fts.rowid
+                WHERE library_items_fts MATCH ? {and_where}
+                ORDER BY bm25(library_items_fts, ?, ?, ?)
+                LIMIT ?
+                """,
+                [match_query] + params + [TITLE_WEIGHT, AUTHOR_WEIGHT, GENRE_WEIGHT, limit]
+            )
+            return c.fetchall()
+        except sqlite3.OperationalError:
+            # Database was created without the index; use the slow path
+            pass
+
+    pattern = f'%{search_query}%'
+    c.execute(
+        f"""
+        SELECT * FROM library_items
+        WHERE (title LIKE ? OR author LIKE ? OR genre LIKE ?) {and_where}
+        LIMIT ?
+        """,
+        [pattern, pattern, pattern] + params + [limit]
+    )
+    return c.fetchall()
+
+
+# -----------------------------------------------------
+# Spelling correction
+# -----------------------------------------------------
+def term_counts_sql(ref, source=None):
+    """SELECT of (term, titles or authors it is in) for the words of ref's title and author.
+
+    ref is a trigger's NEW or OLD, or the name `source` (a FROM item such as
+    "library_items AS item") gives the rows it ranges over. Splits as the
+    unicode61 tokenizer does for ASCII text: any ASCII character other than a
+    letter or digit ends a word. Words with other characters are left to
+    refresh_terms.
+    """
+    separators = ["'" + ch.replace("'", "''") + "'" for ch in string.punctuation]
+    separators += ['char(9)', 'char(10)', 'char(13)']
+
+    def split(text, separators):
+        """json_each over the pieces of text between separators and spaces.
+
+        Done in three passes below, as one expression nesting a replace()
+        per separator is deeper than SQLite's parser allows.
+        """
+        for separator in separators:
+            text = f"replace({text}, {separator}, ' ')"
+        return f"""json_each('[' || replace(json_quote({text}), ' ', '","') || ']')"""
+
+    third = len(separators) // 3 + 1
+    selects = [f'''
+        SELECT DISTINCT {ref}.item_id, word.value AS term
+        FROM {f'{source}, ' if source else ''}{split(f"lower({ref}.{column})", separators[:third])} AS piece,
+             {split('piece.value', separators[third:2 * third])} AS part,
+             {split('part.value', separators[2 * third:])} AS word
+        WHERE length(word.value) >= 3 AND word.value NOT GLOB '*[^a-z0-9]*'
+          AND word.value GLOB '*[^0-9]*'
+    ''' for column in ('title', 'author')]
+    return f"SELECT term, COUNT(*) AS docs FROM ({' UNION ALL '.join(selects)}) GROUP BY term"
+
+
+def add_terms(conn, first_item_id):
+    """Adds the words of titles from first_item_id on to search_terms.
+
+    Runs inside the caller's write transaction, after a bulk insert that
+    paused the triggers (see pause_terms), so only the new rows are read.
+    """
+    if not fts5_available():
+        return
+    source = "(SELECT item_id, title, author FROM library_items WHERE item_id >= :first) AS item"
+    conn.execute(f'''
+        INSERT INTO search_terms (term, docs) {term_counts_sql('item', source)}
+        ON CONFLICT (term) DO UPDATE SET docs = docs + excluded.docs
+    ''', {'first': first_item_id})
+
+
+def pause_terms(conn):
+    """Stops new titles' words reaching search_terms in this write transaction.
+
+    For bulk inserts, which call add_terms() (or refresh_terms()) once
+    afterwards instead of updating the terms row by row. Call resume_terms()
+    before committing.
+    """
+    set_watermark(conn, TERMS_PAUSED, 1)
+
+
+def resume_terms(conn):
+    conn.execute("DELETE FROM watermarks WHERE name = ?", (TERMS_PAUSED,))
+
+
+def refresh_terms(conn):
+    """Brings search_terms up to date with the words in titles and authors.
+
+    Triggers keep it current for plain ASCII words as titles change; this
+    catches up after bulk inserts and on words with other characters. Reads
+    the search index's own vocabulary, so a term is spelled exactly as the
+    index has it. Returns (terms added, terms removed); (0, 0) without FTS5,
+    where there is no spelling correction.
+    """
+    if not fts5_available():
+        return 0, 0
+
+    def refresh(conn):
+        conn.execute("DROP TABLE IF EXISTS temp.current_terms")
+        conn.execute('''
+            CREATE TEMP TABLE current_terms AS
+            SELECT term, SUM(doc) AS docs FROM library_items_terms
+            WHERE col IN ('title', 'author') AND length(term) >= 3 AND term GLOB '*[^0-9]*'
+            GROUP BY term
+        ''')
+        removed = conn.execute(
+            "DELETE FROM search_terms WHERE term NOT IN (SELECT term FROM current_terms)").rowcount
+        before = conn.execute("SELECT COUNT(*) FROM search_terms").fetchone()[0]
+        conn.execute('''
+            INSERT INTO search_terms (term, docs)
+            SELECT term, docs FROM current_terms WHERE true
+            ON CONFLICT (term) DO UPDATE SET docs = excluded.docs WHERE docs <> excluded.docs
+        ''')
+        added = conn.execute("SELECT COUNT(*) FROM search_terms").fetchone()[0] - before
+        conn.execute("DROP TABLE temp.current_terms")
+        return added, removed
+
+    return run_write(conn, refresh)
+
+
+def fold(word):
+    """Lowercases word and strips accents, as the unicode61 tokenizer does."""
+    return ''.join(ch for ch in unicodedata.normalize('NFKD', word.lower())
+                   if not unicodedata.combining(ch))
+
+
+def edit_distance(a, b):
+    """Insertions, deletions, substitutions and swaps of neighbours to turn a into b."""
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def one_edit_variants(word):
+    """Every string one deletion, swap, substitution or insertion away from word."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    variants = {a + b[1:] for a, b in splits if b}
+    variants.update(a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1)
+    variants.update(a + ch + b[1:] for a, b in splits if b for ch in LETTERS)
+    variants.update(a + ch + b for a, b in splits for ch in LETTERS)
+    variants.discard(word)
+    return variants
+
+
+def closest_term(conn, word):
+    """The indexed term fewest edits from word (then in the most titles), or None.
+
+    One edit away, every variant of word is looked up directly: a few hundred
+    primary key probes. Two edits away (for words of TWO_EDIT_LENGTH letters
+    or more), word is cut into MAX_EDITS + 1 pieces; an insertion, deletion
+    or substitution changes only one piece, so the term contains at least one
+    piece unchanged, and the trigram index finds the terms that do.
+    """
+    word = fold(word)
+    if len(word) < 3:
+        return None
+    variants = list(one_edit_variants(word))
+    found = conn.execute(
+        f"SELECT term, docs FROM search_terms WHERE term IN ({', '.join('?' * len(variants))})",
+        variants
+    ).fetchall()
+    if found:
+        return min(found, key=lambda row: (-row[1], row[0]))[0]
+    if len(word) < TWO_EDIT_LENGTH:
+        return None
+
+    size = len(word) / (MAX_EDITS + 1)
+    pieces = {word[round(i * size):round((i + 1) * size)] for i in range(MAX_EDITS + 1)}
+    best = None
+    for term, docs in conn.execute('''
+        SELECT t.term, t.docs FROM search_terms_trigrams
+        JOIN search_terms t ON t.term_id = search_terms_trigrams.rowid
+        WHERE search_terms_trigrams MATCH ? AND length(t.term) BETWEEN ? AND ?
+    ''', (' OR '.join(f'"{piece}"' for piece in pieces), len(word) - MAX_EDITS, len(word) + MAX_EDITS)):
+        distance = edit_distance(word, term)
+        if distance <= MAX_EDITS and (best is None or (distance, -docs, term) < best):
+            best = (distance, -docs, term)
+    return best[2] if best else None
+
+
+def correct_query(conn, search_query):
+    """search_query with each word that matches nothing replaced by its closest term.
+
+    Returns None when no word needed (or could be given) a correction. Meant
+    for when search_items() found nothing, so the common case costs nothing.
+    """
+    if not fts5_available():
+        return None
+    words = re.findall(r'\w+', search_query)
+    corrected = []
+    try:
+        for word in words:
+            # search_items matches words as prefixes
+            prefix = fold(word)
+            known = conn.execute(
+                "SELECT 1 FROM library_items_terms WHERE term >= ? AND term < ? LIMIT 1",
+                (prefix, prefix + '\U0010ffff')
+            ).fetchone()
+            corrected.append(word if known else closest_term(conn, word) or word)
+    except sqlite3.OperationalError:
+        return None  # no term index in this database
+    if corrected == words:
+        return None
+    return ' '.join(corrected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the catalog search indexes.')
+    parser.add_argument('--database', default='library.db')
+    parser.add_argument('--refresh-terms', action='store_true',
+                        help='add new title and author words to the spelling index')
+    parser.add_argument('--every', type=float, help='repeat every N seconds instead of exiting')
+    args = parser.parse_args()
+    if not args.refresh_terms:
+        parser.error('nothing to do (use --refresh-terms)')
+
+    conn = sqlite3.connect(args.database)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    while True:
+        start = time.perf_counter()
+        added, removed = refresh_terms(conn)
+        print(f"{added} terms added, {removed} removed in {time.perf_counter() - start:.1f}s")
+        if not args.every:
+            break
+        time.sleep(args.every)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
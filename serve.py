@@ -0,0 +1,177 @@
+# serve.py
+"""Production launcher: pre-forked worker processes sharing library.db.
+
+The app is loaded and the schema checked once, in the master process; the
+workers are then forked from it, so they start with everything imported and
+each opens its own database connections (see db.get_pool). SQLite's file
+locks and WAL keep the processes consistent with each other.
+
+Uses gunicorn when it is installed, and a small built-in pre-fork server
+otherwise (Unix only).
+
+    python serve.py --workers 4 --threads 8 --bind 127.0.0.1:8000
+    kill -HUP <master pid>    # graceful reload: new workers, old ones finish
+    kill -TERM <master pid>   # graceful stop
+
+Workers are forked from the preloaded master, so a reload only recycles
+them: it releases worker memory, but the new workers run the code and
+configuration the master started with. Changes to either need a restart.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+
+def parse_bind(bind):
+    host, _, port = bind.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def ready_message(args, started, schema_seconds):
+    return (f"Serving on http://{args.bind} with {args.workers} workers x {args.threads} threads "
+            f"(pid {os.getpid()}; schema check {schema_seconds * 1000:.0f} ms, "
+            f"ready {time.perf_counter() - started:.2f}s after launch)")
+
+
+def serve_gunicorn(app, args, started, schema_seconds):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', args.bind)
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            self.cfg.set('graceful_timeout', int(args.graceful_timeout))
+            self.cfg.set('when_ready', lambda server: print(ready_message(args, started, schema_seconds),
+                                                           flush=True))
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def _run_worker(app, sock):
+    """Serves requests on the shared listening socket until SIGTERM.
+
+    Werkzeug starts a thread per request; the connection pool (sized to
+    --threads) is what bounds how many touch the database at once.
+    """
+    from werkzeug.serving import make_server
+
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    # Let requests in flight finish when shutting down
+    server.daemon_threads = False
+    server.block_on_close = True
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # shutdown() waits for serve_forever to return, so not from its thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    server.serve_forever()
+    server.server_close()
+
+
+def serve_prefork(app, args, started, schema_seconds):
+    host, port = parse_bind(args.bind)
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+    workers = set()
+    pending = []  # signals received, handled by the loop below
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock)
+            finally:
+                os._exit(0)
+        workers.add(pid)
+
+    def retire(pids, timeout):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + timeout
+        while pids and time.monotonic() < deadline:
+            for pid in list(pids):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    pids.discard(pid)
+            time.sleep(0.05)
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: pending.append('reload'))
+    signal.signal(signal.SIGTERM, lambda signum, frame: pending.append('stop'))
+    signal.signal(signal.SIGINT, lambda signum, frame: pending.append('stop'))
+
+    for _ in range(args.workers):
+        spawn()
+    print(ready_message(args, started, schema_seconds), flush=True)
+
+    while True:
+        time.sleep(0.2)
+        action = pending.pop(0) if pending else None
+        if action == 'stop':
+            retire(workers, args.graceful_timeout)
+            return
+        if action == 'reload':
+            old = set(workers)
+            workers.clear()
+            for _ in range(args.workers):
+                spawn()
+            retire(old, args.graceful_timeout)
+            print(f"Reloaded: {args.workers} new workers", flush=True)
+            continue
+        # Replace workers that died
+        for pid in list(workers):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                workers.discard(pid)
+                print(f"Worker {pid} exited; starting a new one", flush=True)
+                spawn()
+
+
+def main():
+    started = time.perf_counter()
+    parser = argparse.ArgumentParser(description='Serve The Book Nook with pre-forked workers.')
+    parser.add_argument('--bind', default='127.0.0.1:8000')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--threads', type=int, default=8, help='request threads per worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='seconds a retiring worker gets to finish its requests')
+    parser.add_argument('--database', help='SQLite file (default library.db)')
+    parser.add_argument('--builtin', action='store_true', help='use the built-in server even if gunicorn is installed')
+    args = parser.parse_args()
+
+    from app import create_app
+
+    schema_started = time.perf_counter()
+    app = create_app({'DATABASE': args.database} if args.database else None)
+    # Each worker's thread count is its useful connection count
+    app.config['DB_POOL_SIZE'] = max(app.config['DB_POOL_SIZE'], args.threads)
+    schema_seconds = time.perf_counter() - schema_started
+
+    try:
+        import gunicorn  # noqa: F401
+        have_gunicorn = not args.builtin
+    except ImportError:
+        have_gunicorn = False
+    if have_gunicorn:
+        serve_gunicorn(app, args, started, schema_seconds)
+    elif hasattr(os, 'fork'):
+        serve_prefork(app, args, started, schema_seconds)
+    else:
+        sys.exit("Pre-forked workers need Unix; use `python asgi.py` or `python app.py` instead")
+
+
+if __name__ == '__main__':
+    main()
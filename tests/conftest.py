@@ -0,0 +1,47 @@
+# tests/conftest.py
+"""Fixtures giving each test its own library.db, built the way the app builds it."""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import populate  # noqa: E402
+from app import app as flask_app, create_app  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / 'library.db')
+
+
+@pytest.fixture
+def app(database, monkeypatch):
+    """The app set up on a fresh database with the sample data loaded."""
+    for name in ('db_pool', 'response_cache', 'count_cache'):
+        stale = flask_app.extensions.pop(name, None)
+        if name == 'db_pool' and stale is not None:
+            stale.close_all()
+    create_app({'DATABASE': database, 'TESTING': True})
+    monkeypatch.setattr(populate, 'DATABASE', database)
+    populate.populate_tables()
+    yield flask_app
+    pool = flask_app.extensions.pop('db_pool', None)
+    if pool is not None:
+        pool.close_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def conn(app, database):
+    conn = sqlite3.connect(database, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 5000")
+    yield conn
+    conn.close()
@@ -0,0 +1,56 @@
+# tests/test_asgi.py
+import asyncio
+
+import reporting
+from asgi import create_asgi_app
+from db import get_pool
+
+
+def request(application, method, path, query=b''):
+    """Sends one request through the ASGI app; returns (status, headers, body)."""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': [],
+             'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80),
+             'client': ('127.0.0.1', 50000), 'root_path': ''}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def run():
+        await application(scope, receive, send)
+        return messages
+    return run()
+
+
+def response(messages):
+    start = messages[0]
+    assert start['type'] == 'http.response.start'
+    assert not messages[-1].get('more_body')
+    return start['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_streamed_csv_report(app, conn):
+    conn.execute("INSERT INTO borrowing (item_id, customer_id, borrowed_date, due_date) "
+                 "VALUES (3, 2, '2025-03-01', '2025-03-15')")
+    conn.commit()
+    reporting.update_rollups(conn)
+    application = create_asgi_app(app)
+
+    async def fetch_all():
+        return await asyncio.gather(*(
+            request(application, 'GET', f'/reports/{name}.csv', b'from=2025-01-01&to=2025-12-31')
+            for name in sorted(reporting.REPORTS) for _ in range(4)))
+
+    try:
+        results = asyncio.run(fetch_all())
+    finally:
+        application.readers.shutdown(wait=True)
+        application.writers.shutdown(wait=True)
+    for messages in results:
+        status, body = response(messages)
+        assert status == 200
+        assert body.count(b'\n') >= 1
+    assert get_pool(app).stats()['in_use'] == 0
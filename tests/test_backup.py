@@ -0,0 +1,25 @@
+# tests/test_backup.py
+import sqlite3
+
+import pytest
+
+from backup import export, restore
+
+
+def addresses(conn):
+    return [tuple(row) for row in conn.execute("SELECT customer_id, address FROM customers ORDER BY customer_id")]
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_export_round_trips_text_that_looks_like_null(conn, tmp_path, fmt):
+    for customer_id, address in ((1, r'\N'), (2, '\\'), (3, r'\\N'), (4, None), (5, '')):
+        conn.execute("UPDATE customers SET address = ? WHERE customer_id = ?", (address, customer_id))
+    conn.commit()
+
+    export(conn, str(tmp_path / 'export'), fmt)
+    restored = str(tmp_path / 'restored.db')
+    restore(str(tmp_path / 'export'), restored)
+    copy = sqlite3.connect(restored)
+    assert addresses(copy) == addresses(conn)
+    assert addresses(copy)[:5] == [(1, r'\N'), (2, '\\'), (3, r'\\N'), (4, None), (5, '')]
+    copy.close()
@@ -0,0 +1,115 @@
+# tests/test_circulation.py
+import sqlite3
+import threading
+
+import pytest
+
+from circulation import AlreadyReturned, ItemUnavailable, borrow, return_loan
+
+COPIES = 3
+
+
+@pytest.fixture
+def item_id(conn):
+    """An item anyone may borrow, with COPIES copies on the shelf."""
+    item_id = conn.execute('''
+        SELECT item_id FROM library_items
+        WHERE available_copies = total_copies AND is_future_item = 0 AND restriction = 0 LIMIT 1
+    ''').fetchone()[0]
+    missing = COPIES - conn.execute("SELECT total_copies FROM library_items WHERE item_id = ?",
+                                    (item_id,)).fetchone()[0]
+    conn.executemany("INSERT INTO item_copies (item_id) VALUES (?)", [(item_id,)] * missing)
+    conn.commit()
+    return item_id
+
+
+@pytest.fixture
+def customers(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT customer_id FROM customers WHERE outstanding_fine_balance = 0 ORDER BY customer_id")]
+
+
+def concurrently(database, jobs):
+    """Runs every job(conn) at once, each on its own thread and connection.
+
+    Returns a list of (result, None) or (None, error), in job order.
+    """
+    results = [None] * len(jobs)
+    ready = threading.Barrier(len(jobs))
+
+    def run(index, job):
+        conn = sqlite3.connect(database)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        try:
+            ready.wait()
+            results[index] = (job(conn), None)
+        except Exception as e:
+            results[index] = (None, e)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=run, args=(i, job)) for i, job in enumerate(jobs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def assert_consistent(conn, item_id):
+    total, available, availability = conn.execute(
+        "SELECT total_copies, available_copies, availability FROM library_items WHERE item_id = ?",
+        (item_id,)).fetchone()
+    copies, on_shelf = conn.execute(
+        "SELECT COUNT(*), COUNT(*) FILTER (WHERE status = 'Available') FROM item_copies WHERE item_id = ?",
+        (item_id,)).fetchone()
+    open_loans, lent_copies = conn.execute('''
+        SELECT COUNT(*), COUNT(DISTINCT copy_id) FROM borrowing
+        WHERE item_id = ? AND returned_date IS NULL
+    ''', (item_id,)).fetchone()
+    assert (total, available) == (copies, on_shelf)
+    assert open_loans == lent_copies == copies - on_shelf
+    assert (availability == 'Available') == (on_shelf > 0)
+
+
+def test_concurrent_borrows_lend_each_copy_once(database, conn, item_id, customers):
+    jobs = [lambda c, customer=customer: borrow(c, item_id, customer, '2025-06-01')
+            for customer in customers]
+    results = concurrently(database, jobs)
+
+    lent = [result for result, error in results if error is None]
+    assert len(lent) == COPIES
+    assert all(isinstance(error, ItemUnavailable) for result, error in results if error is not None)
+    assert_consistent(conn, item_id)
+
+    # Returning each loan twice at once: one return per loan goes through
+    jobs = [lambda c, transaction_id=transaction_id: return_loan(c, transaction_id, '2025-06-05')
+            for transaction_id, _ in lent for _ in range(2)]
+    errors = [error for _, error in concurrently(database, jobs)]
+    assert sum(error is None for error in errors) == COPIES
+    assert all(isinstance(error, AlreadyReturned) for error in errors if error is not None)
+    assert_consistent(conn, item_id)
+    assert conn.execute("SELECT available_copies FROM library_items WHERE item_id = ?",
+                        (item_id,)).fetchone()[0] == COPIES
+
+
+def test_mixed_borrow_and_return(database, conn, item_id, customers):
+    def borrow_and_return(conn, customer):
+        lent = 0
+        for _ in range(20):
+            try:
+                transaction_id, _ = borrow(conn, item_id, customer, '2025-06-01')
+            except ItemUnavailable:
+                continue
+            return_loan(conn, transaction_id, '2025-06-02')
+            lent += 1
+        return lent
+
+    results = concurrently(database, [lambda c, customer=customer: borrow_and_return(c, customer)
+                                      for customer in customers])
+    assert [error for _, error in results if error is not None] == []
+    lent = sum(result for result, _ in results)
+    assert lent > 0
+    assert conn.execute("SELECT COUNT(*) FROM borrowing WHERE item_id = ? AND borrowed_date = '2025-06-01'",
+                        (item_id,)).fetchone()[0] == lent
+    assert_consistent(conn, item_id)
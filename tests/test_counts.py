@@ -0,0 +1,45 @@
+# tests/test_counts.py
+import re
+import sqlite3
+import threading
+
+from app import cached_count, get_count_cache
+
+
+def shown_total(client):
+    return int(re.search(rb'(\d+) items</span>', client.get('/items').data).group(1))
+
+
+def test_total_follows_writes_from_any_connection(client, database):
+    before = shown_total(client)
+    client.post('/donate', data={'title': 'Middlemarch', 'author': 'George Eliot', 'item_type': 'Book'})
+    assert shown_total(client) == before + 1
+
+    # A script writing through its own connection bumps the same counter
+    conn = sqlite3.connect(database)
+    conn.execute("DELETE FROM library_items WHERE title = 'Middlemarch'")
+    conn.commit()
+    conn.close()
+    assert shown_total(client) == before
+
+
+def test_count_cache_is_bounded_under_concurrent_use(app, conn):
+    app.config['COUNT_CACHE_SIZE'] = 16
+    app.extensions.pop('count_cache', None)
+    errors = []
+
+    def count_pages(offset):
+        try:
+            with app.app_context():
+                for below in range(offset, offset + 50):
+                    assert cached_count(conn, 'library_items', 'item_id > ?', (-below,)) == 10
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=count_pages, args=(i * 50,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert get_count_cache().stats()['entries'] == 16
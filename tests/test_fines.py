@@ -0,0 +1,73 @@
+# tests/test_fines.py
+import pytest
+
+from circulation import borrow, return_loan
+from fines import assess_overdue_fines
+
+
+@pytest.fixture
+def loan(conn):
+    """Customer 1 borrows an item on 2025-01-01; fines start after 2025-01-16."""
+    item_id = conn.execute('''
+        SELECT item_id FROM library_items
+        WHERE available_copies > 0 AND is_future_item = 0 AND restriction = 0 LIMIT 1
+    ''').fetchone()[0]
+    transaction_id, _ = borrow(conn, item_id, 1, '2025-01-01')
+    return transaction_id
+
+
+def fines_of(conn, transaction_id):
+    return [tuple(row) for row in conn.execute(
+        "SELECT amount_of_fine, fine_status FROM fines WHERE transaction_id = ? ORDER BY fine_id",
+        (transaction_id,))]
+
+
+def balance(conn):
+    return conn.execute("SELECT outstanding_fine_balance FROM customers WHERE customer_id = 1").fetchone()[0]
+
+
+def pay(conn, transaction_id):
+    conn.execute("UPDATE fines SET fine_status = 'Paid' WHERE transaction_id = ?", (transaction_id,))
+    conn.commit()
+
+
+def test_fine_paid_while_out_is_topped_up(conn, loan):
+    assess_overdue_fines(conn, '2025-02-01')
+    assert fines_of(conn, loan) == [(16.0, 'Unpaid')]
+    pay(conn, loan)
+
+    assess_overdue_fines(conn, '2025-02-10')
+    assert fines_of(conn, loan) == [(16.0, 'Paid'), (9.0, 'Unpaid')]
+    assess_overdue_fines(conn, '2025-02-20')
+    assert fines_of(conn, loan) == [(16.0, 'Paid'), (19.0, 'Unpaid')]
+
+    amount, _ = return_loan(conn, loan, '2025-03-18')
+    assert amount == 61.0
+    assert fines_of(conn, loan) == [(16.0, 'Paid'), (45.0, 'Unpaid')]
+    assert balance(conn) == 45.0
+
+
+def test_return_after_paying_everything_accrued(conn, loan):
+    assess_overdue_fines(conn, '2025-02-01')
+    pay(conn, loan)
+    amount, _ = return_loan(conn, loan, '2025-03-18')
+    assert amount == 61.0
+    assert fines_of(conn, loan) == [(16.0, 'Paid'), (45.0, 'Unpaid')]
+    assert balance(conn) == 45.0
+
+
+def test_paid_fine_is_not_charged_again(conn, loan):
+    assess_overdue_fines(conn, '2025-02-01')
+    pay(conn, loan)
+    assess_overdue_fines(conn, '2025-02-01')
+    # Returned earlier than the batch job assumed: what was paid stands
+    amount, _ = return_loan(conn, loan, '2025-01-20')
+    assert amount == 16.0
+    assert fines_of(conn, loan) == [(16.0, 'Paid')]
+    assert balance(conn) == 0.0
+
+
+def test_return_page_shows_the_fine(client, loan):
+    page = client.post('/return', data={'transaction_id': loan, 'returned_date': '2025-02-01'},
+                       follow_redirects=True)
+    assert b'A fine of $16.00' in page.data
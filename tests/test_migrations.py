@@ -0,0 +1,77 @@
+# tests/test_migrations.py
+import io
+import sqlite3
+
+import populate
+import search
+from app import create_app
+from bulk_import import import_items
+from migrations import latest_version, migrate
+
+SEARCH_OBJECTS = ('library_items_fts', 'library_items_fts_insert', 'library_items_terms',
+                  'search_terms_trigrams', 'search_terms_insert')
+
+
+def schema_names(conn):
+    return {name for name, in conn.execute("SELECT name FROM sqlite_master")}
+
+
+def test_upgrade_creates_search_index(app, database):
+    # A database from before the search migrations, as `python migrations.py`
+    # finds it
+    conn = sqlite3.connect(database)
+    for trigger in ('library_items_fts_insert', 'library_items_fts_delete', 'library_items_fts_update',
+                    'search_terms_insert', 'search_terms_delete'):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    for table in ('library_items_terms', 'search_terms_trigrams', 'library_items_fts'):
+        conn.execute(f"DROP TABLE {table}")
+    for trigger in ('search_terms_item_insert', 'search_terms_item_delete', 'search_terms_item_update'):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE search_terms")
+    conn.execute("PRAGMA user_version = 13")
+    conn.commit()
+
+    assert migrate(conn) == latest_version()
+    assert set(SEARCH_OBJECTS) <= schema_names(conn)
+    assert conn.execute(
+        "SELECT rowid FROM library_items_fts WHERE library_items_fts MATCH 'gatsby'").fetchall()
+    assert conn.execute("SELECT docs FROM search_terms WHERE term = 'gatsby'").fetchone() == (1,)
+    conn.close()
+
+
+def test_startup_sets_journal_mode_on_migrated_database(app, database):
+    # e.g. a file built by backup.py restore, already at the latest version
+    conn = sqlite3.connect(database)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+    create_app()
+    conn = sqlite3.connect(database)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    conn.close()
+
+
+def test_schema_without_fts5(app, tmp_path, monkeypatch):
+    # As on a SQLite build without FTS5: catalog search falls back to LIKE
+    monkeypatch.setattr(search, '_fts5_supported', False)
+    database = str(tmp_path / 'no_fts5.db')
+    monkeypatch.setitem(app.config, 'DATABASE', database)
+    monkeypatch.setattr(populate, 'DATABASE', database)
+    create_app()
+    populate.populate_tables()
+
+    conn = sqlite3.connect(database)
+    assert migrate(conn) == latest_version()
+    assert not set(SEARCH_OBJECTS) & schema_names(conn)
+    assert not {'search_terms_item_insert', 'library_items_fts_delete'} & schema_names(conn)
+    report = import_items(conn, io.StringIO("title,author\nMiddlemarch,George Eliot\n"), 'csv')
+    assert report.rows_imported == 1
+    assert search.refresh_terms(conn) == (0, 0)
+    assert search.correct_query(conn, 'gatsbby') is None
+    conn.close()
+
+    client = app.test_client()
+    assert b'Middlemarch' in client.get('/items?q=middlemarch').data
+    assert client.get('/items?q=gatsbby').status_code == 200
+    client.post('/donate', data={'title': 'Bleak House', 'author': 'Charles Dickens', 'item_type': 'Book'})
+    assert b'Bleak House' in client.get('/items?q=bleak').data
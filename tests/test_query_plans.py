@@ -0,0 +1,112 @@
+# tests/test_query_plans.py
+"""The hot queries must keep using their indexes as the schema changes."""
+import pytest
+
+from bulk_import import FIND_TITLE_SQL
+from search import facet_where
+
+# (description, query, parameters, index the planner is expected to use)
+PLANNED_QUERIES = [
+    ('loans of an item',
+     "SELECT * FROM borrowing WHERE item_id = ?", (1,), 'idx_borrowing_item'),
+    ('customer loan history',
+     "SELECT * FROM borrowing WHERE customer_id = ? ORDER BY borrowed_date DESC", (1,),
+     'idx_borrowing_customer'),
+    ('open loan of an item',
+     "SELECT * FROM borrowing WHERE item_id = ? AND returned_date IS NULL", (1,),
+     'idx_borrowing_open_item'),
+    ('overdue loans',
+     "SELECT * FROM borrowing WHERE returned_date IS NULL AND due_date < ?", ('2025-01-01',),
+     'idx_borrowing_open_due'),
+    ('customer open loans',
+     "SELECT * FROM borrowing WHERE customer_id = ? AND returned_date IS NULL", (1,),
+     'idx_borrowing_open_customer'),
+    ('overdue open loans to fine',
+     "SELECT transaction_id FROM borrowing WHERE returned_date IS NULL AND borrowed_date < ? "
+     "ORDER BY borrowed_date, transaction_id", ('2025-01-01',), 'idx_borrowing_open_borrowed'),
+    ('fines of a loan',
+     "SELECT * FROM fines WHERE transaction_id = ?", (1,), 'idx_fines_transaction'),
+    ('customer unpaid fines',
+     "SELECT * FROM fines WHERE customer_id = ? AND fine_status = 'Unpaid'", (1,),
+     'idx_fines_unpaid_customer'),
+    ('event registrations',
+     "SELECT * FROM register WHERE event_id = ?", (1,), 'idx_register_event_customer'),
+    ('customer already registered',
+     "SELECT 1 FROM register WHERE event_id = ? AND customer_id = ?", (1, 1),
+     'idx_register_event_customer'),
+    ('upcoming events by date',
+     "SELECT * FROM upcoming_events WHERE (datetime, event_id) > (?, ?) "
+     "ORDER BY datetime, event_id LIMIT 25", ('2025-01-01 00:00', 0), 'idx_events_datetime'),
+    ('event waitlist in order',
+     "SELECT * FROM event_waitlist WHERE event_id = ? ORDER BY waitlist_id", (1,),
+     'idx_waitlist_event'),
+    ('customer registrations',
+     "SELECT * FROM register WHERE customer_id = ?", (1,), 'idx_register_customer'),
+    ('customer loan history page',
+     "SELECT * FROM borrowing WHERE customer_id = ? AND (borrowed_date, transaction_id) < (?, ?) "
+     "ORDER BY borrowed_date DESC, transaction_id DESC LIMIT 25", (1, '2025-01-01', 0),
+     'idx_borrowing_customer'),
+    ('available copy of an item',
+     "SELECT copy_id FROM item_copies WHERE item_id = ? AND status = 'Available' LIMIT 1", (1,),
+     'idx_copies_item_status'),
+    ('existing title for a donation or import',
+     FIND_TITLE_SQL, ('1984', 'George Orwell', 'Book', 'Print', 'Dystopian', '1949-06-08', 0, 0),
+     'idx_items_title_author'),
+    ('next hold for an item',
+     "SELECT hold_id FROM item_holds WHERE item_id = ? AND status = 'Waiting' "
+     "ORDER BY hold_id LIMIT 1", (1,), 'idx_holds_queue'),
+    ('expired holds awaiting pickup',
+     "SELECT hold_id FROM item_holds WHERE status = 'Ready' AND ready_until < ?", ('2025-01-01',),
+     'idx_holds_ready'),
+    ('customer waitlist entries',
+     "SELECT * FROM event_waitlist WHERE customer_id = ?", (1,), 'idx_waitlist_customer'),
+    ('neighbors of an item',
+     "SELECT neighbor_id FROM item_neighbors WHERE item_id = ? ORDER BY rank", (1,),
+     'PRIMARY KEY'),
+    ('most borrowed items',
+     "SELECT item_id FROM item_popularity ORDER BY loans DESC", (), 'idx_popularity_loans'),
+    ('circulation rollup for a date range',
+     "SELECT * FROM daily_circulation WHERE day BETWEEN ? AND ?", ('2025-01-01', '2025-01-31'),
+     'PRIMARY KEY'),
+    ('logged changes to a counted loan',
+     "DELETE FROM circulation_changes WHERE transaction_id > ? AND transaction_id <= ?", (0, 100),
+     'idx_circulation_changes_loan'),
+    ('items filtered by genre and type',
+     "SELECT * FROM library_items WHERE genre = ? AND item_type = ? AND item_id > ? "
+     "ORDER BY item_id LIMIT 25", ('Fiction', 'Book', 0), 'idx_items_genre_type'),
+    ('items filtered by type and format',
+     "SELECT * FROM library_items WHERE item_type = ? AND format = ? AND item_id > ? "
+     "ORDER BY item_id LIMIT 25", ('Book', 'Audio', 0), 'idx_items_type_format'),
+    ('items filtered by availability',
+     "SELECT * FROM library_items WHERE availability = ? AND item_id > ? ORDER BY item_id LIMIT 25",
+     ('Borrowed', 0), 'idx_items_availability'),
+    ('facet counts',
+     "SELECT value, items FROM item_facets WHERE facet = ?", ('genre',), 'PRIMARY KEY'),
+    ('spelling index term',
+     "SELECT docs FROM search_terms WHERE term = ?", ('tolkien',), 'sqlite_autoindex_search_terms_1'),
+    ('items open to a customer of an age',
+     f"SELECT * FROM library_items WHERE {facet_where({}, 12)[0]} AND item_id > ? ORDER BY item_id LIMIT 25",
+     (12, 0), 'idx_items_restriction_item'),
+    ('items open to a customer of an age, previous page',
+     f"SELECT * FROM library_items WHERE {facet_where({}, 12)[0]} AND item_id < ? ORDER BY item_id DESC LIMIT 25",
+     (12, 100), 'idx_items_restriction_item'),
+    ('customer ages due a refresh',
+     "SELECT customer_id FROM customer_eligibility WHERE age_until <= ?", ('2025-01-01',),
+     'idx_eligibility_age_until'),
+    ('event staff',
+     "SELECT * FROM manage WHERE event_id = ?", (1,), 'idx_manage_event'),
+    ('staff events',
+     "SELECT * FROM manage WHERE employee_id = ?", (1,), 'idx_manage_employee'),
+]
+
+
+def query_plan(conn, query, params=()):
+    """Returns the EXPLAIN QUERY PLAN detail lines for query."""
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+@pytest.mark.parametrize('description, query, params, index', PLANNED_QUERIES,
+                         ids=[query[0] for query in PLANNED_QUERIES])
+def test_query_uses_index(conn, description, query, params, index):
+    plan = query_plan(conn, query, params)
+    assert any(index in line for line in plan), f"{description}: {'; '.join(plan)}"
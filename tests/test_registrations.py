@@ -0,0 +1,77 @@
+# tests/test_registrations.py
+import json
+import threading
+import urllib.error
+import urllib.request
+
+from werkzeug.serving import make_server
+
+from db import get_pool
+
+CAPACITY = 5
+CLIENTS = 32
+
+
+def post_json(url, body):
+    request = urllib.request.Request(url, json.dumps(body).encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.status, json.load(response)
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.status, response.read()
+
+
+def test_event_opening_over_http(app, conn, monkeypatch):
+    """Concurrent clients register (and browse) through the threaded server and pool."""
+    event_id = conn.execute(
+        "INSERT INTO events (event_name, event_type, datetime, capacity) "
+        "VALUES ('Author talk', 'Workshop', '2030-01-01 10:00', ?)", (CAPACITY,)).lastrowid
+    conn.executemany(
+        "INSERT INTO customers (name, email, dob, outstanding_fine_balance) VALUES (?, ?, '1980-01-01', 0)",
+        [(f'Reader {i}', f'reader{i}@example.com') for i in range(CLIENTS)])
+    conn.commit()
+    customers = [row[0] for row in conn.execute(
+        "SELECT customer_id FROM customers ORDER BY customer_id DESC LIMIT ?", (CLIENTS,))]
+
+    # Fewer pooled connections than clients, so requests queue for them
+    monkeypatch.setitem(app.config, 'DB_POOL_SIZE', 4)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    serving = threading.Thread(target=server.serve_forever)
+    serving.start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    results, failures = [], []
+    ready = threading.Barrier(CLIENTS)
+
+    def client(customer_id):
+        try:
+            ready.wait()
+            results.append(post_json(f'{base}/api/v1/events/{event_id}/registrations',
+                                     {'customer_id': customer_id}))
+            for path in (f'/api/v1/events/{event_id}/seats', '/events', '/reports/genre.csv'):
+                assert get(base + path)[0] == 200
+        except (AssertionError, OSError, urllib.error.HTTPError) as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=client, args=(customer_id,)) for customer_id in customers]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.shutdown()
+        serving.join()
+        server.server_close()
+
+    assert failures == []
+    assert sorted(status for status, _ in results) == [200] * (CLIENTS - CAPACITY) + [201] * CAPACITY
+    positions = sorted(body['waitlist_position'] for status, body in results if status == 200)
+    assert positions == list(range(1, CLIENTS - CAPACITY + 1))
+    assert conn.execute("SELECT registered_count FROM events WHERE event_id = ?",
+                        (event_id,)).fetchone()[0] == CAPACITY
+    assert conn.execute("SELECT COUNT(*) FROM register WHERE event_id = ?", (event_id,)).fetchone()[0] == CAPACITY
+    assert get_pool(app).stats()['in_use'] == 0
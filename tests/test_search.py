@@ -0,0 +1,79 @@
+# tests/test_search.py
+import io
+
+from bulk_import import import_items
+from search import facet_where
+
+VOCABULARY = '''
+    SELECT term, SUM(doc) FROM library_items_terms
+    WHERE col IN ('title', 'author') AND length(term) >= 3 AND term GLOB '*[^0-9]*'
+    GROUP BY term
+'''
+
+
+def kept_terms(conn):
+    return dict(conn.execute("SELECT term, docs FROM search_terms").fetchall())
+
+
+def test_misspelled_search_finds_sample_items(client):
+    for query in ('tolkein', 'hobit', 'gatsbby'):
+        page = client.get(f'/items?q={query}')
+        assert page.status_code == 200
+        assert b'The Hobbit' in page.data or b'Gatsby' in page.data, query
+
+
+def test_donation_reaches_spelling_index(client):
+    client.post('/donate', data={'title': 'Wuthering Heights', 'author': 'Emily Bronte',
+                                 'item_type': 'Book', 'format': 'Print', 'genre': 'Fiction',
+                                 'published_date': '1847-12-01'})
+    assert b'Wuthering Heights' in client.get('/items?q=wutherin').data
+
+
+def test_triggers_keep_terms_matching_the_search_index(conn):
+    assert kept_terms(conn) == dict(conn.execute(VOCABULARY).fetchall())
+
+    conn.execute('''
+        INSERT INTO library_items (title, author, item_type, availability, is_future_item, restriction)
+        VALUES ('The Hobbit: There and Back Again (Illustrated)', 'J.R.R. Tolkien', 'Book', 'Available', 0, 0),
+               ('Tab\tand  double--dash 1999 abc123', NULL, 'Book', 'Available', 0, 0)
+    ''')
+    conn.execute("UPDATE library_items SET title = 'Nineteen Eighty-Four' WHERE title = '1984'")
+    conn.execute("UPDATE library_items SET availability = 'Borrowed' WHERE title = 'The Great Gatsby'")
+    conn.execute("DELETE FROM library_items WHERE title = 'To Kill a Mockingbird'")
+    conn.commit()
+
+    terms = kept_terms(conn)
+    assert terms == dict(conn.execute(VOCABULARY).fetchall())
+    assert terms['tolkien'] == 2 and 'mockingbird' not in terms and 'abc123' in terms
+
+
+def test_age_filter_keeps_the_items_an_age_allows(conn):
+    conn.execute("UPDATE library_items SET restriction = 16 WHERE item_id IN (2, 5)")
+    conn.execute("UPDATE library_items SET restriction = 12 WHERE item_id = 7")
+    conn.commit()
+    for age in (0, 12, 15, 16, 99):
+        where, params = facet_where({}, age)
+        kept = [row[0] for row in conn.execute(
+            f"SELECT item_id FROM library_items WHERE {where} ORDER BY item_id", params)]
+        assert kept == [row[0] for row in conn.execute(
+            "SELECT item_id FROM library_items WHERE restriction <= ? ORDER BY item_id", (age,))], age
+
+
+def test_import_adds_only_the_new_titles_words(conn):
+    # A count only a full rebuild would put right
+    conn.execute("UPDATE search_terms SET docs = 99 WHERE term = 'gatsby'")
+    conn.commit()
+    rows = ("title,author\n"
+            "The Hobbit,J.R.R. Tolkien\n"
+            "Middlemarch,George Eliot\n"
+            "Middlemarch,George Eliot\n")
+    for defer_indexes in (False, True):
+        import_items(conn, io.StringIO(rows), 'csv', chunk_size=2, defer_indexes=defer_indexes)
+
+    terms = kept_terms(conn)
+    assert terms['gatsby'] == 99
+    del terms['gatsby']
+    vocabulary = dict(conn.execute(VOCABULARY).fetchall())
+    del vocabulary['gatsby']
+    assert terms == vocabulary
+    assert terms['tolkien'] == 2 and terms['middlemarch'] == 1